@@ -1,22 +1,77 @@
+import sys
 from pathlib import Path
 
 import pandas as pd
-import plotly.express as px
 import streamlit as st
 
+# streamlit puts app/ on the path; data_views also reads with pipelines/arrow_io
+sys.path.append(str(Path(__file__).resolve().parent.parent / "pipelines"))
+from data_views import (  # noqa: E402
+    arrow_year_slice,
+    arrow_years,
+    top_bottom,
+    year_slices,
+)
+
 st.set_page_config(page_title="SDG4 Inequity Map", layout="wide")
 
-DATA = Path("data/public/inequity_index.parquet")
+# Memory-mapped Arrow export when there is one (all app processes share it
+# through the page cache), else the Parquet export decoded per process
+ARROW = Path("data/public/arrow/inequity_index.arrow")
+PARQUET = Path("data/public/parquet/inequity_index.parquet")
+DATA = ARROW if ARROW.exists() else PARQUET
 if not DATA.exists():
-    st.error("inequity_index.parquet not found. Run pipelines/build_index.py first.")
+    st.error("No index export found. Run pipelines/run.py (or its export step).")
     st.stop()
 
-df = pd.read_parquet(DATA).copy()
-# Clean: drop rows w/ missing iso3 or index
-df = df.dropna(subset=["country_iso3", "inequity_index"])
-df["year"] = pd.to_numeric(df["year"], errors="coerce")
-df = df.dropna(subset=["year"]).astype({"year": int})
-years = sorted(df["year"].unique())
+
+# Streamlit reruns this script on every interaction, so everything derived from
+# the parquet is cached: once per file version (keyed on mtime, so a pipeline
+# rewrite invalidates it) and shared by all sessions. Cached objects are
+# read-only from here on.
+@st.cache_resource(max_entries=2)
+def load_year_slices(path: str, mtime_ns: int) -> dict[int, pd.DataFrame]:
+    """Cleaned index split per year, each slice sorted by inequity_index (desc)."""
+    return year_slices(path)
+
+
+@st.cache_resource(max_entries=64)
+def year_view(path: str, mtime_ns: int, year: int):
+    """Choropleth plus top/bottom 10 tables for one year."""
+    import plotly.express as px  # ~1s to import; only needed once there is data
+
+    if path.endswith(".arrow"):
+        d = arrow_year_slice(path, year)
+    else:
+        d = load_year_slices(path, mtime_ns)[year]
+
+    # Choropleth (ISO3-based)
+    fig = px.choropleth(
+        d,
+        locations="country_iso3",
+        color="inequity_index",
+        hover_name="country_name",
+        color_continuous_scale="Viridis",
+        range_color=(0, 1),
+        title=f"Inequity Index by Country — {year}",
+    )
+    fig.update_geos(
+        showcountries=True,
+        showcoastlines=False,
+        showframe=False,
+        projection_type="natural earth",
+    )
+    fig.update_layout(margin=dict(l=0, r=0, t=60, b=0))
+
+    top, bottom = top_bottom(d)
+    return fig, top, bottom
+
+
+mtime_ns = DATA.stat().st_mtime_ns
+if DATA == ARROW:
+    years = arrow_years(str(DATA))
+else:
+    years = sorted(load_year_slices(str(DATA), mtime_ns))
 default_year = max([y for y in years if 2015 <= y <= 2024] or years)
 
 st.title("Mapping Global Education Inequity (SDG 4)")
@@ -33,43 +88,19 @@ with col_b:
         """
     )
 
-# Filter by year
-d = df[df["year"] == year].copy()
-
-# Choropleth (ISO3-based)
-fig = px.choropleth(
-    d,
-    locations="country_iso3",
-    color="inequity_index",
-    hover_name="country_name",
-    color_continuous_scale="Viridis",
-    range_color=(0, 1),
-    title=f"Inequity Index by Country — {year}",
-)
-fig.update_geos(
-    showcountries=True,
-    showcoastlines=False,
-    showframe=False,
-    projection_type="natural earth",
-)
-fig.update_layout(margin=dict(l=0, r=0, t=60, b=0))
+fig, top, bottom = year_view(str(DATA), mtime_ns, year)
 
 with col_a:
     st.plotly_chart(fig, use_container_width=True)
 
 # Top / bottom tables
-d_sorted = d.sort_values("inequity_index", ascending=False)
 left, right = st.columns(2)
 with left:
     st.subheader("Top 10 (more equitable)")
-    st.dataframe(
-        d_sorted.head(10)[["country_name", "inequity_index"]].reset_index(drop=True)
-    )
+    st.dataframe(top)
 with right:
     st.subheader("Bottom 10 (less equitable)")
-    st.dataframe(
-        d_sorted.tail(10)[["country_name", "inequity_index"]].reset_index(drop=True)
-    )
+    st.dataframe(bottom)
 
 st.caption(
     "Prototype index. Data coverage varies by country and year; see docs/coverage_by_country_year.csv."
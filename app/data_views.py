@@ -0,0 +1,64 @@
+# app/data_views.py
+"""Data shaping behind the app, kept free of Streamlit so it can be reused
+(and benchmarked) outside a script run.
+
+Reads the public exports of the index (export_for_tableau), the Arrow ones
+with arrow_io, the module that writes them: pipelines/ must be on the path.
+"""
+import arrow_io
+import pandas as pd
+
+# decimals the index is shown with: those of the public exports (export_for_tableau)
+DECIMALS = 3
+
+# Tableau names of the exported index (Parquet and Arrow) -> the names used here
+EXPORT_RENAME = {
+    "ISO3": "country_iso3",
+    "Country": "country_name",
+    "Year": "year",
+    "InequityIndex": "inequity_index",
+}
+
+
+def year_slices(path: str) -> dict[int, pd.DataFrame]:
+    """Cleaned index split per year, each slice sorted by inequity_index (desc).
+
+    path is the Parquet export of the index (data/public/parquet).
+    """
+    df = pd.read_parquet(path, columns=list(EXPORT_RENAME))
+    df = df.rename(columns=EXPORT_RENAME)
+    # Clean: drop rows w/ missing iso3 or index
+    df = df.dropna(subset=["country_iso3", "inequity_index"])
+    df["year"] = pd.to_numeric(df["year"], errors="coerce")
+    df = df.dropna(subset=["year"]).astype({"year": int})
+    df["inequity_index"] = df["inequity_index"].round(DECIMALS)
+    df = df.sort_values(
+        ["year", "inequity_index"], ascending=[True, False], kind="stable"
+    )
+    return {int(y): d.reset_index(drop=True) for y, d in df.groupby("year")}
+
+
+def arrow_years(path: str) -> list[int]:
+    """Years present in a year-indexed Arrow export of the index."""
+    return sorted(arrow_io.open_year_indexed(path).years)
+
+
+def arrow_year_slice(path: str, year: int) -> pd.DataFrame:
+    """One year of the index from the Arrow export, sorted by inequity_index (desc).
+
+    Only that year's rows are converted to pandas; the rest is never read.
+    """
+    table = arrow_io.open_year_indexed(path).year(year)
+    d = table.to_pandas().rename(columns=EXPORT_RENAME)
+    d = d.dropna(subset=["country_iso3", "inequity_index"])
+    d = d.astype({"year": int})
+    d = d.sort_values("inequity_index", ascending=False, kind="stable")
+    return d.reset_index(drop=True)
+
+
+def top_bottom(d: pd.DataFrame, n: int = 10) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Top and bottom n rows of a sorted year slice."""
+    cols = ["country_name", "inequity_index"]
+    top = d.head(n)[cols].reset_index(drop=True)
+    bottom = d.tail(n)[cols].reset_index(drop=True)
+    return top, bottom
@@ -0,0 +1,279 @@
+# benchmarks/bench.py
+"""Time and memory-profile every pipeline stage on synthetic data.
+
+For each scale a fresh working directory is filled by synth.write_raw and the
+stages run in pipeline order against it (so each stage sees the previous
+one's outputs): the tidy functions on every raw layout, the UIS bulk-export
+reader, harmonize, gap-filling, the coverage cube, build_index,
+check_coverage, the Tableau export and the app's year-slice data paths
+(Parquet, and memory-mapped Arrow). Wall and CPU
+time are the best of --repeat runs; peak_mb is the tracemalloc peak of one
+extra run (Python and numpy allocations; Arrow buffers and harmonize's worker
+processes are not seen).
+
+    python benchmarks/bench.py --scales small medium --out benchmarks/baseline.json
+    python benchmarks/bench.py --scales small medium --compare benchmarks/baseline.json
+
+With --compare the run exits 1 if a stage got slower than the baseline by more
+than --tolerance (and by more than MIN_DELTA seconds, to ignore noise).
+Nothing here touches the network.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+HERE = Path(__file__).resolve().parent
+sys.path[:0] = [str(HERE.parent / "pipelines"), str(HERE.parent / "app")]
+
+import build_index  # noqa: E402
+import check_coverage  # noqa: E402
+import coverage_cube  # noqa: E402
+import excel_cache  # noqa: E402
+import export_for_tableau  # noqa: E402
+import gapfill  # noqa: E402
+import harmonize  # noqa: E402
+import uis_bulk as bulk  # noqa: E402
+from data_views import (  # noqa: E402
+    arrow_year_slice,
+    arrow_years,
+    top_bottom,
+    year_slices,
+)
+from synth import (  # noqa: E402
+    SCALES,
+    UIS_INDICATORS,
+    WB_CODE,
+    Scale,
+    uis_bulk,
+    write_raw,
+)
+from tidy_unesco import tidy_unesco_file  # noqa: E402
+
+MIN_DELTA = 0.05  # seconds; smaller slowdowns are treated as noise
+
+
+def uis_bulk_stream(path: Path) -> int:
+    """The bulk reader's streaming pass (into a staging directory)."""
+    staging = Path("data/interim/.bench_uis")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    indicators = [bulk.Indicator(i, i, "percent") for i in UIS_INDICATORS]
+    return sum(bulk.stream(path, staging, indicators).values())
+
+
+def stages(raw: Path) -> list[tuple[str, Callable[[], None], Callable[[], int]]]:
+    """(name, setup, run) per stage; run returns the number of rows produced."""
+    unesco = raw / "unesco"
+    wb_zips = sorted(raw.glob("wb_*.zip"))
+    xlsx = sorted(unesco.glob("*.xlsx"))
+
+    def tidy_wb(fn):
+        return lambda: sum(len(fn(p, p.stem[3:], "percent")) for p in wb_zips)
+
+    def tidy(path):
+        return lambda: len(tidy_unesco_file(path, path.stem, "percent"))
+
+    def clear_excel_cache():
+        shutil.rmtree(excel_cache.CACHE_DIR, ignore_errors=True)
+
+    def app_data_path():
+        index = export_for_tableau.PARQUET_OUT / "inequity_index.parquet"
+        rows = 0
+        for d in year_slices(str(index)).values():
+            top_bottom(d)
+            rows += len(d)
+        return rows
+
+    def app_arrow_path():
+        path = str(export_for_tableau.ARROW_OUT / "inequity_index.arrow")
+        rows = 0
+        for y in arrow_years(path):
+            d = arrow_year_slice(path, y)
+            top_bottom(d)
+            rows += len(d)
+        return rows
+
+    def nothing():
+        pass
+
+    out = [
+        ("tidy_wb_zip", nothing, tidy_wb(harmonize.tidy_wb_zip)),
+        ("tidy_wb_zip_arrow", nothing, tidy_wb(harmonize.tidy_wb_zip_arrow)),
+        ("tidy_unesco_wide_csv", nothing, tidy(unesco / "SDG_4.a.1_elec.csv")),
+        ("tidy_unesco_long_csv", nothing, tidy(unesco / "SDG_4.2.2.csv")),
+        ("tidy_unesco_country_csv", nothing, tidy(unesco / "SDG_4.5.1_GPI_SEC.csv")),
+        ("uis_bulk_stream", nothing, lambda: uis_bulk_stream(raw / "uis" / "bulk.csv")),
+    ]
+    if xlsx:
+        out += [
+            ("tidy_unesco_xlsx_cold", clear_excel_cache, tidy(xlsx[0])),
+            ("tidy_unesco_xlsx_cached", nothing, tidy(xlsx[0])),
+        ]
+    out += [
+        ("harmonize", nothing, lambda: len(harmonize.main(force=True).rows)),
+        (
+            "gapfill",
+            nothing,
+            lambda: len((gapfill.main(force=True) or coverage_cube.load()).rows),
+        ),
+        ("coverage_cube", nothing, lambda: len(coverage_cube.build().rows)),
+        ("build_index", nothing, lambda: len(build_index.main(full=True))),
+        ("build_index_incremental", nothing, lambda: len(build_index.main())),
+        ("check_coverage", nothing, lambda: len(check_coverage.main())),
+        (
+            "export",
+            nothing,
+            lambda: sum(map(len, export_for_tableau.export_all().values())),
+        ),
+        ("app_data_path", nothing, app_data_path),
+        ("app_arrow_path", nothing, app_arrow_path),
+    ]
+    return out
+
+
+def measure(setup, run, repeat: int) -> dict:
+    best_wall = best_cpu = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        rows = run()
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+
+    setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": round(best_wall, 4),
+        "cpu_seconds": round(best_cpu, 4),
+        "peak_mb": round(peak / 2**20, 2),
+        "rows": int(rows),
+        "rows_per_s": round(rows / best_wall) if best_wall > 0 else None,
+    }
+
+
+def bench_scale(scale: Scale, repeat: int, seed: int = 0) -> dict:
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="sdg4-bench-") as tmp:
+        root = Path(tmp)
+        (root / "docs").mkdir()
+        raw = write_raw(root, scale, seed)
+        uis_bulk(raw / "uis" / "bulk.csv", scale, UIS_INDICATORS, seed=seed)
+        os.chdir(root)  # the pipeline resolves data/ and docs/ against cwd
+        try:
+            results = {}
+            for name, setup, run in stages(raw):
+                # check_coverage prints; keep the report readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[name] = measure(setup, run, repeat)
+                r = results[name]
+                print(
+                    f"  {name:<26}{r['seconds']:>9.3f}s{r['cpu_seconds']:>9.3f}s"
+                    f"{r['peak_mb']:>10.1f} MB{r['rows']:>12,} rows"
+                )
+            return results
+        finally:
+            os.chdir(cwd)
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Stages slower than baseline by more than tolerance (and MIN_DELTA)."""
+    regressions = []
+    print(f"\n{'scale / stage':<52}{'base':>9}{'now':>9}{'ratio':>8}")
+    for label, stages_now in current["results"].items():
+        for name, now in stages_now.items():
+            base = baseline["results"].get(label, {}).get(name)
+            if base is None:
+                continue
+            ratio = now["seconds"] / max(base["seconds"], 1e-9)
+            slower = now["seconds"] - base["seconds"]
+            flag = ratio > 1 + tolerance and slower > MIN_DELTA
+            print(
+                f"{label + ' / ' + name:<52}{base['seconds']:>9.3f}"
+                f"{now['seconds']:>9.3f}{ratio:>8.2f}{'  <-- slower' if flag else ''}"
+            )
+            if flag:
+                regressions.append(f"{label}/{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages")
+    parser.add_argument(
+        "--scales", nargs="+", default=["small", "medium"], choices=list(SCALES)
+    )
+    parser.add_argument(
+        "--custom",
+        nargs=4,
+        type=int,
+        metavar=("COUNTRIES", "YEARS", "INDICATORS", "DISAGG"),
+        help="an extra scale",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--out", type=Path, default=HERE / "latest.json", help="results JSON"
+    )
+    parser.add_argument("--compare", type=Path, default=None, help="baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    scales = [SCALES[s] for s in args.scales]
+    if args.custom:
+        scales.append(Scale(*args.custom))
+
+    results = {}
+    for scale in scales:
+        print(f"{scale.label}  ({WB_CODE} + {scale.indicators - 1} extra WB zips)")
+        results[scale.label] = bench_scale(scale, args.repeat, args.seed)
+
+    report = {
+        "meta": {
+            "created": datetime.now(UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    args.out.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {args.out}")
+
+    if args.compare:
+        regressions = compare(
+            report, json.loads(args.compare.read_text()), args.tolerance
+        )
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
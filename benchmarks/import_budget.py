@@ -0,0 +1,123 @@
+# benchmarks/import_budget.py
+"""Import-time budget for the pipeline entry points and the app.
+
+Each entry point is imported in a fresh interpreter under `python -X importtime`
+and the cumulative time of its top-level module (best of --repeat runs) is
+checked against its budget in BUDGET_MS. Some modules are also forbidden from
+loading at import time (FORBIDDEN): they belong behind first use, e.g. requests
+in ingest_worldbank is only needed once something is downloaded.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --scale 2 --out benchmarks/imports.json
+
+Exits 1 if any entry point is over budget or imports a forbidden module.
+Budgets are roughly twice the time measured on a laptop with warm disk
+caches; --scale stretches them all for slower machines.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+PATHS = [str(HERE.parent / "pipelines"), str(HERE.parent / "app")]
+
+# entry point -> cumulative import time budget, in milliseconds
+BUDGET_MS = {
+    "config": 50,
+    "run": 250,
+    "ingest_worldbank": 250,
+    "serve": 600,
+    "tidy_unesco": 1000,
+    "harmonize": 1200,
+    "gapfill": 1200,
+    "check_coverage": 1200,
+    "build_index": 1200,
+    "uncertainty": 1200,
+    "sensitivity": 1200,
+    "export_for_tableau": 1200,
+    "uis_bulk": 1200,
+    "data_views": 1000,
+}
+ALWAYS_FORBIDDEN = ("pydantic",)
+FORBIDDEN = {
+    "config": ("pandas",),
+    "run": ("pandas", "pyarrow", "requests"),
+    "ingest_worldbank": ("requests", "pandas"),
+    "tidy_unesco": ("country_converter",),
+    "harmonize": ("country_converter",),
+    "data_views": ("plotly", "streamlit"),
+    "serve": ("pandas",),
+}
+
+
+def import_profile(module: str) -> dict[str, int]:
+    """{module: cumulative microseconds} of one `import module` in a new process."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(PATHS)}
+    proc = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    out = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        out[name.strip()] = int(cumulative)
+    return out
+
+
+def measure(module: str, repeat: int) -> tuple[float, set[str]]:
+    """Best-of-repeat import time (ms) and the modules the import loaded."""
+    best, loaded = float("inf"), set()
+    for _ in range(repeat):
+        profile = import_profile(module)
+        best = min(best, profile[module] / 1000)
+        loaded = set(profile)
+    return best, loaded
+
+
+def check(module: str, ms: float, loaded: set[str], scale: float) -> list[str]:
+    problems = []
+    budget = BUDGET_MS[module] * scale
+    if ms > budget:
+        problems.append(f"{module}: {ms:.0f} ms, budget {budget:.0f} ms")
+    for name in (*ALWAYS_FORBIDDEN, *FORBIDDEN.get(module, ())):
+        if name in loaded:
+            problems.append(f"{module}: imports {name} at import time")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", help="default: every entry point")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="budget multiplier")
+    parser.add_argument("--out", type=Path, help="write the timings as JSON")
+    args = parser.parse_args()
+
+    unknown = sorted(set(args.modules) - set(BUDGET_MS))
+    if unknown:
+        parser.error(f"no budget for {unknown}; known: {list(BUDGET_MS)}")
+    results, problems = {}, []
+    print(f"{'module':<20}{'ms':>8}{'budget':>8}")
+    for module in args.modules or BUDGET_MS:
+        ms, loaded = measure(module, args.repeat)
+        results[module] = round(ms, 1)
+        problems += check(module, ms, loaded, args.scale)
+        print(f"{module:<20}{ms:>8.0f}{BUDGET_MS[module] * args.scale:>8.0f}")
+
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+    for problem in problems:
+        print(f"FAIL {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
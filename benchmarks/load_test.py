@@ -0,0 +1,127 @@
+# benchmarks/load_test.py
+"""Load test for the read-only API in pipelines/serve.py.
+
+Fires a mix of country, year, ranking and indicator requests (JSON and
+Arrow, some with If-None-Match) from a pool of threads and reports
+throughput, latency percentiles and status codes. Without --url a server is
+started in-process on a free port over settings.data_dir (DATA_LAKE, by
+default the current directory's data/), where the pipeline has produced its
+outputs.
+
+    python benchmarks/load_test.py --requests 5000 --concurrency 16
+    python benchmarks/load_test.py --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "pipelines"))
+
+import serve  # noqa: E402
+
+
+def _get(url: str, headers: dict | None = None) -> tuple[int, bytes, dict]:
+    req = urllib.request.Request(url, headers=headers or {})  # noqa: S310
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:  # noqa: S310
+            return resp.status, resp.read(), dict(resp.headers)
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), dict(e.headers)
+
+
+def request_mix(base: str, n: int, seed: int = 0) -> list[tuple[str, dict]]:
+    """n (url, headers) pairs over the countries and years the server knows."""
+    _, body, _ = _get(f"{base}/countries")
+    countries = json.loads(body)
+    codes = [c["country_iso3"] for c in countries]
+    years = sorted({y for c in countries for y in (c["first_year"], c["last_year"])})
+    _, body, headers = _get(f"{base}/health")
+    etag = headers.get("ETag", "")
+
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        iso3 = codes[rng.integers(len(codes))]
+        year = years[rng.integers(len(years))]
+        order = ("top", "bottom")[rng.integers(2)]
+        kinds = [
+            (f"/countries/{iso3}", {}),
+            (f"/countries/{iso3}?format=arrow", {}),
+            (f"/years/{year}", {}),
+            (f"/ranking?year={year}&n=10&order={order}", {}),
+            (f"/indicators/{iso3}?from=2015", {}),
+            (f"/countries/{iso3}", {"If-None-Match": etag}),
+        ]
+        url, hdrs = kinds[rng.integers(len(kinds))]
+        out.append((base + url, hdrs))
+    return out
+
+
+def run(base: str, n: int, concurrency: int, seed: int = 0) -> dict:
+    mix = request_mix(base, n, seed)
+    latencies = np.empty(len(mix))
+    statuses: dict[int, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        url, headers = mix[i]
+        start = time.perf_counter()
+        status, _, _ = _get(url, headers)
+        latencies[i] = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(len(mix))))
+    wall = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {
+        "requests": len(mix),
+        "concurrency": concurrency,
+        "seconds": round(wall, 3),
+        "requests_per_s": round(len(mix) / wall),
+        "p50_ms": round(p50, 2),
+        "p95_ms": round(p95, 2),
+        "p99_ms": round(p99, 2),
+        "statuses": statuses,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="running server; default: start one here")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.disable("serve")  # no access log line per request
+    server = None
+    base = args.url
+    if base is None:
+        server = serve.make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        result = run(base.rstrip("/"), args.requests, args.concurrency, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+    print(json.dumps(result, indent=2))
+    errors = sum(n for s, n in result["statuses"].items() if s >= 500)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
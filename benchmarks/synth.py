@@ -0,0 +1,270 @@
+# benchmarks/synth.py
+"""Deterministic synthetic raw inputs in the layouts the pipeline reads.
+
+write_raw(root, scale) fills <root>/data/raw with
+
+    wb_<code>.zip              World Bank API zip (4 preamble lines, wide years)
+    unesco/SDG_4.1.1_read      SDG-portal wide sheet (.xlsx while small)
+    unesco/SDG_4.a.1_elec.csv  SDG-portal wide CSV
+    unesco/SDG_4.2.2.csv       UIS long (Country, Code, Year, Value)
+    unesco/SDG_4.5.1_GPI_SEC   wide with a Country column only
+    unesco/SDG_4.c.1_prim.csv  UIS SDMX-style long (REF_AREA, TIME_PERIOD, ...)
+
+Countries are real names/ISO3 codes (so the ISO3 resolver takes its fast
+path), followed by NOT_COUNTRIES: an aggregate and a name nothing resolves,
+which the pipeline must leave out (the second with a warning). `disagg` repeats every country-year once per disaggregation value
+(a Sex/Location-style column in the UNESCO files), which is how subnational
+and disaggregated inputs grow. The first value is the total ("_T"), so every
+scale has the headline series and disagg - 1 slices on top of it.
+`indicators` is the number of World Bank zips; the first is the one harmonize
+picks up, the rest feed the tidy benchmarks.
+The same (scale, seed) always produces the same bytes.
+
+uis_bulk writes the UIS bulk SDMX-CSV export (every indicator in one long
+file), which is not part of the raw tree.
+"""
+import gzip
+import io
+import zipfile
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+import country_converter as coco
+import numpy as np
+import pandas as pd
+
+WB_CODE = "SE.PRM.CMPT.ZS"
+LAST_YEAR = 2023
+MISSING = 0.4  # share of empty cells
+MAX_XLSX_ROWS = 20_000  # larger wide sheets are written as CSV (openpyxl is slow)
+UIS_INDICATORS = [
+    "SDG_4.1.1_read",
+    "SDG_4.2.2",
+    "SDG_4.5.1_GPI_SEC",
+    "SDG_4.a.1_elec",
+    "SDG_4.c.1_prim",
+]
+# rows every file carries besides the countries (see countries())
+NOT_COUNTRIES = pd.DataFrame(
+    {"iso3": ["WLD", "XQZ"], "name": ["World", "Republic of Utopia"]}
+)
+
+
+class Scale(NamedTuple):
+    countries: int
+    years: int
+    indicators: int = 1
+    disagg: int = 1
+
+    @property
+    def label(self) -> str:
+        return f"c{self.countries}-y{self.years}-i{self.indicators}-d{self.disagg}"
+
+
+SCALES = {
+    "small": Scale(countries=60, years=20, indicators=1, disagg=1),
+    "medium": Scale(countries=200, years=40, indicators=4, disagg=4),
+    "large": Scale(countries=240, years=64, indicators=8, disagg=16),
+}
+
+
+def _rng(seed: int, name: str) -> np.random.Generator:
+    # one stream per file, so adding a file does not shift the others
+    return np.random.default_rng([seed, zlib.crc32(name.encode())])
+
+
+def countries(n: int) -> pd.DataFrame:
+    """The first n countries (ISO3, name) known to country_converter, then
+    NOT_COUNTRIES."""
+    data = coco.CountryConverter().data[["ISO3", "name_short"]]
+    if n > len(data):
+        raise ValueError(f"At most {len(data)} countries; grow disagg instead")
+    data = data.head(n).rename(columns={"ISO3": "iso3", "name_short": "name"})
+    return pd.concat([data, NOT_COUNTRIES], ignore_index=True)
+
+
+def years(scale: Scale) -> list[int]:
+    return list(range(LAST_YEAR - scale.years + 1, LAST_YEAR + 1))
+
+
+def _values(rng, shape, lo: float, hi: float) -> np.ndarray:
+    v = rng.uniform(lo, hi, size=shape).round(4)
+    v[rng.random(shape) < MISSING] = np.nan
+    return v
+
+
+def _disagg_values(disagg: int) -> list[str]:
+    return ["_T", *(f"D{k}" for k in range(1, disagg))]
+
+
+def _wide(rng, ctry: pd.DataFrame, yrs: list[int], disagg: int, lo, hi):
+    """One row per country × disaggregation value, one column per year."""
+    rows = ctry.loc[ctry.index.repeat(disagg)].reset_index(drop=True)
+    rows["disagg"] = np.tile(_disagg_values(disagg), len(ctry))
+    vals = _values(rng, (len(rows), len(yrs)), lo, hi)
+    return rows, pd.DataFrame(vals, columns=[str(y) for y in yrs])
+
+
+def _long(rng, ctry: pd.DataFrame, yrs: list[int], disagg: int, lo, hi):
+    """One row per country × year × disaggregation value with a value."""
+    n = len(ctry) * len(yrs) * disagg
+    idx = np.arange(n)
+    c = idx // (len(yrs) * disagg)
+    out = pd.DataFrame(
+        {
+            "name": ctry["name"].to_numpy()[c],
+            "iso3": ctry["iso3"].to_numpy()[c],
+            "year": np.array(yrs)[(idx // disagg) % len(yrs)],
+            "disagg": np.array(_disagg_values(disagg))[idx % disagg],
+            "value": _values(rng, n, lo, hi),
+        }
+    )
+    return out.dropna(subset=["value"])
+
+
+def wb_zip(path: Path, code: str, scale: Scale, seed: int = 0) -> Path:
+    rng = _rng(seed, path.name)
+    ctry, yrs = countries(scale.countries), years(scale)
+    vals = _values(rng, (len(ctry), len(yrs)), 20, 110)
+    frame = pd.DataFrame(
+        {
+            "Country Name": ctry["name"].to_numpy(),
+            "Country Code": ctry["iso3"].to_numpy(),
+            "Indicator Name": f"Synthetic indicator {code}",
+            "Indicator Code": code,
+        }
+    )
+    frame = pd.concat([frame, pd.DataFrame(vals, columns=map(str, yrs))], axis=1)
+    frame[""] = ""  # the API files end every line with a comma
+    buf = io.StringIO()
+    buf.write('"Data Source","World Development Indicators",\n\n')
+    buf.write('"Last Updated Date","2024-06-28",\n\n')
+    frame.to_csv(buf, index=False, quoting=1, lineterminator="\n")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f"API_{code}_DS2_en_csv_v2_1.csv", buf.getvalue())
+        z.writestr(f"Metadata_Country_API_{code}_DS2_en_csv_v2_1.csv", "x\n")
+    return path
+
+
+def sdg_wide(path: Path, scale: Scale, seed: int = 0, lo=5, hi=95) -> Path:
+    """SDG-portal layout; written as .xlsx when the suffix asks for it."""
+    rng = _rng(seed, path.stem)
+    ctry = countries(scale.countries)
+    rows, vals = _wide(rng, ctry, years(scale), scale.disagg, lo, hi)
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "Goal": 4,
+                    "Target": "4.1",
+                    "SeriesCode": "SE_SYN",
+                    "GeoAreaCode": rows.index + 1,
+                    "GeoAreaName": rows["name"],
+                    "Sex": rows["disagg"],
+                    "Units": "PERCENT",
+                }
+            ),
+            vals,
+        ],
+        axis=1,
+    )
+    if path.suffix == ".xlsx":
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def country_wide(path: Path, scale: Scale, seed: int = 0, lo=0.6, hi=1.3) -> Path:
+    """Wide by year with only a Country name column (ISO3 resolved by name)."""
+    rng = _rng(seed, path.stem)
+    rows, vals = _wide(
+        rng, countries(scale.countries), years(scale), scale.disagg, lo, hi
+    )
+    df = pd.concat(
+        [rows[["name", "disagg"]].set_axis(["Country", "Location"], axis=1), vals],
+        axis=1,
+    )
+    df.to_csv(path, index=False)
+    return path
+
+
+def uis_long(path: Path, scale: Scale, seed: int = 0, sdmx: bool = False) -> Path:
+    rng = _rng(seed, path.stem)
+    df = _long(rng, countries(scale.countries), years(scale), scale.disagg, 30, 100)
+    names = (
+        ["COUNTRY", "REF_AREA", "TIME_PERIOD", "SEX", "OBS_VALUE"]
+        if sdmx
+        else ["Country", "Code", "Year", "Sex", "Value"]
+    )
+    df.set_axis(names, axis=1).to_csv(path, index=False)
+    return path
+
+
+def uis_bulk(
+    path: Path,
+    scale: Scale,
+    indicators: list[str],
+    other: int = 20,
+    seed: int = 0,
+) -> Path:
+    """UIS bulk SDMX-CSV export (gzipped if the suffix says so).
+
+    Every indicator (the given ones, then `other` that a reader should skip)
+    gets a total row per country-year plus `disagg` SEX/LOCATION breakdowns.
+    Written one indicator at a time, so `other` can make it arbitrarily large.
+    """
+    ctry, yrs = countries(scale.countries), years(scale)
+    dims = [
+        ("_T", "_T"),
+        *[(("F", "M")[k % 2], f"L{k // 2}") for k in range(scale.disagg)],
+    ]
+    ids = [*indicators, *(f"SYN.UIS.{k}" for k in range(other))]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    raw = open(path, "wb")  # noqa: SIM115
+    if path.suffix == ".gz":
+        raw = gzip.GzipFile(fileobj=raw, mode="wb", mtime=0)  # same bytes every run
+    with io.TextIOWrapper(raw, newline="") as f:
+        for i, ind in enumerate(ids):
+            rng = _rng(seed, ind)
+            n = len(ctry) * len(yrs) * len(dims)
+            idx = np.arange(n)
+            c = idx // (len(yrs) * len(dims))
+            d = idx % len(dims)
+            df = pd.DataFrame(
+                {
+                    "DATAFLOW": "UIS:SDG4(1.0)",
+                    "INDICATOR": ind,
+                    "REF_AREA": ctry["iso3"].to_numpy()[c]
+                    + ": "
+                    + ctry["name"].to_numpy()[c],
+                    "TIME_PERIOD": np.array(yrs)[(idx // len(dims)) % len(yrs)],
+                    "SEX": np.array([s for s, _ in dims])[d],
+                    "LOCATION": np.array([loc for _, loc in dims])[d],
+                    "OBS_VALUE": _values(rng, n, 0, 100),
+                    "OBS_STATUS": "A",
+                }
+            )
+            df.dropna(subset=["OBS_VALUE"]).to_csv(f, index=False, header=i == 0)
+    return path
+
+
+def write_raw(root: Path, scale: Scale, seed: int = 0) -> Path:
+    """Write the full raw tree for `scale` under root/data/raw."""
+    raw = root / "data" / "raw"
+    unesco = raw / "unesco"
+    unesco.mkdir(parents=True, exist_ok=True)
+
+    wb_zip(raw / f"wb_{WB_CODE}.zip", WB_CODE, scale, seed)
+    for i in range(1, scale.indicators):
+        code = f"SYN.WB.{i}"
+        wb_zip(raw / f"wb_{code}.zip", code, scale, seed)
+
+    xlsx = scale.countries * scale.disagg <= MAX_XLSX_ROWS
+    sdg_wide(unesco / ("SDG_4.1.1_read" + (".xlsx" if xlsx else ".csv")), scale, seed)
+    sdg_wide(unesco / "SDG_4.a.1_elec.csv", scale, seed, lo=10, hi=100)
+    uis_long(unesco / "SDG_4.2.2.csv", scale, seed)
+    country_wide(unesco / "SDG_4.5.1_GPI_SEC.csv", scale, seed)
+    uis_long(unesco / "SDG_4.c.1_prim.csv", scale, seed, sdmx=True)
+    return raw
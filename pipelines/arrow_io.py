@@ -0,0 +1,78 @@
+# pipelines/arrow_io.py
+"""Year-indexed Arrow IPC (Feather v2) files for data/public.
+
+Written uncompressed, an Arrow IPC file can be memory-mapped and its column
+buffers used in place: no decoding, and every process that maps the same
+file shares one copy in the OS page cache. Rows are sorted by year and the
+schema metadata carries {year: [start, stop]} row ranges under YEAR_INDEX,
+so one year is a zero-copy slice:
+
+    t = arrow_io.open_year_indexed("data/public/arrow/inequity_index.arrow")
+    t.year(2020).to_pandas()
+
+Files are replaced by rename, never rewritten in place, so a process still
+mapping the previous version keeps a valid view of it.
+"""
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+YEAR_INDEX = b"year_index"
+
+
+class YearIndexed(NamedTuple):
+    table: pa.Table  # backed by the memory map
+    years: dict[int, tuple[int, int]]  # row range per year
+
+    def year(self, year: int) -> pa.Table:
+        """Rows of one year, as a zero-copy slice (empty if there are none)."""
+        start, stop = self.years.get(year, (0, 0))
+        return self.table.slice(start, stop - start)
+
+
+def write(data: pd.DataFrame | pa.Table, path: Path, year: str = "year") -> Path:
+    """Write data sorted by `year` (stable) with its year index, atomically."""
+    table = (
+        pa.Table.from_pandas(data, preserve_index=False)
+        if isinstance(data, pd.DataFrame)
+        else data
+    )
+    # stable sort, rows without a year last (and outside the index)
+    table = table.take(pc.sort_indices(table, [(year, "ascending")])).combine_chunks()
+    col = table[year]
+    n_valid = len(col) - col.null_count
+    years = col.slice(0, n_valid).to_numpy(zero_copy_only=False).astype(np.int64)
+    uniq, starts = np.unique(years, return_index=True)
+    stops = [*starts[1:], n_valid]
+    index = {
+        str(y): [int(a), int(b)] for y, a, b in zip(uniq, starts, stops, strict=True)
+    }
+    meta = {**(table.schema.metadata or {}), YEAR_INDEX: json.dumps(index).encode()}
+    table = table.replace_schema_metadata(meta)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    feather.write_feather(table, tmp, compression="uncompressed")
+    tmp.replace(path)
+    return path
+
+
+@lru_cache(maxsize=16)
+def _open(path: str, mtime_ns: int) -> YearIndexed:
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    index = json.loads((table.schema.metadata or {}).get(YEAR_INDEX, b"{}"))
+    return YearIndexed(table, {int(y): tuple(r) for y, r in index.items()})
+
+
+def open_year_indexed(path: str | Path) -> YearIndexed:
+    """Memory-map a file written by `write`; reopened once it is replaced."""
+    path = Path(path)
+    return _open(str(path), path.stat().st_mtime_ns)
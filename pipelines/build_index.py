@@ -1,164 +1,260 @@
 # pipelines/build_index.py
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import index_state
+import instrument
 import numpy as np
 import pandas as pd
-from pathlib import Path
+import registry
+import schema
+from config import settings
 from loguru import logger
 
-# Buckets & indicators (MVP)
-BUCKETS = {
-    "Learning": ["SDG_4.1.1_read"],
-    "EarlyChildhood": ["SDG_4.2.2"],
-    "Participation": ["SE.PRM.CMPT.ZS"],
-    "Equity": ["SDG_4.5.1_GPI_SEC"],  # GPI: ideal = 1
-    "Infrastructure": ["SDG_4.a.1_elec"],
-    "Teachers": ["SDG_4.c.1_prim"],
-}
-WEIGHTS = {k: 1 / len(BUCKETS) for k in BUCKETS}  # equal for now
-
-
-def load_interim(ind_id: str, base: Path) -> pd.DataFrame:
-    p = base / f"{ind_id}.parquet"
-    if not p.exists():
-        logger.warning(f"Missing {p}")
-        return pd.DataFrame()
-    df = pd.read_parquet(p)
-    df["indicator_id"] = ind_id  # ensure
-    return df[["country_iso3", "country_name", "year", "indicator_id", "value"]]
-
-
-def normalize_series(x: pd.Series, higher_is_better: bool = True) -> pd.Series:
-    x = pd.to_numeric(x, errors="coerce")
-    x = x.replace([np.inf, -np.inf], np.nan)
-    if x.notna().sum() <= 1:
-        return pd.Series(np.zeros(len(x)), index=x.index)
-    mn, mx = x.min(), x.max()
-    if mn == mx:
-        return pd.Series(np.zeros(len(x)), index=x.index)
-    s01 = (x - mn) / (mx - mn)
-    return s01 if higher_is_better else (1 - s01)
-
-    base = Path("data/interim")
-    frames = []
-    for bucket, inds in BUCKETS.items():
-        for ind in inds:
-            df = load_interim(ind, base)
-            if df.empty:
-                continue
-            df["bucket"] = bucket
-            # Special handling for GPI (closer to 1 is better)
-            if ind == "SDG_4.5.1_GPI_SEC":
-                # convert to “goodness” = 1 - |GPI-1| then min-max across countries/years
-                g = df["value"].astype(float)
-                goodness = 1 - (g - 1.0).abs()
-                # min-max scale goodness to [0,1]
-                df["norm"] = normalize_series(goodness, True)
-            else:
-                df["norm"] = normalize_series(df["value"], True)
-            frames.append(df)
-
-    if not frames:
-        logger.error("No indicators available. Did you run harmonize?")
-        return
-
-    df = pd.concat(frames, ignore_index=True)
-
-    # Aggregate to bucket-level per country-year
-    bucket_scores = df.groupby(
-        ["country_iso3", "country_name", "year", "bucket"], as_index=False
-    ).agg(bucket_score=("norm", "mean"))
-    bucket_scores["weight"] = bucket_scores["bucket"].map(WEIGHTS)
-
-    # Weighted average across buckets
-    index_df = (
-        bucket_scores.groupby(["country_iso3", "country_name", "year"], as_index=False)
-        .apply(lambda g: np.average(g["bucket_score"], weights=g["weight"]))
-        .rename(columns={None: "inequity_index"})
-        .reset_index(drop=True)
-    )
+KEYS = ["country_iso3", "country_name", "year"]
+SDG_ERA = (2015, 2024)
+OUT = settings.data_dir / "interim" / "inequity_index.parquet"
+# national rows (disagg_type / disagg_value NA) plus one block per slice
+DISAGG_OUT = settings.data_dir / "interim" / "inequity_index_disagg.parquet"
+
+
+def bucket_indicators() -> dict[str, list[str]]:
+    """Bucket -> its indicator ids, from the registry (docs/indicators.csv)."""
+    return registry.buckets()
+
+
+def weights() -> dict[str, float]:
+    buckets = bucket_indicators()
+    return {k: 1 / len(buckets) for k in buckets}  # equal for now
+
+
+def cell_matrix(cell: pd.Series):
+    """Dense country-year × bucket matrix of the mean score per (KEYS, bucket).
+
+    Returns (rows, buckets, scores, mask): rows is the sorted MultiIndex of
+    country-years, buckets the sorted bucket names, scores the cell scores (0
+    where missing) and mask marks the cells that have one.
+    """
+    keys = cell.index.droplevel("bucket")
+    rows = keys.unique()  # already sorted, like the old groupby output
+    rows_of_cell = rows.get_indexer(keys)
+    buckets = sorted(cell.index.get_level_values("bucket").unique())
+    col_of_cell = pd.Categorical(
+        cell.index.get_level_values("bucket"), categories=buckets
+    ).codes
+
+    scores = np.zeros((len(rows), len(buckets)))
+    mask = np.zeros((len(rows), len(buckets)), dtype=bool)
+    scores[rows_of_cell, col_of_cell] = cell.to_numpy()
+    mask[rows_of_cell, col_of_cell] = True
+    return rows, buckets, scores, mask
+
+
+def bucket_weights(buckets: list[str]) -> np.ndarray:
+    w = weights()
+    return np.array([w[b] for b in buckets], dtype=float)
+
+
+def weighted_index(
+    scores: np.ndarray, mask: np.ndarray, weights: np.ndarray, min_buckets: int = 2
+) -> tuple[np.ndarray, np.ndarray]:
+    """Weighted mean over the present buckets of each row, and the coverage mask.
+
+    Weights are renormalized over present buckets only, i.e. the same
+    sum(w*x)/sum(w) as np.average per group; absent cells are zero in both sums
+    (and buckets are in the same sorted order), so the result is bit-identical.
+    """
+    keep = mask.sum(axis=1) >= min_buckets
+    w = np.where(mask, weights, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = (scores * w).sum(axis=1) / w.sum(axis=1)
+    return index, keep
+
+
+def parse_years(text: str) -> tuple[int, int] | None:
+    """ "2015-2019" -> (2015, 2019); "" -> None."""
+    if not text:
+        return None
+    first, _, last = text.partition("-")
+    return int(first), int(last or first)
+
+
+def _buckets() -> dict[str, str]:
+    return {i.indicator_id: i.bucket for i in registry.scored()}
+
+
+def load_cells(
+    full: bool = False, reference: tuple[int, int] | None = None
+) -> pd.Series:
+    """Mean normalized score per (KEYS, bucket), from the incremental state."""
+    state = index_state.update(registry.rules(), full=full)
+    return index_state.cell_scores(state, _buckets(), SDG_ERA, reference)
 
-    out = base / "inequity_index.parquet"
-    index_df.to_parquet(out, index=False)
-    logger.success(f"Wrote {out} with {len(index_df):,} rows")
-
-
-def main():
-    from country_converter import CountryConverter
-    import pandas as pd
-    import numpy as np
-    from pathlib import Path
-
-    cc = CountryConverter()
-
-    base = Path("data/interim")
-    frames = []
-    for bucket, inds in BUCKETS.items():
-        for ind in inds:
-            df = load_interim(ind, base)
-            if df.empty:
-                continue
-            df["bucket"] = bucket
-
-            # --- Drop regional aggregates (keep only true ISO3 countries) & silence prints ---
-            import io
-            from contextlib import redirect_stdout
-
-            buf = io.StringIO()
-            with redirect_stdout(buf):  # suppress "not found in ISO3" spam
-                iso3_conv = pd.Series(
-                    cc.convert(
-                        df["country_iso3"].astype(str), to="ISO3", not_found=None
-                    ),
-                    index=df.index,
-                )
-            df = df[iso3_conv.notna()]  # keep only recognized countries
-
-            # --- Normalize (special case for GPI) ---
-            if ind == "SDG_4.5.1_GPI_SEC":
-                g = pd.to_numeric(df["value"], errors="coerce")
-                goodness = 1 - (g - 1.0).abs()
-                df["norm"] = normalize_series(goodness, True)
-            else:
-                df["norm"] = normalize_series(df["value"], True)
-
-            df = df.dropna(subset=["year", "norm"])
-            frames.append(df)
-
-    if not frames:
+
+def index_inputs(
+    full: bool = False,
+    reference: tuple[int, int] | None = None,
+):
+    """(rows, buckets, scores, mask) of every country-year with a bucket score,
+    or None if there is nothing to build from. A bucket is present where it
+    has a score, so the mask and the scores come from the same cells.
+
+    Normalization comes from index_state, so only changed year partitions are
+    read; full=True rebuilds that state. reference freezes each indicator's
+    min-max bounds to those years (default: settings.index_reference).
+    """
+    if reference is None:
+        reference = parse_years(settings.index_reference)
+    with instrument.step("build_index.load_cells") as s:
+        cell = load_cells(full, reference)
+        s.rows_out = len(cell)
+    if cell.empty:
         logger.error("No indicators available. Did you run harmonize?")
-        return
+        return None
 
-    df = pd.concat(frames, ignore_index=True)
-    # Keep SDG era
-    df = df[(df["year"] >= 2015) & (df["year"] <= 2024)]
+    with instrument.step("build_index.cell_matrix", rows_in=len(cell)) as s:
+        rows, buckets, scores, mask = cell_matrix(cell)
+        s.rows_out = len(rows)
+    return rows, buckets, scores, mask
+
+
+def compute_index(
+    full: bool = False,
+    reference: tuple[int, int] | None = None,
+) -> pd.DataFrame:
+    """The inequity index per country-year (empty if nothing to build from)."""
+    inputs = index_inputs(full, reference)
+    if inputs is None:
+        return pd.DataFrame()
+    rows, buckets, scores, mask = inputs
 
     # --- Require at least 2 buckets present per country-year (global coverage bias) ---
-    bucket_scores = df.groupby(
-        ["country_iso3", "country_name", "year", "bucket"], as_index=False
-    ).agg(bucket_score=("norm", "mean"))
-    counts = bucket_scores.groupby(
-        ["country_iso3", "country_name", "year"], as_index=False
-    ).agg(n_buckets=("bucket", "nunique"))
-    present = bucket_scores.merge(
-        counts, on=["country_iso3", "country_name", "year"], how="left"
-    )
-    present = present[present["n_buckets"] >= 2]
+    with instrument.step("build_index.weighted_index", rows_in=len(rows)):
+        index, keep = weighted_index(scores, mask, bucket_weights(buckets))
 
-    if present.empty:
+    if not keep.any():
         logger.error("No country-years with minimum coverage (>=2 buckets).")
-        return
-
-    present["weight"] = present["bucket"].map(WEIGHTS)
-    index_df = (
-        present.groupby(["country_iso3", "country_name", "year"], as_index=False)
-        .apply(lambda g: np.average(g["bucket_score"], weights=g["weight"]))
-        .rename(columns={None: "inequity_index"})
-        .reset_index(drop=True)
-    )
+        return pd.DataFrame()
+
+    index_df = rows[keep].to_frame(index=False)
+    index_df["inequity_index"] = index[keep]
+    return index_df
+
+
+def slice_index(
+    key: tuple[str, str],
+    cells: pd.DataFrame,
+    bounds: dict[str, tuple[float, float, int]],
+) -> pd.DataFrame:
+    """The index of one disaggregation slice from its index_state cells.
+
+    Buckets count as present where the slice has a score; a bucket whose
+    indicators are not disaggregated this way is absent, not filled from the
+    national score.
+    """
+    with instrument.step(f"build_index.slice:{key[0]}={key[1]}", len(cells)) as s:
+        cell = index_state.slice_scores(cells, bounds, _buckets(), SDG_ERA)
+        if cell.empty:
+            return pd.DataFrame()
+        rows, buckets, scores, mask = cell_matrix(cell)
+        index, keep = weighted_index(scores, mask, bucket_weights(buckets))
+        out = rows[keep].to_frame(index=False)
+        out.insert(0, "disagg_type", key[0])
+        out.insert(1, "disagg_value", key[1])
+        out["inequity_index"] = index[keep]
+        s.rows_out = len(out)
+    return out
+
 
-    out = base / "inequity_index.parquet"
-    index_df.to_parquet(out, index=False)
-    logger.success(f"Wrote {out} with {len(index_df):,} rows")
+def compute_slices(
+    state: index_state.IndexState,
+    reference: tuple[int, int] | None = None,
+    workers: int | None = None,
+) -> list[pd.DataFrame]:
+    """The index of every disaggregation slice in the state, one slice per task
+    on a process pool (workers=1: in this process).
+
+    Every slice is scaled with the same min-max bounds, pooled over headline
+    and disaggregated rows (see index_state), so slices are comparable with
+    each other.
+    """
+    if reference is None:
+        reference = parse_years(settings.index_reference)
+    bounds = index_state.all_bounds(state, reference, pooled=True)
+    parts = index_state.slices(state)
+    if workers == 1 or len(parts) < 2:
+        return [slice_index(key, cells, bounds) for key, cells in parts.items()]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(instrument.traced_call, slice_index, key, cells, bounds)
+            for key, cells in parts.items()
+        ]
+        return [instrument.unwrap(f.result()) for f in futures]
+
+
+def write_disagg(index_df: pd.DataFrame, slices: list[pd.DataFrame]) -> Path:
+    """National and slice indices in one file keyed by (disagg_type, disagg_value)."""
+    national = index_df.assign(disagg_type=pd.NA, disagg_value=pd.NA)
+    cols = ["disagg_type", "disagg_value", *KEYS, "inequity_index"]
+    df = schema.concat([national[cols], *(d[cols] for d in slices if not d.empty)])
+    df = schema.cast(df).sort_values(cols[:-1], na_position="first", kind="stable")
+    df.to_parquet(DISAGG_OUT, index=False)
+    n = df["disagg_type"].notna().sum()
+    logger.success(f"Wrote {DISAGG_OUT} with {n:,} rows in {len(slices)} slices")
+    return DISAGG_OUT
+
+
+@instrument.timed("build_index")
+def main(
+    full: bool = False,
+    reference: tuple[int, int] | None = None,
+    draws: int | None = None,
+    workers: int | None = None,
+) -> pd.DataFrame:
+    index_df = compute_index(full, reference)
+    if index_df.empty:
+        return index_df
+    index_df.to_parquet(OUT, index=False)
+    logger.success(f"Wrote {OUT} with {len(index_df):,} rows")
+    # compute_index brought the state up to date, so it is only loaded here
+    write_disagg(index_df, compute_slices(index_state.load(), reference, workers))
+
+    draws = settings.index_draws if draws is None else draws
+    if draws:
+        import uncertainty  # imports this module, so not at the top
+
+        uncertainty.main(draws, reference=reference)
+    return index_df
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build the inequity index")
+    parser.add_argument(
+        "--full", action="store_true", help="rebuild the normalization state"
+    )
+    parser.add_argument(
+        "--reference",
+        default=settings.index_reference,
+        help="freeze min-max bounds to these years, e.g. 2015-2019",
+    )
+    parser.add_argument(
+        "--uncertainty",
+        type=int,
+        default=None,
+        metavar="DRAWS",
+        help="also write Monte Carlo intervals (see uncertainty.py)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes for the disaggregated slices (1: none)",
+    )
+    args = parser.parse_args()
+    main(
+        full=args.full,
+        reference=parse_years(args.reference),
+        draws=args.uncertainty,
+        workers=args.workers,
+    )
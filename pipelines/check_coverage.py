@@ -1,46 +1,41 @@
 # pipelines/check_coverage.py
-import pandas as pd
 from pathlib import Path
 
-INDICATORS = [
-    "SE.PRM.CMPT.ZS",
-    "SDG_4.1.1_read",
-    "SDG_4.2.2",
-    "SDG_4.5.1_GPI_SEC",
-    "SDG_4.a.1_elec",
-    "SDG_4.c.1_prim",
-]
-
-base = Path("data/interim")
-dfs = []
-for ind in INDICATORS:
-    p = base / f"{ind}.parquet"
-    if p.exists():
-        df = pd.read_parquet(p)[
-            ["country_iso3", "country_name", "year", "indicator_id", "value"]
-        ]
-        dfs.append(df.assign(has_value=df["value"].notna()))
-    else:
-        print(f"Missing: {p}")
-
-if not dfs:
-    raise SystemExit("No interim files found. Run harmonize first.")
-
-all_df = pd.concat(dfs, ignore_index=True)
-coverage = all_df.groupby(
-    ["country_iso3", "country_name", "year", "indicator_id"], as_index=False
-).agg(has_value=("has_value", "max"))
-pivot = coverage.pivot_table(
-    index=["country_iso3", "country_name", "year"],
-    columns="indicator_id",
-    values="has_value",
-    fill_value=False,
-)
-pivot["available_count"] = pivot.sum(axis=1)
-pivot = pivot.reset_index().sort_values(
-    ["year", "available_count"], ascending=[False, False]
-)
-
-out = Path("docs/coverage_by_country_year.csv")
-pivot.to_csv(out, index=False)
-print(f"Wrote {out} with {len(pivot):,} rows")
+import coverage_cube
+import instrument
+import pandas as pd
+import registry
+import store
+from loguru import logger
+
+OUT = Path("docs/coverage_by_country_year.csv")
+
+
+def coverage_table(cube: coverage_cube.CoverageCube) -> pd.DataFrame:
+    indicators = {i.indicator_id for i in registry.load()}
+    for ind in sorted(indicators - set(cube.indicators)):
+        logger.warning(f"Missing: {store.indicator_dir(ind)}")
+
+    present = [ind for ind in cube.indicators if ind in indicators]
+    if not present:
+        raise SystemExit("No interim files found. Run harmonize first.")
+
+    # one 0/1 column per indicator, straight from the cube's bits
+    pivot = cube.flags(present).astype(int)
+    pivot["available_count"] = cube.available_count(present)
+    return pivot.reset_index().sort_values(
+        ["year", "available_count"], ascending=[False, False]
+    )
+
+
+@instrument.timed("check_coverage")
+def main(cube: coverage_cube.CoverageCube | None = None) -> pd.DataFrame:
+    # observed values only: gap-filled cells are not data we have
+    pivot = coverage_table(cube or coverage_cube.load(coverage_cube.OBSERVED))
+    pivot.to_csv(OUT, index=False)
+    logger.success(f"Wrote {OUT} with {len(pivot):,} rows")
+    return pivot
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,37 @@
-from pydantic import BaseModel
-from pathlib import Path
 import os
+from dataclasses import dataclass
+from pathlib import Path
 
 
-class Settings(BaseModel):
+# A plain dataclass: every module imports this, and pydantic alone would
+# add ~150 ms to each process start. Values come from the environment.
+@dataclass
+class Settings:
     data_dir: Path = Path(os.getenv("DATA_LAKE", "data"))
     years: str = os.getenv("DEFAULT_YEARS", "2015-2024")
+    # float32 halves the memory of the interim values, but moves the published
+    # numbers in the last digits; float64 keeps them exact
+    value_dtype: str = os.getenv("VALUE_DTYPE", "float64")
+    # "2015-2019" freezes the index's min-max bounds to those years
+    index_reference: str = os.getenv("INDEX_REFERENCE_YEARS", "")
+    # > 0 makes build_index also write Monte Carlo intervals with that many draws
+    index_draws: int = int(os.getenv("INDEX_UNCERTAINTY_DRAWS", "0"))
+    # gapfill.py: methods applied in order ("" fills nothing, so the published
+    # index only uses observed values unless asked), and the longest gap filled
+    gapfill_methods: str = os.getenv("GAPFILL_METHODS", "")
+    gapfill_max_gap: int = int(os.getenv("GAPFILL_MAX_GAP", "3"))
+    # validate.py: "warn" logs failed checks, "fail" refuses the table, "off"
+    validation: str = os.getenv("VALIDATION", "warn")
+    # years a value may carry at all (settings.years is the analysis window)
+    valid_years: str = os.getenv("VALID_YEARS", "1950-2035")
+    # uis_bulk.py: the UIS bulk export run.py reads after harmonize ("" for none)
+    uis_bulk: str = os.getenv("UIS_BULK", "")
+    excel_cache_mb: int = int(os.getenv("EXCEL_CACHE_MB", "512"))
+    # {code} is filled in; point at a local stand-in server for offline runs
+    worldbank_url: str = os.getenv(
+        "WB_BASE_URL",
+        "https://api.worldbank.org/v2/country/all/indicator/{code}?downloadformat=csv",
+    )
 
 
 settings = Settings()
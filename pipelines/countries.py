@@ -0,0 +1,233 @@
+# pipelines/countries.py
+"""Shared country resolver (code/name -> ISO3).
+
+CountryConverter matches every name against ~300 regexes, so calling it on
+whole columns is the slowest part of a pipeline run. Here it is called at most
+once per distinct string: results live in a small lookup table (key, iso3,
+is_aggregate) that is seeded from the converter's own country list, extended
+on demand, and persisted under <data_dir>/cache between runs. The table is
+shared by every thread of the process (index_state resolves on a pool), so it
+is only read and extended under _LOCK.
+
+A key without an ISO3 code is either a regional or income aggregate, listed
+in AGGREGATES (World Bank codes and names, SDG regions), or unknown: a typo or
+a name CountryConverter does not know. Both are left out as non-countries,
+but unknown keys are logged, once per process.
+"""
+import logging
+import tempfile
+import threading
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+
+import instrument
+import numpy as np
+import pandas as pd
+from config import settings
+from loguru import logger
+
+CACHE_DIR = settings.data_dir / "cache"
+_NOT_FOUND = "__not_found__"
+_SEED_COLUMNS = ("name_official", "name_short", "ISO2", "ISO3")
+# compared case-insensitively
+AGGREGATES = frozenset(
+    s.casefold()
+    for s in (
+        # World Bank aggregate codes, as in the "Country Code" column of its files
+        *"AFE AFW ARB CEB CSS EAP EAR EAS ECA ECS EMU EUU FCS HIC HPC IBD IBT IDA"
+        " IDB IDX INX LAC LCN LDC LIC LMC LMY LTE MEA MIC MNA NAC OED OSS PRE PSS"
+        " PST SAS SSA SSF SST TEA TEC TLA TMN TSA TSS UMC WLD".split(),
+        # ... and their names
+        "Africa Eastern and Southern",
+        "Africa Western and Central",
+        "Arab World",
+        "Caribbean small states",
+        "Central Europe and the Baltics",
+        "Early-demographic dividend",
+        "East Asia & Pacific",
+        "East Asia & Pacific (excluding high income)",
+        "East Asia & Pacific (IDA & IBRD countries)",
+        "Euro area",
+        "Europe & Central Asia",
+        "Europe & Central Asia (excluding high income)",
+        "Europe & Central Asia (IDA & IBRD countries)",
+        "European Union",
+        "Fragile and conflict affected situations",
+        "Heavily indebted poor countries (HIPC)",
+        "High income",
+        "IBRD only",
+        "IDA & IBRD total",
+        "IDA blend",
+        "IDA only",
+        "IDA total",
+        "Late-demographic dividend",
+        "Latin America & Caribbean",
+        "Latin America & Caribbean (excluding high income)",
+        "Latin America & the Caribbean (IDA & IBRD countries)",
+        "Least developed countries: UN classification",
+        "Low & middle income",
+        "Low income",
+        "Lower middle income",
+        "Middle East & North Africa",
+        "Middle East & North Africa (excluding high income)",
+        "Middle East & North Africa (IDA & IBRD countries)",
+        "Middle income",
+        "North America",
+        "Not classified",
+        "OECD members",
+        "Other small states",
+        "Pacific island small states",
+        "Post-demographic dividend",
+        "Pre-demographic dividend",
+        "Small states",
+        "South Asia",
+        "South Asia (IDA & IBRD)",
+        "Sub-Saharan Africa",
+        "Sub-Saharan Africa (excluding high income)",
+        "Sub-Saharan Africa (IDA & IBRD countries)",
+        "Upper middle income",
+        "World",
+        # SDG regions used by UIS
+        "Central and Southern Asia",
+        "Eastern and South-Eastern Asia",
+        "Europe and Northern America",
+        "Landlocked Developing Countries",
+        "Latin America and the Caribbean",
+        "Least Developed Countries",
+        "Northern Africa and Western Asia",
+        "Oceania",
+        "Small Island Developing States",
+    )
+)
+
+_LOCK = threading.Lock()
+_lookup: dict[str, str | None] | None = None
+_warned: set[str] = set()  # unknown keys already logged
+
+
+@lru_cache(maxsize=1)
+def _converter():
+    from country_converter import CountryConverter
+
+    return CountryConverter()
+
+
+def _clean_iso3(code) -> str:
+    # same cleanup CountryConverter applies to ISO2/ISO3 outputs
+    return "".join(c for c in str(code).split("|")[0] if c.isalnum()).upper()
+
+
+def _table_path() -> Path:
+    try:
+        version = metadata.version("country_converter")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return CACHE_DIR / f"iso3_lookup_{version}.parquet"
+
+
+def is_aggregate(key: str) -> bool:
+    return key.casefold() in AGGREGATES
+
+
+def _save() -> None:
+    table = pd.DataFrame(
+        {
+            "key": pd.array(list(_lookup), dtype="string"),
+            "iso3": pd.array(list(_lookup.values()), dtype="string"),
+        }
+    )
+    table["is_aggregate"] = [is_aggregate(k) for k in _lookup]
+    path = _table_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # a name of its own, so two processes saving at once do not collide
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as f:
+        tmp = Path(f.name)
+    table.to_parquet(tmp, index=False)
+    tmp.replace(path)
+
+
+def _load() -> dict[str, str | None]:
+    global _lookup
+    if _lookup is None:
+        path = _table_path()
+        if path.exists():
+            t = pd.read_parquet(path)
+            _lookup = dict(
+                zip(
+                    t["key"],
+                    t["iso3"].astype(object).where(t["iso3"].notna(), None),
+                    strict=False,
+                )
+            )
+        else:
+            data = _converter().data
+            _lookup = {}
+            for col in _SEED_COLUMNS:
+                for key, iso3 in zip(data[col].astype(str), data["ISO3"], strict=False):
+                    # ISO2 entries can be alternations such as "^GR$|^EL$"
+                    for alt in key.split("|") if col == "ISO2" else [key]:
+                        _lookup[alt.strip("^$")] = _clean_iso3(iso3)
+            _save()
+    return _lookup
+
+
+def _resolve_new(keys: list[str]) -> None:
+    """Run CountryConverter once over keys not in the table yet, quietly."""
+    cc_log = logging.getLogger("country_converter")
+    level = cc_log.level
+    cc_log.setLevel(logging.ERROR)  # no "X not found in ISO3" spam
+    try:
+        with instrument.step("countries.CountryConverter", rows_in=len(keys)):
+            hits = _converter().convert(
+                keys, to="ISO3", enforce_list=True, not_found=_NOT_FOUND
+            )
+    finally:
+        cc_log.setLevel(level)
+    for key, found in zip(keys, hits, strict=False):
+        _lookup[key] = None if found[0] == _NOT_FOUND else _clean_iso3(found[0])
+    _save()
+
+
+@instrument.timed("countries.to_iso3")
+def to_iso3(values: pd.Series) -> pd.Series:
+    """ISO3 code for each value; <NA> for aggregates and unknowns (logged)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # the categories already are the distinct values
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values.astype("string"))
+    keys = [str(u) for u in uniques]
+    with _LOCK:
+        table = _load()
+        new = [k for k in keys if k not in table]
+        if new:
+            _resolve_new(new)
+        # trailing None so the -1 code factorize gives to missing values maps to NA
+        mapped = np.array([table[k] for k in keys] + [None], dtype=object)
+        unknown = [
+            k
+            for k in keys
+            if table[k] is None and not is_aggregate(k) and k not in _warned
+        ]
+        _warned.update(unknown)
+    if unknown:
+        logger.warning(
+            f"{len(unknown)} name(s)/code(s) resolve to no country and are not "
+            f"known aggregates, left out: {', '.join(sorted(unknown)[:10])}"
+        )
+    return pd.Series(mapped[codes], index=values.index, dtype="string")
+
+
+def is_country(values: pd.Series) -> pd.Series:
+    """Boolean mask: True where the value resolves to a real ISO3 country."""
+    return to_iso3(values).notna()
+
+
+def un_region(iso3: pd.Series) -> pd.Series:
+    """UN M49 sub-region of each ISO3 code; <NA> for unknown codes."""
+    data = _converter().data
+    regions = dict(zip(data["ISO3"].map(_clean_iso3), data["UNregion"], strict=False))
+    return iso3.astype(object).map(regions).astype("string")
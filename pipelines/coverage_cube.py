@@ -0,0 +1,169 @@
+# pipelines/coverage_cube.py
+"""Country × year × indicator availability as a bitmask ("coverage cube").
+
+One row per (country_iso3, country_name, year) of the interim dataset and one
+bit per indicator, packed into uint64 words (indicator i is bit i % 64 of
+word i // 64). A bit is set when that country-year has a finite value for the
+indicator. harmonize (and gapfill) rebuild the cube after every run and store
+it next to the dataset, with an OBSERVED copy that leaves gap-filled
+(is_imputed) rows out: build_index reads the first, so a filled cell counts
+towards a row's buckets, while check_coverage and export_for_tableau report
+the observed one. None of them re-derives availability from the rows, and
+every question (how many indicators, which are missing, which rows have >= N
+buckets) is a mask-and-popcount over the words.
+"""
+import json
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import store
+from config import settings
+from loguru import logger
+
+CUBE = settings.data_dir / "interim" / "coverage_cube.parquet"
+OBSERVED = settings.data_dir / "interim" / "coverage_cube_observed.parquet"
+KEYS = ["country_iso3", "country_name", "year"]
+
+_M1, _M2, _M4, _H01 = (
+    np.uint64(0x5555555555555555),
+    np.uint64(0x3333333333333333),
+    np.uint64(0x0F0F0F0F0F0F0F0F),
+    np.uint64(0x0101010101010101),
+)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """Number of set bits in each row of a rows × n_words uint64 array."""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    # SWAR popcount, one pass per step over the whole array
+    x = words - ((words >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return ((x * _H01) >> np.uint64(56)).sum(axis=1, dtype=np.int64)
+
+
+class CoverageCube(NamedTuple):
+    rows: pd.MultiIndex  # country_iso3, country_name, year; sorted
+    indicators: list[str]  # bit order
+    words: np.ndarray  # len(rows) × ceil(len(indicators) / 64), uint64
+
+    def mask(self, indicators: list[str]) -> np.ndarray:
+        """Word mask with the bits of `indicators` set (unknown ids are ignored)."""
+        out = np.zeros(self.words.shape[1], dtype=np.uint64)
+        pos = {ind: i for i, ind in enumerate(self.indicators)}
+        for ind in indicators:
+            if ind in pos:
+                out[pos[ind] // 64] |= np.uint64(1) << np.uint64(pos[ind] % 64)
+        return out
+
+    def available_count(self, indicators: list[str] | None = None) -> np.ndarray:
+        """Per row, how many of `indicators` (default: all) have a value."""
+        if indicators is None:
+            return popcount(self.words)
+        return popcount(self.words & self.mask(indicators))
+
+    def has(self, indicator: str) -> np.ndarray:
+        return (self.words & self.mask([indicator])).any(axis=1)
+
+    def flags(self, indicators: list[str]) -> pd.DataFrame:
+        """Boolean row × indicator availability table."""
+        return pd.DataFrame({ind: self.has(ind) for ind in indicators}, index=self.rows)
+
+    def missing(self, indicators: list[str]) -> pd.Series:
+        """Per row, the list of `indicators` without a value."""
+        gaps = ~self.flags(indicators).to_numpy()
+        names = np.array(indicators, dtype=object)
+        return pd.Series([list(names[g]) for g in gaps], index=self.rows)
+
+    def group_flags(self, groups: list[list[str]]) -> np.ndarray:
+        """rows × groups: does the row have any indicator of each group."""
+        return np.column_stack(
+            [(self.words & self.mask(g)).any(axis=1) for g in groups]
+        ).reshape(len(self.rows), len(groups))
+
+    def at_least(self, n: int, groups: list[list[str]]) -> np.ndarray:
+        """Rows with at least n groups (e.g. index buckets) present."""
+        return self.group_flags(groups).sum(axis=1) >= n
+
+    def reindex(self, rows: pd.MultiIndex) -> "CoverageCube":
+        """The cube for `rows` (in that order); unknown rows have no bits set."""
+        pos = self.rows.get_indexer(rows)
+        words = np.zeros((len(rows), self.words.shape[1]), dtype=np.uint64)
+        words[pos >= 0] = self.words[pos[pos >= 0]]
+        return CoverageCube(rows, self.indicators, words)
+
+
+def build(base: Path | None = None, observed: bool = False) -> CoverageCube:
+    """Scan the interim dataset once and pack availability into bits
+    (observed=True: leaving gap-filled rows out)."""
+    cube, observed_cube = build_both(base)
+    return observed_cube if observed else cube
+
+
+def build_both(base: Path | None = None) -> tuple[CoverageCube, CoverageCube]:
+    """The cube and its OBSERVED counterpart from a single scan.
+
+    Only headline rows count: a disaggregated value (sex, location, ...) does
+    not make the national series present.
+    """
+    columns = KEYS + ["indicator_id", "value", "disagg_type", "is_imputed"]
+    df = store.scan(columns=columns, base=base)
+    # rows without an ISO3 code (regional aggregates) are not country-years
+    df = df[df["disagg_type"].isna()].dropna(subset=KEYS)
+    imputed = df["is_imputed"].to_numpy(dtype=bool)
+    cube = _pack(df)
+    return cube, (_pack(df[~imputed]) if imputed.any() else cube)
+
+
+def _pack(df: pd.DataFrame) -> CoverageCube:
+    indicators = sorted(df["indicator_id"].dropna().unique())
+    groups = df.groupby(KEYS, sort=True, observed=True)
+    rows = groups.size().index
+    row_of = groups.ngroup().to_numpy()
+
+    words = np.zeros((len(rows), max(1, -(-len(indicators) // 64))), dtype=np.uint64)
+    bit = pd.Categorical(df["indicator_id"], categories=indicators).codes
+    present = np.isfinite(pd.to_numeric(df["value"], errors="coerce")).to_numpy()
+    present &= bit >= 0
+    bit = bit[present].astype(np.uint64)
+    np.bitwise_or.at(
+        words,
+        (row_of[present], (bit // 64).astype(np.intp)),
+        np.uint64(1) << (bit % np.uint64(64)),
+    )
+    return CoverageCube(rows, indicators, words)
+
+
+def save(cube: CoverageCube, path: Path = CUBE) -> Path:
+    frame = cube.rows.to_frame(index=False)
+    for j in range(cube.words.shape[1]):
+        frame[f"w{j}"] = cube.words[:, j]
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    meta = {**table.schema.metadata, b"indicators": json.dumps(cube.indicators)}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table.replace_schema_metadata(meta), tmp)
+    tmp.replace(path)
+    return path
+
+
+def load(path: Path = CUBE) -> CoverageCube:
+    """The stored cube (or OBSERVED); built from the dataset (and saved) if
+    there is none."""
+    if not path.exists():
+        logger.warning(f"No {path}, building it from {store.DATASET}")
+        cube = build(observed=path == OBSERVED)
+        save(cube, path)
+        return cube
+    table = pq.read_table(path)
+    indicators = json.loads(table.schema.metadata[b"indicators"])
+    frame = table.to_pandas()
+    word_cols = [c for c in frame.columns if c not in KEYS]
+    words = frame[word_cols].to_numpy(dtype=np.uint64)
+    return CoverageCube(pd.MultiIndex.from_frame(frame[KEYS]), indicators, words)
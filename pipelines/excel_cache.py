@@ -0,0 +1,118 @@
+# pipelines/excel_cache.py
+"""Parquet sidecars for Excel inputs.
+
+Parsing .xls/.xlsx is the slowest I/O in the pipeline, so each workbook is
+parsed once and stored as <sha256>.<engine>-<version>.parquet under
+<data_dir>/cache/excel: the parser (fastexcel or pandas) is part of the key,
+as the two do not type cells alike, so installing or upgrading one rebuilds
+the sidecars. A small stamp per source file (size, mtime_ns -> sha256) means
+unchanged files are not even re-hashed. Sidecars are evicted least-recently-used once the
+cache grows past settings.excel_cache_mb.
+"""
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import instrument
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import settings
+from loguru import logger
+
+CACHE_DIR = settings.data_dir / "cache" / "excel"
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _content_hash(path: Path) -> str:
+    st = path.stat()
+    key = hashlib.sha1(str(path.resolve()).encode()).hexdigest()  # noqa: S324
+    stamp = CACHE_DIR / f"{key}.stamp.json"
+    if stamp.exists():
+        s = json.loads(stamp.read_text())
+        if s["size"] == st.st_size and s["mtime_ns"] == st.st_mtime_ns:
+            return s["sha256"]
+    digest = _sha256(path)
+    tmp = stamp.with_name(f"{stamp.name}.{os.getpid()}.tmp")
+    tmp.write_text(
+        json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest})
+    )
+    tmp.replace(stamp)
+    return digest
+
+
+@functools.cache
+def _engine() -> tuple[str, str]:
+    """Name and version of the parser: fastexcel (calamine) when installed."""
+    try:
+        import fastexcel
+    except ImportError:
+        return "pandas", pd.__version__
+    return "fastexcel", fastexcel.__version__
+
+
+@instrument.timed("excel_cache.parse")
+def _parse(path: Path) -> pa.Table:
+    """First sheet as an Arrow table, read with the _engine() parser."""
+    if _engine()[0] == "fastexcel":
+        import fastexcel
+
+        batch = fastexcel.read_excel(path).load_sheet(0).to_arrow()
+        return pa.Table.from_batches([batch])
+
+    df = pd.read_excel(path)
+    df.columns = [str(c) for c in df.columns]  # Parquet needs string names
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # mixed object columns (numbers next to footnote markers): keep as text
+        for c in df.select_dtypes(include="object").columns:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _evict(keep: Path) -> None:
+    cap = settings.excel_cache_mb * 2**20
+    sidecars = [(p, p.stat()) for p in CACHE_DIR.glob("*.parquet")]
+    total = sum(st.st_size for _, st in sidecars)
+    for p, st in sorted(sidecars, key=lambda x: x[1].st_mtime):
+        if total <= cap:
+            break
+        if p != keep:
+            p.unlink(missing_ok=True)
+            total -= st.st_size
+            logger.info(f"Evicted {p.name} from Excel cache")
+
+
+def sidecar(path: Path) -> Path:
+    """Path of the Parquet sidecar for an Excel file, building it if needed."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    engine, version = _engine()
+    side = CACHE_DIR / f"{_content_hash(path)}.{engine}-{version}.parquet"
+    if side.exists():
+        os.utime(side)  # mtime doubles as last-used time for LRU
+        return side
+    table = _parse(path)
+    tmp = side.with_name(f"{side.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp)
+    tmp.replace(side)
+    logger.info(f"Cached {path.name} as {side.name}")
+    _evict(keep=side)
+    return side
+
+
+def read_excel_cached(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    return pd.read_parquet(sidecar(path), columns=columns)
+
+
+def excel_columns(path: Path) -> list[str]:
+    return pq.read_schema(sidecar(path)).names
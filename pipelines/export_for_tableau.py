@@ -1,130 +1,246 @@
 # pipelines/export_for_tableau.py
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+import arrow_io
+import coverage_cube
+import gapfill
+import instrument
 import pandas as pd
+import registry
+import store
+from config import settings
+from countries import is_country
 from loguru import logger
-from country_converter import CountryConverter
-
-BASE = Path("data/interim")
-OUT = Path("data/public")
-OUT.mkdir(parents=True, exist_ok=True)
-
-# Map each indicator to a friendly Tableau name + bucket
-INDICATORS = {
-    "SE.PRM.CMPT.ZS": ("Participation_completion", "Participation"),
-    "SDG_4.1.1_read": ("Learning_proficiency", "Learning"),
-    "SDG_4.2.2": ("EarlyChildhood_participation", "EarlyChildhood"),
-    "SDG_4.5.1_GPI_SEC": ("Equity_gender_parity", "Equity"),  # closer to 1 is better
-    "SDG_4.a.1_elec": ("Infrastructure_electricity", "Infrastructure"),
-    "SDG_4.c.1_prim": ("Teachers_trained", "Teachers"),
+
+BASE = settings.data_dir / "interim"
+OUT = settings.data_dir / "public"
+PARQUET_OUT = OUT / "parquet"  # same tables as the CSVs (Tableau reads Parquet too)
+ARROW_OUT = OUT / "arrow"  # memory-mappable, year-indexed copies (see arrow_io)
+# tables only exported when their interim input is as new as the index
+OPTIONAL = ("inequity_index_intervals", "inequity_index_disagg")
+
+RENAME = {
+    "country_iso3": "ISO3",
+    "country_name": "Country",
+    "year": "Year",
+    "value": "Value",
+    "inequity_index": "InequityIndex",
+    "index_lo": "IndexLow",
+    "index_hi": "IndexHigh",
+    "index_std": "IndexStd",
+    "rank": "Rank",
+    "rank_lo": "RankLow",
+    "rank_hi": "RankHigh",
+    "disagg_type": "DisaggType",
+    "disagg_value": "DisaggValue",
 }
 
-cc = CountryConverter()
+
+def _indicators() -> dict[str, tuple[str, str | None]]:
+    """Each registry indicator's friendly Tableau name and bucket."""
+    return {i.indicator_id: (i.label, i.bucket or None) for i in registry.load()}
 
 
 def _filter_countries(df: pd.DataFrame) -> pd.DataFrame:
-    iso = pd.Series(
-        cc.convert(df["country_iso3"].astype(str), to="ISO3", not_found=None),
-        index=df.index,
+    return df[is_country(df["country_iso3"])].copy()
+
+
+@instrument.timed("export.load_indicators")
+def load_indicators() -> pd.DataFrame:
+    """Every exported indicator, all years, observed headline country rows only:
+    read once.
+
+    Values filled in by gapfill are left out (rows it added dropped, rows it
+    filled in place empty, as harmonize wrote them); they only feed the index.
+    So are disaggregated values; their index is exported by export_disagg.
+    """
+    available = set(store.available_indicators())
+    indicators = _indicators()
+    for ind in indicators:
+        if ind not in available:
+            logger.warning(f"Missing {store.indicator_dir(ind)} — skipping")
+    columns = ["country_iso3", "country_name", "year", "indicator_id", "value"]
+    df = store.scan(
+        columns=[*columns, "is_imputed", "obs_status", "disagg_type"],
+        indicators=[ind for ind in indicators if ind in available],
     )
-    return df[iso.notna()].copy()
+    df = gapfill.unfill(df[df["disagg_type"].isna()])
+    return _filter_countries(df[columns])
 
 
-def export_index():
-    p = BASE / "inequity_index.parquet"
-    if not p.exists():
-        logger.error(f"Missing {p}. Run pipelines/build_index.py first.")
-        return
-    df = pd.read_parquet(p)
-    df = _filter_countries(df)
-    df = df[(df["year"] >= 2015) & (df["year"] <= 2024)].copy()
-
+def export_index(index_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    df = _filter_countries(index_df)
     df["inequity_index"] = pd.to_numeric(df["inequity_index"], errors="coerce").round(3)
-    df = df.rename(
-        columns={
-            "country_iso3": "ISO3",
-            "country_name": "Country",
-            "year": "Year",
-            "inequity_index": "InequityIndex",
-        }
-    )
-    df[["ISO3", "Country", "Year", "InequityIndex"]].to_csv(
-        OUT / "inequity_index.csv", index=False
-    )
-    logger.success(f"Wrote {OUT/'inequity_index.csv'} ({len(df):,} rows)")
+    df = df.rename(columns=RENAME)[["ISO3", "Country", "Year", "InequityIndex"]]
+    # the sort below is not stable, so its row order depends on the year dtype:
+    # int64, as the published files were first written with (schema has int16)
+    df["Year"] = df["Year"].astype("Int64")
 
     # Latest year per country (handy for the opening map in Tableau)
-    latest = df.sort_values("Year").groupby("ISO3", as_index=False).tail(1)
-    latest.to_csv(OUT / "inequity_index_latest.csv", index=False)
-    logger.success(f"Wrote {OUT/'inequity_index_latest.csv'} ({len(latest):,} rows)")
+    latest = (
+        df.sort_values("Year").groupby("ISO3", as_index=False, observed=True).tail(1)
+    )
+    return {"inequity_index": df, "inequity_index_latest": latest}
 
 
-def export_indicators_long():
-    frames = []
-    for ind, (alias, bucket) in INDICATORS.items():
-        p = BASE / f"{ind}.parquet"
-        if not p.exists():
-            logger.warning(f"Missing {p} — skipping")
-            continue
-        d = pd.read_parquet(p)[["country_iso3", "country_name", "year", "value"]].copy()
-        d = _filter_countries(d)
-        d = d[
-            (pd.to_numeric(d["year"], errors="coerce") >= 2010)
-            & (pd.to_numeric(d["year"], errors="coerce") <= 2024)
-        ]
-        d["IndicatorID"] = ind
-        d["Indicator"] = alias
-        d["Bucket"] = bucket
-        d = d.rename(
-            columns={
-                "country_iso3": "ISO3",
-                "country_name": "Country",
-                "year": "Year",
-                "value": "Value",
-            }
-        )
-        d["Value"] = pd.to_numeric(d["Value"], errors="coerce").round(3)
-        frames.append(d)
-
-    if not frames:
-        logger.error("No indicator files found to export.")
-        return
+def export_intervals(unc_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    df = _filter_countries(unc_df)
+    for c in ["inequity_index", "index_lo", "index_hi", "index_std"]:
+        df[c] = df[c].round(3)
+    cols = ["ISO3", "Country", "Year", "InequityIndex", "IndexLow", "IndexHigh"]
+    df = df.rename(columns=RENAME)
+    df = df[[*cols, "IndexStd", "Rank", "RankLow", "RankHigh"]]
+    return {"inequity_index_intervals": df.reset_index(drop=True)}
+
 
-    long_df = pd.concat(frames, ignore_index=True)
-    long_df = long_df[
+def export_disagg(disagg_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """National and per-slice index in one table; national rows have no
+    DisaggType."""
+    df = _filter_countries(disagg_df)
+    df["inequity_index"] = pd.to_numeric(df["inequity_index"], errors="coerce").round(3)
+    df = df.rename(columns=RENAME)
+    cols = ["DisaggType", "DisaggValue", "ISO3", "Country", "Year", "InequityIndex"]
+    return {"inequity_index_disagg": df[cols].reset_index(drop=True)}
+
+
+def export_indicators_long(ind_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    years = pd.to_numeric(ind_df["year"], errors="coerce")
+    d = ind_df[(years >= 2010) & (years <= 2024)].rename(columns=RENAME)
+    d["IndicatorID"] = d.pop("indicator_id")
+    indicators = _indicators()
+    d["Indicator"] = d["IndicatorID"].map({k: v[0] for k, v in indicators.items()})
+    d["Bucket"] = d["IndicatorID"].map({k: v[1] for k, v in indicators.items()})
+    d["Value"] = pd.to_numeric(d["Value"], errors="coerce").astype(float).round(3)
+    long_df = d[
         ["ISO3", "Country", "Year", "Bucket", "Indicator", "IndicatorID", "Value"]
-    ]
-    long_df.to_csv(OUT / "indicators_long.csv", index=False)
-    logger.success(f"Wrote {OUT/'indicators_long.csv'} ({len(long_df):,} rows)")
+    ].reset_index(drop=True)
+    return {"indicators_long": long_df}
 
 
-def export_coverage():
+def export_coverage(cube: coverage_cube.CoverageCube) -> dict[str, pd.DataFrame]:
     # Optional: a quick coverage table for Tableau filters/labels
-    from collections import defaultdict
-
-    counts = defaultdict(int)
-    for ind in INDICATORS:
-        p = BASE / f"{ind}.parquet"
-        if p.exists():
-            d = pd.read_parquet(p)[
-                ["country_iso3", "country_name", "year", "value"]
-            ].copy()
-            d = _filter_countries(d)
-            d = d.dropna(subset=["value"])
-            for tup in d[["country_iso3", "country_name", "year"]].itertuples(
-                index=False, name=None
-            ):
-                counts[tup] += 1
-    if not counts:
-        return
-    cov = pd.DataFrame(
-        [(iso3, cname, yr, c) for (iso3, cname, yr), c in counts.items()],
-        columns=["ISO3", "Country", "Year", "AvailableIndicators"],
-    )
-    cov.to_csv(OUT / "coverage.csv", index=False)
-    logger.success(f"Wrote {OUT/'coverage.csv'} ({len(cov):,} rows)")
+    cov = cube.rows.to_frame(index=False).rename(columns=RENAME)
+    cov["AvailableIndicators"] = cube.available_count(list(_indicators()))
+    cov = cov[is_country(cov["ISO3"]) & (cov["AvailableIndicators"] > 0)]
+    return {"coverage": cov.reset_index(drop=True)}
+
+
+def _write(
+    name: str,
+    df: pd.DataFrame,
+    parquet: bool,
+    arrow: bool = True,
+    parent: str | None = None,
+) -> list[Path]:
+    paths = [OUT / f"{name}.csv"]
+    with instrument.step(f"export.csv:{name}", len(df), parent) as s:
+        df.to_csv(paths[0], index=False)
+        s.rows_out = len(df)
+    if parquet:
+        paths.append(PARQUET_OUT / f"{name}.parquet")
+        with instrument.step(f"export.parquet:{name}", len(df), parent) as s:
+            df.to_parquet(paths[-1], index=False)
+            s.rows_out = len(df)
+    if arrow:
+        paths.append(ARROW_OUT / f"{name}.arrow")
+        with instrument.step(f"export.arrow:{name}", len(df), parent) as s:
+            arrow_io.write(df, paths[-1], year="Year")
+            s.rows_out = len(df)
+    return paths
+
+
+def remove_stale(tables: dict[str, pd.DataFrame]) -> None:
+    """Delete the copies of optional tables left out of this export, so none
+    from an older index (e.g. intervals, when uncertainty was skipped) remain."""
+    for name in OPTIONAL:
+        if name in tables:
+            continue
+        for p in (
+            OUT / f"{name}.csv",
+            PARQUET_OUT / f"{name}.parquet",
+            ARROW_OUT / f"{name}.arrow",
+        ):
+            if p.exists():
+                p.unlink()
+                logger.warning(f"Removed {p}, which belongs to an older index")
+
+
+def write_outputs(
+    tables: dict[str, pd.DataFrame], parquet: bool = True, arrow: bool = True
+) -> None:
+    """Write every table (CSV, plus Parquet / Arrow if asked) on a thread pool."""
+    OUT.mkdir(parents=True, exist_ok=True)
+    if parquet:
+        PARQUET_OUT.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=len(tables) or 1) as pool:
+        futures = {
+            name: pool.submit(
+                _write, name, df, parquet, arrow, parent=instrument.current()
+            )
+            for name, df in tables.items()
+        }
+    for name, fut in futures.items():
+        for p in fut.result():
+            logger.success(f"Wrote {p} ({len(tables[name]):,} rows)")
+
+
+@instrument.timed("export")
+def export_all(
+    parquet: bool = True,
+    index_df: pd.DataFrame | None = None,
+    cube: coverage_cube.CoverageCube | None = None,
+    arrow: bool = True,
+) -> dict[str, pd.DataFrame]:
+    """Write every Tableau table; index_df / cube (the observed-only coverage
+    cube) can be handed in from memory."""
+    tables = {}
+    p = BASE / "inequity_index.parquet"
+    if index_df is not None:
+        years = index_df["year"]
+        tables |= export_index(index_df[(years >= 2015) & (years <= 2024)])
+    elif p.exists():
+        tables |= export_index(store.read_file(p, years=(2015, 2024)))
+    else:
+        logger.error(f"Missing {p}. Run pipelines/build_index.py first.")
+
+    u = BASE / "index_uncertainty.parquet"
+    if u.exists() and p.exists() and u.stat().st_mtime < p.stat().st_mtime:
+        logger.warning(f"{u} is older than {p}; skipping the index intervals")
+    elif u.exists():
+        tables |= export_intervals(store.read_file(u, years=(2015, 2024)))
+
+    d = BASE / "inequity_index_disagg.parquet"
+    if d.exists() and p.exists() and d.stat().st_mtime < p.stat().st_mtime:
+        logger.warning(f"{d} is older than {p}; skipping the disaggregated index")
+    elif d.exists():
+        tables |= export_disagg(store.read_file(d, years=(2015, 2024)))
+
+    ind_df = load_indicators()
+    if ind_df.empty:
+        logger.error("No indicator files found to export.")
+    else:
+        tables |= export_indicators_long(ind_df)
+        tables |= export_coverage(cube or coverage_cube.load(coverage_cube.OBSERVED))
+
+    write_outputs(tables, parquet=parquet, arrow=arrow)
+    remove_stale(tables)
+    return tables
 
 
 if __name__ == "__main__":
-    export_index()
-    export_indicators_long()
-    export_coverage()
+    parser = argparse.ArgumentParser(description="Export Tableau-ready tables")
+    parser.add_argument(
+        "--no-parquet", action="store_true", help="skip the Parquet copies"
+    )
+    parser.add_argument(
+        "--no-arrow", action="store_true", help="skip the Arrow IPC copies"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="record timings/memory per step"
+    )
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+    export_all(parquet=not args.no_parquet, arrow=not args.no_arrow)
@@ -0,0 +1,273 @@
+# pipelines/gapfill.py
+"""Panel gap-filling between harmonize and build_index.
+
+Each indicator is laid out as a series × year array (a series is one country,
+unit, source and disaggregation) and missing years are filled, in order, by
+
+    interpolate   linear interpolation across gaps of at most max_gap years
+    locf          last observation carried forward, at most max_gap years
+    region        mean of the observed countries in the same UN sub-region
+                  and year (at least MIN_REGION_COUNTRIES; headline series
+                  only)
+
+No method is on by default (GAPFILL_METHODS, --methods): filled values change
+the published index, so they are asked for, not assumed.
+
+Every step is a whole-array NumPy operation; there is no loop over
+countries. Filled cells are written back into the dataset with
+is_imputed=True: a cell that has an empty row gets its value in that row, one
+without a row gets a new row (obs_status schema.GAPFILL_STATUS), so a
+(country, year, disaggregation) key still has one row. The filled table is
+validated (validate.py) like harmonize's, and the coverage cube is rebuilt,
+so build_index counts filled cells as present (coverage reports and exports
+use the observed-only cube). Earlier fills are undone before filling (added
+rows dropped, filled rows emptied again), which makes the stage idempotent;
+an indicator whose partitions and settings are unchanged since the last run
+is not touched (see MANIFEST).
+"""
+import argparse
+import json
+
+import coverage_cube
+import harmonize
+import index_state
+import instrument
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import schema
+import store
+import validate
+from config import settings
+from countries import is_country, un_region
+from loguru import logger
+
+MANIFEST = settings.data_dir / "interim" / "_gapfill.json"
+METHODS = ("interpolate", "locf", "region")
+MIN_REGION_COUNTRIES = 3
+SERIES = [
+    "country_iso3",
+    "country_name",
+    "unit",
+    "source",
+    "disagg_type",
+    "disagg_value",
+]
+
+
+def parse_methods(text: str) -> list[str]:
+    methods = [m.strip() for m in text.split(",") if m.strip()]
+    unknown = sorted(set(methods) - set(METHODS))
+    if unknown:
+        raise ValueError(f"Unknown gap-fill method(s) {unknown}; pick from {METHODS}")
+    return [m for m in METHODS if m in methods]
+
+
+def fill_panel(
+    x: np.ndarray,
+    methods: list[str],
+    max_gap: int = 3,
+    region: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fill NaN cells of a series × year array.
+
+    Returns the filled array and, per cell, 0 for untouched or 1 + the
+    position in METHODS of the method that filled it. region gives each
+    series a region code (-1: no regional fill); the regional mean uses
+    observed values only.
+    """
+    n, t = x.shape
+    valid = ~np.isnan(x)
+    out = x.copy()
+    how = np.zeros(x.shape, dtype=np.int8)
+    cols = np.arange(t)
+    # nearest observed year at or before / at or after each cell (-1 / t: none)
+    prev = np.maximum.accumulate(np.where(valid, cols, -1), axis=1)
+    nxt = np.minimum.accumulate(np.where(valid, cols, t)[:, ::-1], axis=1)[:, ::-1]
+    x_prev = np.take_along_axis(x, np.maximum(prev, 0), axis=1)
+    x_next = np.take_along_axis(x, np.minimum(nxt, t - 1), axis=1)
+
+    if "interpolate" in methods:
+        cell = ~valid & (prev >= 0) & (nxt < t) & (nxt - prev - 1 <= max_gap)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = (cols - prev) / (nxt - prev)
+        out[cell] = (x_prev + (x_next - x_prev) * frac)[cell]
+        how[cell] = 1 + METHODS.index("interpolate")
+
+    if "locf" in methods:
+        cell = ~valid & (how == 0) & (prev >= 0) & (cols - prev <= max_gap)
+        out[cell] = x_prev[cell]
+        how[cell] = 1 + METHODS.index("locf")
+
+    if "region" in methods and region is not None and n:
+        ok = region >= 0
+        n_regions = int(region.max()) + 1 if ok.any() else 0
+        flat = (region[:, None] * t + cols)[ok[:, None] & valid]
+        sums = np.bincount(
+            flat, weights=x[ok[:, None] & valid], minlength=n_regions * t
+        )
+        counts = np.bincount(flat, minlength=n_regions * t)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts >= MIN_REGION_COUNTRIES, sums / counts, np.nan)
+        means = means.reshape(n_regions, t)
+        cand = np.full(x.shape, np.nan)
+        cand[ok] = means[region[ok]]
+        cell = ~valid & (how == 0) & ~np.isnan(cand)
+        out[cell] = cand[cell]
+        how[cell] = 1 + METHODS.index("region")
+    return out, how
+
+
+def unfill(df: pd.DataFrame) -> pd.DataFrame:
+    """The rows as they were before gapfill: added rows dropped, filled ones
+    empty again."""
+    imputed = df["is_imputed"].to_numpy(dtype=bool)
+    added = imputed & (df["obs_status"] == schema.GAPFILL_STATUS).to_numpy()
+    df = df[~added].reset_index(drop=True)
+    imputed = df["is_imputed"].to_numpy(dtype=bool)
+    if imputed.any():
+        df["value"] = df["value"].mask(imputed)
+        df["is_imputed"] = False
+    return df
+
+
+def fill_indicator(
+    df: pd.DataFrame, methods: list[str], max_gap: int = 3
+) -> tuple[pd.DataFrame, dict[str, int]]:
+    """One indicator's rows with gaps filled, and the number of cells per method."""
+    df = unfill(df)
+    counts = dict.fromkeys(methods, 0)
+    years = df["year"].to_numpy(dtype="float64")
+    if df.empty or not methods or np.isnan(years).all():
+        return df, counts
+
+    sid = df.groupby(SERIES, observed=True, dropna=False, sort=False).ngroup()
+    sid = sid.to_numpy()
+    y0 = int(np.nanmin(years))
+    col = (years - y0).astype(np.int64)
+    x = np.full((sid.max() + 1, int(np.nanmax(years)) - y0 + 1), np.nan)
+    value = df["value"].to_numpy(dtype="float64", na_value=np.nan)
+    dated = ~np.isnan(years)
+    has = dated & ~np.isnan(value)
+    x[sid[has], col[has]] = value[has]
+    # the empty row of a cell, if it has one (-1: none)
+    row = np.full(x.shape, -1)
+    empty = np.flatnonzero(dated & ~has)
+    row[sid[empty], col[empty]] = empty
+
+    # one template row per series; only real countries are filled
+    _, first = np.unique(sid, return_index=True)
+    series = df.iloc[first][SERIES].reset_index(drop=True)
+    fillable = is_country(series["country_iso3"]).to_numpy()
+    region = None
+    if "region" in methods:
+        names = un_region(series["country_iso3"])
+        codes, _ = pd.factorize(names)
+        headline = series["disagg_type"].isna().to_numpy()
+        region = np.where(fillable & headline, codes, -1)
+
+    filled, how = fill_panel(x, methods, max_gap, region)
+    how[~fillable] = 0
+    s, c = np.nonzero(how)
+    for m in methods:
+        counts[m] = int((how[s, c] == 1 + METHODS.index(m)).sum())
+    if not len(s):
+        return df, counts
+
+    # filled in place where the cell has an empty row, else in a new row
+    r = row[s, c]
+    inplace = r >= 0
+    value = df["value"].to_numpy(copy=True)
+    value[r[inplace]] = filled[s, c][inplace]
+    df["value"] = value
+    df.loc[r[inplace], "is_imputed"] = True
+    s, c = s[~inplace], c[~inplace]
+    if not len(s):
+        return df, counts
+    added = series.iloc[s].reset_index(drop=True)
+    added["year"] = y0 + c
+    added["indicator_id"] = df["indicator_id"].iloc[0]
+    added["value"] = filled[s, c]
+    added["is_imputed"] = True
+    added["obs_status"] = schema.GAPFILL_STATUS
+    out = schema.concat([df, schema.cast(added[schema.COLUMNS])])
+    return out.reset_index(drop=True), counts
+
+
+def load_manifest() -> dict:
+    return json.loads(MANIFEST.read_text()) if MANIFEST.exists() else {}
+
+
+def save_manifest(manifest: dict) -> None:
+    tmp = MANIFEST.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp.replace(MANIFEST)
+
+
+@instrument.timed("gapfill")
+def main(
+    methods: list[str] | None = None,
+    max_gap: int | None = None,
+    force: bool = False,
+) -> coverage_cube.CoverageCube | None:
+    """Fill every indicator that changed; returns the rebuilt coverage cube, if any."""
+    methods = parse_methods(settings.gapfill_methods) if methods is None else methods
+    max_gap = settings.gapfill_max_gap if max_gap is None else max_gap
+    config = {"methods": methods, "max_gap": max_gap}
+    manifest = load_manifest()
+    if manifest.get("config") != config:
+        manifest = {"config": config, "indicators": {}}
+
+    written, reports = 0, {}
+    try:
+        for ind in store.available_indicators():
+            digests = index_state.partition_digests(ind)
+            if not force and manifest["indicators"].get(ind) == digests:
+                continue
+            with instrument.step(f"gapfill.fill:{ind}") as s:
+                df = store.scan(indicators=[ind])
+                out, counts = fill_indicator(df, methods, max_gap)
+                s.rows_out = len(out)
+            # rewrite when there is something to fill, or old fills to drop
+            if any(counts.values()) or df["is_imputed"].any():
+                table = schema.cast_table(
+                    pa.Table.from_pandas(out, preserve_index=False)
+                )
+                try:
+                    reports[ind] = validate.run(table, ind)
+                except validate.ValidationError as e:
+                    reports[ind] = e.result
+                    raise
+                store.write_indicator(table, ind)
+                written += 1
+            filled = ", ".join(f"{n:,} by {m}" for m, n in counts.items() if n)
+            logger.info(f"{ind}: {filled or 'nothing'} filled")
+            manifest["indicators"][ind] = index_state.partition_digests(ind)
+    finally:
+        if reports:
+            validate.save_report(reports)
+        save_manifest(manifest)
+    cubes = (coverage_cube.CUBE, coverage_cube.OBSERVED)
+    if written or not all(c.exists() for c in cubes):
+        return harmonize.write_coverage()
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill gaps in the interim panel")
+    parser.add_argument(
+        "--methods",
+        default=settings.gapfill_methods,
+        help=f"comma-separated, from {', '.join(METHODS)} ('' drops all fills)",
+    )
+    parser.add_argument("--max-gap", type=int, default=settings.gapfill_max_gap)
+    parser.add_argument(
+        "--force", action="store_true", help="refill every indicator, ignore manifest"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="record timings/memory per step"
+    )
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+    main(parse_methods(args.methods), args.max_gap, args.force)
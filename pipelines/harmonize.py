@@ -1,24 +1,41 @@
 # pipelines/harmonize.py
-import pandas as pd
+import argparse
+import csv
+import hashlib
+import json
+import zipfile
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
 from pathlib import Path
-from loguru import logger
+from typing import NamedTuple
+
+import coverage_cube
+import instrument
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import registry
+import schema
+import store
+import validate
 from config import settings
-import zipfile
+from loguru import logger
 from tidy_unesco import tidy_unesco_file  # ensure this import matches the new helper
 
-SCHEMA = [
-    "country_iso3",
-    "country_name",
-    "year",
-    "indicator_id",
-    "value",
-    "unit",
-    "source",
-    "disagg_type",
-    "disagg_value",
-    "is_imputed",
-    "obs_status",
-]
+# Bump when tidy_wb_zip / tidy_unesco_file change their output (or gapfill the
+# way it marks its rows), so every interim indicator is rebuilt on the next run.
+PARSER_VERSION = 7
+MANIFEST = "_manifest.json"  # per-output input hash + parser version, in data/interim
+# indicators uis_bulk wrote from the UIS bulk export, also in data/interim: they
+# are left alone here unless --force takes them back
+BULK_MANIFEST = "_uis_bulk.json"
+
+
+class Job(NamedTuple):
+    indicator_id: str
+    source: str  # "WorldBank" or "UNESCO"
+    raw_path: Path
+    unit: str
 
 
 def tidy_wb_zip(zip_path: Path, indicator_id: str, unit: str):
@@ -28,11 +45,18 @@ def tidy_wb_zip(zip_path: Path, indicator_id: str, unit: str):
             f for f in z.namelist() if f.endswith(".csv") and f.startswith("API_")
         ][0]
         with z.open(csv_name) as f:
-            df = pd.read_csv(f, header=2)
+            # round_trip: correctly rounded floats, same as the Arrow reader
+            df = pd.read_csv(
+                f, header=2, na_values=[".."], float_precision="round_trip"
+            )
 
     # Reshape wide (years as columns) → long (one row per country-year)
+    year_cols = [c for c in df.columns if str(c).isdigit() and len(str(c)) == 4]
     df = df.melt(
-        id_vars=["Country Name", "Country Code"], var_name="year", value_name="value"
+        id_vars=["Country Name", "Country Code"],
+        value_vars=year_cols,
+        var_name="year",
+        value_name="value",
     )
     df = df.rename(
         columns={"Country Code": "country_iso3", "Country Name": "country_name"}
@@ -46,10 +70,6 @@ def tidy_wb_zip(zip_path: Path, indicator_id: str, unit: str):
     df["value"] = df["value"].replace("..", pd.NA)
     df["value"] = pd.to_numeric(df["value"], errors="coerce")
 
-    # Ensure proper data types for all columns
-    df["country_iso3"] = df["country_iso3"].astype("string")
-    df["country_name"] = df["country_name"].astype("string")
-    df["year"] = df["year"].astype("Int64")  # Nullable integer type
     df["indicator_id"] = indicator_id
     df["unit"] = unit
     df["source"] = "WorldBank"
@@ -58,8 +78,72 @@ def tidy_wb_zip(zip_path: Path, indicator_id: str, unit: str):
     df["is_imputed"] = False
     df["obs_status"] = pd.NA
 
-    df = df[SCHEMA]
-    return df
+    # Compact dtypes for all columns (see schema.py)
+    return schema.cast(df[schema.COLUMNS])
+
+
+def _constant(value, n: int) -> pa.DictionaryArray:
+    """n copies of value as a one-entry dictionary (no per-row Python objects)."""
+    return pa.DictionaryArray.from_arrays(
+        pa.array(np.zeros(n, dtype=np.int8)), pa.array([value])
+    )
+
+
+def tidy_wb_zip_arrow(zip_path: Path, indicator_id: str, unit: str) -> pa.Table:
+    """Arrow/NumPy version of tidy_wb_zip: same rows and schema, as a Table.
+
+    Only the country and year columns are parsed, the wide → long reshape is
+    a NumPy repeat/ravel, and constant columns are dictionary-encoded.
+    """
+    with zipfile.ZipFile(zip_path) as z:
+        csv_name = [
+            f for f in z.namelist() if f.endswith(".csv") and f.startswith("API_")
+        ][0]
+        data = z.read(csv_name)
+
+    # Skip the "Data Source" / "Last Updated Date" preamble
+    start = data.index(b'"Country Name"')
+    header_line = data[start : data.index(b"\n", start)].decode("utf-8")
+    header = next(csv.reader([header_line]))
+    years = [c for c in header if c.isdigit() and len(c) == 4]
+    id_cols = ["Country Name", "Country Code"]
+    wide = pacsv.read_csv(
+        pa.py_buffer(memoryview(data)[start:]),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=id_cols + years,
+            column_types={
+                **{c: pa.string() for c in id_cols},
+                **{y: pa.float64() for y in years},
+            },
+            null_values=["", ".."],
+            strings_can_be_null=True,
+        ),
+    )
+
+    # Year-major order, exactly like melt: all countries for year 1, then year 2...
+    n, k = wide.num_rows, len(years)
+    values = np.empty((k, n), dtype=schema.VALUE_DTYPE)
+    for i, y in enumerate(years):
+        values[i] = wide.column(y).to_numpy(zero_copy_only=False)
+    rows = np.tile(np.arange(n), k)
+    total = n * k
+
+    table = pa.table(
+        {
+            "country_iso3": wide.column("Country Code").take(rows),
+            "country_name": wide.column("Country Name").take(rows),
+            "year": pa.array(np.repeat(np.array(years, dtype=np.int64), n)),
+            "indicator_id": _constant(indicator_id, total),
+            "value": pa.array(values.ravel(), from_pandas=True),
+            "unit": _constant(unit, total),
+            "source": _constant("WorldBank", total),
+            "disagg_type": pa.nulls(total),
+            "disagg_value": pa.nulls(total),
+            "is_imputed": pa.array(np.zeros(total, dtype=bool)),
+            "obs_status": pa.nulls(total),
+        }
+    )
+    return schema.cast_table(table)
 
 
 def _first_existing(base_dir, stem):
@@ -71,38 +155,214 @@ def _first_existing(base_dir, stem):
     return None
 
 
-def main():
-    raw = settings.data_dir / "raw"
-    interim = settings.data_dir / "interim"
-    interim.mkdir(parents=True, exist_ok=True)
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
 
-    # 1) World Bank as before...
-    wb_zip = raw / "wb_SE.PRM.CMPT.ZS.zip"
-    if wb_zip.exists():
-        df_wb = tidy_wb_zip(wb_zip, "SE.PRM.CMPT.ZS", "percent")
-        out = interim / "SE.PRM.CMPT.ZS.parquet"
-        df_wb.to_parquet(out, index=False)
-        logger.success(f"Wrote {out} with {len(df_wb):,} rows")
-
-    # 2) UNESCO tasks (stems without extension)
-    tasks = [
-        ("SDG_4.1.1_read", "SDG_4.1.1_read", "percent"),
-        ("SDG_4.2.2", "SDG_4.2.2", "percent"),
-        ("SDG_4.5.1_GPI_SEC", "SDG_4.5.1_GPI_SEC", "ratio"),
-        ("SDG_4.a.1_elec", "SDG_4.a.1_elec", "percent"),
-        ("SDG_4.c.1_prim", "SDG_4.c.1_prim", "percent"),
-    ]
+def load_manifest(interim: Path, name: str = MANIFEST) -> dict:
+    p = interim / name
+    return json.loads(p.read_text()) if p.exists() else {}
+
+
+def save_manifest(interim: Path, manifest: dict, name: str = MANIFEST) -> None:
+    p = interim / name
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp.replace(p)
+
+
+def collect_jobs(raw: Path) -> list[Job]:
+    """One job per registry indicator whose raw input exists."""
+    jobs = []
+    # 1) World Bank: the zips ingest_worldbank downloads, by code
+    for ind in registry.by_source("WorldBank"):
+        wb_zip = raw / f"wb_{ind.code}.zip"
+        if wb_zip.exists():
+            jobs.append(Job(ind.indicator_id, "WorldBank", wb_zip, ind.unit))
+
+    # 2) UNESCO files, named after the indicator id (any supported extension)
     base = raw / "unesco"
-    for ind, stem, unit in tasks:
-        fpath = _first_existing(base, stem)
+    for ind in registry.by_source("UNESCO"):
+        fpath = _first_existing(base, ind.indicator_id)
         if fpath:
-            df_u = tidy_unesco_file(fpath, ind, unit)
-            outp = interim / f"{ind}.parquet"
-            df_u.to_parquet(outp, index=False)
-            logger.success(f"Wrote {outp} with {len(df_u):,} rows")
+            jobs.append(Job(ind.indicator_id, "UNESCO", fpath, ind.unit))
+        else:
+            logger.warning(f"Missing UNESCO file for {ind.indicator_id} in {base}")
+    return jobs
+
+
+def stale_jobs(
+    jobs: list[Job], manifest: dict, force: bool = False, bulk: dict | None = None
+) -> list[tuple[Job, str]]:
+    """Jobs whose output is missing or was built from other input/parser version;
+    indicators in `bulk` (written by uis_bulk) only with force."""
+    stale = []
+    for job in jobs:
+        if not force and job.indicator_id in (bulk or {}):
+            logger.info(
+                f"{job.indicator_id}: kept from {bulk[job.indicator_id]['input']} "
+                f"(uis_bulk), not rebuilt from {job.raw_path}; --force to do so"
+            )
+            continue
+        digest = _sha256(job.raw_path)
+        entry = manifest.get(job.indicator_id, {})
+        if (
+            force
+            or not store.indicator_dir(job.indicator_id).exists()
+            or entry.get("input") != str(job.raw_path)
+            or entry.get("sha256") != digest
+            or entry.get("parser_version") != PARSER_VERSION
+            or entry.get("value_dtype", "float64") != schema.VALUE_DTYPE.name
+        ):
+            stale.append((job, digest))
+    return stale
+
+
+def run_job(job: Job, legacy_wb: bool = False) -> tuple[int, dict | None]:
+    """Tidy one raw input into its dataset partitions; returns rows written and
+    the validation result (None if validation is off)."""
+    with instrument.step(f"harmonize.tidy:{job.indicator_id}") as s:
+        if job.source == "WorldBank" and not legacy_wb:
+            data = tidy_wb_zip_arrow(job.raw_path, job.indicator_id, job.unit)
+        elif job.source == "WorldBank":
+            data = tidy_wb_zip(job.raw_path, job.indicator_id, job.unit)
         else:
-            logger.warning(f"Missing UNESCO file for {stem} in {base}")
+            data = tidy_unesco_file(job.raw_path, job.indicator_id, job.unit)
+        s.rows_out = len(data)
+    with instrument.step(f"harmonize.validate:{job.indicator_id}", len(data)):
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        data = schema.cast_table(data)
+        result = validate.run(data, job.indicator_id)  # raises in fail mode
+    with instrument.step(f"harmonize.write:{job.indicator_id}", len(data)) as s:
+        n = s.rows_out = store.write_indicator(data, job.indicator_id)
+    return n, result
+
+
+def write_coverage() -> coverage_cube.CoverageCube:
+    """Rebuild the coverage cube and its observed-only copy from the dataset
+    as it now stands; returns the first."""
+    with instrument.step("harmonize.coverage_cube") as s:
+        cube, observed = coverage_cube.build_both()
+        s.rows_out = len(cube.rows)
+    coverage_cube.save(cube)
+    coverage_cube.save(observed, coverage_cube.OBSERVED)
+    logger.success(
+        f"Wrote {coverage_cube.CUBE} ({len(cube.rows):,} country-years, "
+        f"{len(cube.indicators)} indicators)"
+    )
+    return cube
+
+
+def collect(futures: dict, manifest: dict, reports: dict):
+    """Record finished jobs in the manifest and their validation results in
+    reports; returns the first ValidationError (the jobs not yet started are
+    cancelled then), or None."""
+    failed = None
+    for fut in as_completed(futures):
+        job, digest = futures[fut]
+        out = store.indicator_dir(job.indicator_id)
+        try:
+            n, reports[job.indicator_id] = instrument.unwrap(fut.result())
+        except validate.ValidationError as e:
+            logger.error(f"Not writing {out}: {e}")
+            reports[job.indicator_id] = e.result
+            manifest.pop(job.indicator_id, None)
+            if failed is None:
+                failed = e
+                for f in futures:
+                    f.cancel()
+            continue
+        except CancelledError:
+            continue
+        except Exception as e:
+            logger.error(f"Failed to harmonize {job.raw_path}: {e!r}")
+            manifest.pop(job.indicator_id, None)
+            continue
+        manifest[job.indicator_id] = {
+            "input": str(job.raw_path),
+            "sha256": digest,
+            "parser_version": PARSER_VERSION,
+            "value_dtype": schema.VALUE_DTYPE.name,
+        }
+        logger.success(f"Wrote {out} with {n:,} rows")
+    return failed
+
+
+@instrument.timed("harmonize")
+def main(
+    force: bool = False,
+    dry_run: bool = False,
+    workers: int | None = None,
+    legacy_wb: bool = False,
+) -> coverage_cube.CoverageCube | None:
+    """Harmonize stale inputs; returns the rebuilt coverage cube, if any."""
+    raw = settings.data_dir / "raw"
+    interim = settings.data_dir / "interim"
+    interim.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(interim)
+    bulk = load_manifest(interim, BULK_MANIFEST)
+    jobs = collect_jobs(raw)
+    stale = stale_jobs(jobs, manifest, force, bulk)
+    logger.info(f"{len(stale)} of {len(jobs)} interim outputs stale")
+    if dry_run:
+        for job, _ in stale:  # to stdout, one per line, for scripts
+            print(  # noqa: T201
+                f"{store.indicator_dir(job.indicator_id)}  <-  {job.raw_path}"
+            )
+        return
+    if not stale:
+        cubes = (coverage_cube.CUBE, coverage_cube.OBSERVED)
+        return None if all(c.exists() for c in cubes) else write_coverage()
+
+    reports: dict[str, dict | None] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(instrument.traced_call, run_job, job, legacy_wb): (job, d)
+            for job, d in stale
+        }
+        failed = collect(futures, manifest, reports)
+    save_manifest(interim, manifest)
+    taken = [j.indicator_id for j, _ in stale if j.indicator_id in manifest]
+    if any(ind in bulk for ind in taken):  # rebuilt from the raw files
+        for ind in taken:
+            bulk.pop(ind, None)
+        save_manifest(interim, bulk, BULK_MANIFEST)
+    if reports:
+        validate.save_report(reports)
+    if failed is not None:
+        raise failed
+    return write_coverage()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Harmonize raw inputs to data/interim")
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild every output, ignore manifest"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only list the stale outputs"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--legacy-wb",
+        action="store_true",
+        help="parse World Bank ZIPs with the pandas read_csv/melt path",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="record timings/memory per step"
+    )
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+    main(
+        force=args.force,
+        dry_run=args.dry_run,
+        workers=args.workers,
+        legacy_wb=args.legacy_wb,
+    )
@@ -0,0 +1,325 @@
+# pipelines/index_state.py
+"""Persisted normalization state, so build_index only rereads what changed.
+
+Min-max scaling an indicator over every country and year means a single new
+year can move every score. Rather than the scores themselves,
+this keeps, per indicator,
+
+    stats.json      its normalization rule (registry.Rule), per-year min / max /
+                    count of the values that rule transformed (headline rows
+                    in "years", every row in "pooled"), and a content digest
+                    of each year partition of the dataset
+    cells.parquet   per disaggregation slice and country-year: number of
+                    rows, of valid values, and the sum of those values
+
+update() digests the indicator's year partitions and rereads only the years
+whose digest changed (a new year, a revised year), replacing their cells and
+year stats; an indicator whose rule changed is reread in full. Digests and
+rereads run on a thread pool (file hashing and DuckDB scans release the GIL),
+the rereads batched into READERS scans rather than one per indicator. Scores
+are an affine function of the stored sums,
+
+    mean norm = (sum / n - min) / (max - min)
+
+so when the global min/max shifts, or is frozen to a reference period, the
+stored cells are rescaled instead of recomputed from the dataset. Results
+match a full recompute up to floating-point rounding. Bump STATE_VERSION when
+the cell layout changes.
+
+The national index is scaled with the headline rows' min/max only, so
+disaggregated data arriving (e.g. from uis_bulk) does not move it. The
+disaggregation slices (sex, location, ...) are scaled with the "pooled"
+min/max of every row, headline and disaggregated alike, so their scores are
+comparable with each other.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import registry
+import schema
+import store
+from config import settings
+from countries import is_country
+from loguru import logger
+
+STATE_DIR = settings.data_dir / "interim" / "index_state"
+STATS = STATE_DIR / "stats.json"
+CELLS = STATE_DIR / "cells.parquet"
+STATE_VERSION = 3
+KEYS = ["country_iso3", "country_name", "year"]
+SLICE = ["disagg_type", "disagg_value"]  # both NA: the headline (national) rows
+READERS = 8  # indicators refreshed at once
+
+
+class IndexState(NamedTuple):
+    # indicator_id -> {"rule": [kind, target], "partitions": {year: digest},
+    #                  "years": {year: [min, max, n]}, "pooled": {...}}
+    indicators: dict[str, dict]
+    # indicator_id, SLICE, KEYS, n_rows, n_valid, t_sum
+    cells: pd.DataFrame
+
+
+def _empty() -> IndexState:
+    cells = schema.empty(["indicator_id", *SLICE, *KEYS])
+    cells["n_rows"] = cells["n_valid"] = pd.Series(dtype="int64")
+    cells["t_sum"] = pd.Series(dtype="float64")
+    return IndexState({}, cells)
+
+
+def load() -> IndexState:
+    """The stored state; empty when there is none or it is from another version."""
+    if not (STATS.exists() and CELLS.exists()):
+        return _empty()
+    meta = json.loads(STATS.read_text())
+    if meta.get("version") != STATE_VERSION:
+        logger.info(f"{STATS} is from another version, rebuilding the index state")
+        return _empty()
+    return IndexState(meta["indicators"], schema.cast(pd.read_parquet(CELLS)))
+
+
+def save(state: IndexState) -> None:
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    pid = os.getpid()
+    tmp = CELLS.with_name(f"{CELLS.name}.{pid}.tmp")
+    state.cells.to_parquet(tmp, index=False)
+    tmp.replace(CELLS)
+    tmp = STATS.with_name(f"{STATS.name}.{pid}.tmp")
+    meta = {"version": STATE_VERSION, "indicators": state.indicators}
+    tmp.write_text(json.dumps(meta, indent=2, sort_keys=True))
+    tmp.replace(STATS)
+
+
+def partition_digests(indicator_id: str) -> dict[str, str]:
+    """Content digest of each year partition of one indicator, by year."""
+    out = {}
+    for part in sorted(store.indicator_dir(indicator_id).glob("year=*")):
+        h = hashlib.blake2b(digest_size=16)
+        for f in sorted(part.glob("*.parquet")):
+            h.update(f.read_bytes())
+        out[part.name.split("=", 1)[1]] = h.hexdigest()
+    return out
+
+
+def _read_years(
+    stale: dict[str, list[int]], rules: dict[str, registry.Rule]
+) -> tuple[pd.DataFrame, dict[str, dict[str, dict[str, list]]]]:
+    """Cells and year stats ("years" and "pooled") of some years of some
+    indicators, countries only: one scan for all of them, whatever their
+    number."""
+    years = [y for ys in stale.values() for y in ys]
+    df = store.scan(
+        columns=["indicator_id", *SLICE, *KEYS, "value"],
+        indicators=list(stale),
+        years=(min(years), max(years)),
+    )
+    ids = df["indicator_id"].astype(object)
+    wanted = pd.MultiIndex.from_tuples(
+        [(ind, y) for ind, ys in stale.items() for y in ys]
+    )
+    at = pd.MultiIndex.from_arrays([ids, df["year"].astype("int64")])
+    keep = at.isin(wanted) & is_country(df["country_iso3"])
+    df, ids = df[keep], ids[keep]
+    x = pd.to_numeric(df["value"], errors="coerce").astype("float64")
+    t = registry.apply_rules(ids, x, rules)
+    df = df[["indicator_id", *SLICE, *KEYS]].assign(
+        t=t.replace([np.inf, -np.inf], np.nan)
+    )
+
+    stats = {ind: {"years": {}, "pooled": {}} for ind in stale}
+    headline = df["disagg_type"].isna().to_numpy()
+    for name, rows in (("years", df[headline]), ("pooled", df)):
+        by_year = rows.groupby(["indicator_id", "year"], observed=True)["t"].agg(
+            ["min", "max", "count"]
+        )
+        for (ind, y), mn, mx, n in by_year.itertuples(name=None):
+            stats[ind][name][str(y)] = [
+                None if pd.isna(mn) else float(mn),
+                None if pd.isna(mx) else float(mx),
+                int(n),
+            ]
+    keys = ["indicator_id", *SLICE, *KEYS]
+    cells = (
+        df.groupby(keys, observed=True, sort=False, dropna=False)["t"]
+        .agg(n_rows="size", n_valid="count", t_sum="sum")
+        .reset_index()
+        .dropna(subset=KEYS)  # dropna=False is for the NA (headline) slice only
+    )
+    return schema.cast(cells), stats
+
+
+def _batches(stale: dict[str, list[int]], n: int) -> list[dict[str, list[int]]]:
+    """stale split into at most n parts of about the same number of partitions."""
+    out = [{} for _ in range(min(n, len(stale)))]
+    sizes = [0] * len(out)
+    for ind, years in sorted(stale.items(), key=lambda kv: -len(kv[1])):
+        i = sizes.index(min(sizes))
+        out[i][ind] = years
+        sizes[i] += len(years)
+    return out
+
+
+def _plan(
+    indicator_id: str, rule: registry.Rule, digests: dict[str, str], old: dict
+) -> tuple[dict, list[int], list[int]]:
+    """(new stats entry without the stale years, stale years, years gone) of
+    one indicator; a changed rule makes every year stale."""
+    if not digests:
+        logger.warning(f"Missing {indicator_id} in {store.DATASET}")
+    if old.get("rule") != list(rule):
+        old = {"partitions": {}, "years": {}, "pooled": {}}
+    new = [y for y, d in digests.items() if old["partitions"].get(y) != d]
+    gone = [y for y in old["partitions"] if y not in digests]
+    if new or gone:
+        logger.info(
+            f"{indicator_id}: rereading {len(new)} of {len(digests)} year partitions"
+            + (f", dropping {len(gone)}" if gone else "")
+        )
+    entry = {"rule": list(rule), "partitions": digests}
+    for name in ("years", "pooled"):
+        entry[name] = {y: s for y, s in old[name].items() if y not in new + gone}
+    return entry, [int(y) for y in new], [int(y) for y in gone]
+
+
+def update(indicators: dict[str, registry.Rule], full: bool = False) -> IndexState:
+    """Bring the stored state up to date with the dataset and return it.
+
+    indicators maps every indicator the index uses to its normalization rule.
+    Only year partitions whose content changed since the last update are read;
+    full=True rereads all.
+    """
+    state = _empty() if full else load()
+    cells = state.cells[state.cells["indicator_id"].isin(list(indicators))]
+    with ThreadPoolExecutor(max_workers=READERS) as pool:
+        digests = dict(
+            zip(indicators, pool.map(partition_digests, indicators), strict=True)
+        )
+        entries, stale, drop = {}, {}, []
+        for ind, rule in indicators.items():
+            entries[ind], new, gone = _plan(
+                ind, rule, digests[ind], state.indicators.get(ind, {})
+            )
+            drop += [(ind, y) for y in new + gone]
+            if new:
+                stale[ind] = new
+
+        reads = [
+            pool.submit(_read_years, batch, indicators)
+            for batch in _batches(stale, READERS)
+        ]
+        fresh = []
+        for future in reads:
+            new_cells, new_stats = future.result()
+            fresh.append(new_cells)
+            for ind, stats in new_stats.items():
+                for name, years in stats.items():
+                    entries[ind][name] |= years
+
+    changed = entries != state.indicators or len(cells) < len(state.cells)
+    if drop:
+        # one pass over the cells, however many indicators changed
+        at = pd.MultiIndex.from_arrays(
+            [cells["indicator_id"].astype(object), cells["year"].astype("int64")]
+        )
+        cells = cells[~at.isin(drop)]
+    if fresh:
+        cells = schema.concat([cells, *fresh])
+    state = IndexState(entries, cells.reset_index(drop=True))
+    if changed or not STATS.exists():
+        save(state)
+    return state
+
+
+def bounds(
+    entry: dict, reference: tuple[int, int] | None = None, pooled: bool = False
+) -> tuple[float, float, int]:
+    """(min, max, valid count) of an indicator, over the reference years if
+    given; of its headline rows, or of every row with pooled=True."""
+    stats = [
+        s
+        for y, s in entry["pooled" if pooled else "years"].items()
+        if reference is None or reference[0] <= int(y) <= reference[1]
+    ]
+    stats = [s for s in stats if s[2]]
+    if not stats:
+        return np.nan, np.nan, 0
+    return (
+        min(s[0] for s in stats),
+        max(s[1] for s in stats),
+        sum(s[2] for s in stats),
+    )
+
+
+def slices(state: IndexState) -> dict[tuple[str, str], pd.DataFrame]:
+    """Cells of each disaggregation slice, by (disagg_type, disagg_value)."""
+    cells = state.cells[state.cells["disagg_type"].notna()]
+    return {
+        key: part.reset_index(drop=True)
+        for key, part in cells.groupby(SLICE, observed=True, sort=True)
+    }
+
+
+def slice_scores(
+    cells: pd.DataFrame,
+    indicators: dict[str, tuple[float, float, int]],
+    buckets: dict[str, str],
+    years: tuple[int, int],
+) -> pd.Series:
+    """Mean normalized score per (KEYS, bucket) of one slice's cells.
+
+    indicators maps indicator ids to their (min, max, valid count) bounds.
+    An indicator with at most one value or a zero range scores 0
+    everywhere. The bounds are looked up per cell, so the
+    cost does not grow with the number of indicators.
+    """
+    ids = cells["indicator_id"].astype(object)
+    c = cells[
+        ids.isin(list(indicators)).to_numpy()
+        & (cells["year"] >= years[0]).to_numpy()
+        & (cells["year"] <= years[1]).to_numpy()
+    ]
+    if c.empty:
+        return pd.Series(dtype="float64", name="norm")
+    ind = c["indicator_id"].astype(object)
+    b = pd.DataFrame.from_dict(indicators, orient="index", columns=["mn", "mx", "n"])
+    mn, mx, n = (b[col].reindex(ind).to_numpy() for col in ("mn", "mx", "n"))
+    flat = (n <= 1) | (mn == mx)
+    n_valid = c["n_valid"].to_numpy()
+    keep = flat | (n_valid > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s = np.where(flat, 0.0, (c["t_sum"].to_numpy() - n_valid * mn) / (mx - mn))
+    w = np.where(flat, c["n_rows"].to_numpy(), n_valid)
+    part = c[KEYS].assign(s=s, w=w, v=n_valid, bucket=ind.map(buckets).to_numpy())[keep]
+    sums = part.groupby([*KEYS, "bucket"], observed=True)[["s", "w", "v"]].sum()
+    sums = sums[sums["v"] > 0]  # a bucket with no value at all has no score
+    return (sums["s"] / sums["w"]).rename("norm")
+
+
+def cell_scores(
+    state: IndexState,
+    buckets: dict[str, str],
+    years: tuple[int, int],
+    reference: tuple[int, int] | None = None,
+) -> pd.Series:
+    """Mean normalized score per (country_iso3, country_name, year, bucket)
+    of the headline rows.
+
+    buckets maps indicator ids to bucket names. Values are min-max scaled per
+    indicator over all years, or over the reference years when given (scores
+    outside that period's range then fall outside [0, 1]).
+    """
+    headline = state.cells[state.cells["disagg_type"].isna()]
+    return slice_scores(headline, all_bounds(state, reference), buckets, years)
+
+
+def all_bounds(
+    state: IndexState, reference: tuple[int, int] | None = None, pooled: bool = False
+) -> dict[str, tuple[float, float, int]]:
+    """bounds() of every indicator in the state."""
+    return {
+        ind: bounds(entry, reference, pooled) for ind, entry in state.indicators.items()
+    }
@@ -1,30 +1,206 @@
 # pipelines/ingest_worldbank.py
+import argparse
+import json
+import os
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import requests
-from loguru import logger
+from typing import TYPE_CHECKING
+
+import registry
 from config import settings
+from loguru import logger
 
-# World Bank bulk CSV-by-indicator endpoint (returns a ZIP of CSVs)
-BASE = "https://api.worldbank.org/v2/country/all/indicator/{code}?downloadformat=csv"
+if TYPE_CHECKING:  # requests is imported when a download starts
+    import requests
 
+MANIFEST = "wb_manifest.json"  # ETag / Last-Modified per indicator, in data/raw
+CHUNK_SIZE = 1 << 16
+# _fetch retries 429/5xx, connection errors and bodies that break off mid-stream
+# (which urllib3 cannot retry once streaming), so the session itself does not
+ATTEMPTS = 3
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+BACKOFF = 1.0  # seconds before the second attempt, doubling after
+
+
+def make_session(pool_size: int = 4) -> "requests.Session":
+    """Pooled session without retries of its own (see ATTEMPTS)."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_manifest(raw_dir: Path) -> dict:
+    p = raw_dir / MANIFEST
+    return json.loads(p.read_text()) if p.exists() else {}
+
+
+def save_manifest(raw_dir: Path, manifest: dict) -> None:
+    p = raw_dir / MANIFEST
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp.replace(p)
+
+
+def worldbank_codes(path: Path | None = None) -> list[str]:
+    """World Bank indicator codes listed in the registry (docs/indicators.csv)."""
+    return [i.code for i in registry.by_source("WorldBank", path)]
 
-def download_indicator(code: str) -> Path:
-    url = BASE.format(code=code)
-    out_zip = settings.data_dir / "raw" / f"wb_{code}.zip"
-    out_zip.parent.mkdir(parents=True, exist_ok=True)
 
+def _save_body(r: "requests.Response", code: str, raw_dir: Path) -> int:
+    """Stream a response to wb_<code>.zip via a temp file and an atomic rename."""
+    fd, tmp = tempfile.mkstemp(dir=raw_dir, prefix=f".wb_{code}.", suffix=".part")
+    nbytes = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                nbytes += len(chunk)
+        os.chmod(tmp, 0o644)  # mkstemp creates files 0600
+        os.replace(tmp, raw_dir / f"wb_{code}.zip")
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return nbytes
+
+
+def _fetch(
+    session: "requests.Session",
+    code: str,
+    raw_dir: Path,
+    entry: dict,
+    base_url: str,
+    force: bool,
+) -> dict:
+    import requests
+
+    url = base_url.format(code=code)
+    headers = {}
+    if (raw_dir / f"wb_{code}.zip").exists() and not force:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    start = time.perf_counter()
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=120) as r:
+                if r.status_code == 304:
+                    return {
+                        "code": code,
+                        "status": "unchanged",
+                        "bytes": 0,
+                        "seconds": time.perf_counter() - start,
+                        **entry,
+                    }
+                if r.status_code not in RETRY_STATUS or attempt == ATTEMPTS:
+                    r.raise_for_status()
+                    return {
+                        "code": code,
+                        "status": "downloaded",
+                        "bytes": _save_body(r, code, raw_dir),
+                        "seconds": time.perf_counter() - start,
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified"),
+                    }
+                problem = f"HTTP {r.status_code}"
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as e:
+            if attempt == ATTEMPTS:
+                raise
+            problem = repr(e)
+        wait = BACKOFF * 2 ** (attempt - 1)
+        logger.warning(f"{code}: {problem}; retrying in {wait:g}s")
+        time.sleep(wait)
+
+
+def download_indicators(
+    codes: list[str],
+    workers: int = 4,
+    force: bool = False,
+    base_url: str | None = None,
+) -> list[dict]:
+    """Fetch indicators concurrently, skipping those the server reports unchanged."""
+    raw_dir = settings.data_dir / "raw"
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    base_url = base_url or settings.worldbank_url
+    manifest = load_manifest(raw_dir)
+    results, failed = [], []
+
+    start = time.perf_counter()
+    with make_session(workers) as session, ThreadPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(
+                _fetch, session, code, raw_dir, manifest.get(code, {}), base_url, force
+            ): code
+            for code in dict.fromkeys(codes)
+        }
+        for fut in as_completed(futures):
+            code = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                logger.error(f"{code}: download failed ({e})")
+                failed.append(code)
+                continue
+            results.append(res)
+            manifest[code] = {
+                "etag": res.get("etag"),
+                "last_modified": res.get("last_modified"),
+            }
+            if res["status"] == "downloaded":
+                logger.success(
+                    f"Saved wb_{code}.zip ({res['bytes']:,} bytes, {res['seconds']:.1f}s)"
+                )
+            else:
+                logger.info(f"{code} unchanged (304), skipped")
+    save_manifest(raw_dir, manifest)
+
+    elapsed = time.perf_counter() - start
+    downloaded = [r for r in results if r["status"] == "downloaded"]
+    total = sum(r["bytes"] for r in downloaded)
+    logger.info(
+        f"{len(downloaded)} downloaded, {len(results) - len(downloaded)} unchanged, "
+        f"{len(failed)} failed; {total:,} bytes in {elapsed:.1f}s"
+    )
+    return results
+
+
+def download_indicator(code: str) -> Path:
+    url = settings.worldbank_url.format(code=code)
     logger.info(f"Downloading {code} from World Bank: {url}")
-    r = requests.get(url, timeout=120)
-    r.raise_for_status()
-    out_zip.write_bytes(r.content)
-    logger.success(f"Saved {out_zip}")
-    return out_zip
+    if not download_indicators([code], workers=1):
+        raise RuntimeError(f"Download of {code} failed")
+    return settings.data_dir / "raw" / f"wb_{code}.zip"
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        logger.error("Usage: python pipelines/ingest_worldbank.py <INDICATOR_CODE>")
+    parser = argparse.ArgumentParser(description="Download World Bank indicator ZIPs")
+    parser.add_argument("codes", nargs="*", help="indicator codes, e.g. SE.PRM.CMPT.ZS")
+    parser.add_argument(
+        "--all", action="store_true", help="every WorldBank code in docs/indicators.csv"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--force", action="store_true", help="ignore the manifest, always re-download"
+    )
+    args = parser.parse_args()
+
+    codes = args.codes + (worldbank_codes() if args.all else [])
+    if not codes:
+        parser.print_usage()
+        sys.exit(1)
+    results = download_indicators(codes, workers=args.workers, force=args.force)
+    if len(results) < len(set(codes)):
         sys.exit(1)
-    code = sys.argv[1]
-    download_indicator(code)
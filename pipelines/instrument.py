@@ -0,0 +1,300 @@
+# pipelines/instrument.py
+"""Opt-in timing, memory and row counts for pipeline stages and their steps.
+
+    with instrument.step("tidy_unesco.read", rows_in=n) as s:
+        df = ...
+        s.rows_out = len(df)
+
+    @instrument.timed("countries.to_iso3")   # rows_out from the result
+    def to_iso3(values): ...
+
+Off unless SDG4_PROFILE is set (1/rss: RSS and process peak RSS per step;
+tracemalloc: traced Python/numpy peak per step, slower) or a script is run
+with --profile, which calls enable(). When off, step() hands back one shared
+do-nothing object, so instrumented code pays a function call per step.
+
+When on, each finished step is a record (name, parent, wall seconds, CPU
+seconds of the calling thread, rows in/out, memory, pid) and at exit all
+records are written as JSON to SDG4_PROFILE_OUT (default
+<data_dir>/interim/profile/<script>-<time>.json), with a summary of the
+top-level steps in the log. With SDG4_PROFILE_CPROFILE set (or
+enable(cprofile=True)) every top-level step also runs under cProfile and the
+stats of the slowest one are dumped next to the JSON as .pstats.
+
+Steps run in worker processes come back to the parent through traced_call /
+unwrap, so harmonize's per-indicator jobs show up in the same report. The
+tracemalloc peak is process-wide, so for steps running concurrently in
+threads it is an upper bound.
+"""
+import atexit
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, wraps
+from pathlib import Path
+
+from config import settings
+from loguru import logger
+
+MODES = ("rss", "tracemalloc")
+
+_mode: str | None = None
+_cprofile = False
+_out: Path | None = None
+_records: list[dict] = []
+_profiles: list[tuple[float, str, cProfile.Profile]] = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _Null:
+    """What step() returns when profiling is off: a context manager whose
+    target drops attribute writes."""
+
+    rows_out = None
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class Step:
+    def __init__(self, name: str, parent: str | None, rows_in: int | None):
+        self.name = name
+        self.parent = parent
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.mem_peak = 0
+
+
+def enabled() -> bool:
+    return _mode is not None
+
+
+def enable(mode: str = "rss", cprofile: bool = False, out: Path | None = None):
+    """Turn profiling on for this process (and workers it forks or spawns)."""
+    global _mode, _cprofile, _out
+    if mode not in MODES:
+        raise ValueError(f"Profile mode must be one of {MODES}")
+    first = _mode is None
+    _mode, _cprofile, _out = mode, cprofile, out
+    os.environ["SDG4_PROFILE"] = mode
+    if cprofile:
+        os.environ["SDG4_PROFILE_CPROFILE"] = "1"
+    if mode == "tracemalloc" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if first:
+        atexit.register(report)
+
+
+def _stack() -> list[Step]:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@lru_cache(maxsize=1)
+def _psutil():
+    # psutil is only needed once profiling is on, so it is imported then
+    try:
+        import psutil
+    except ImportError:  # RSS then falls back to the process peak only
+        return None
+    return psutil
+
+
+def _rss() -> int:
+    psutil = _psutil()
+    return psutil.Process().memory_info().rss if psutil else 0
+
+
+def step(name: str, rows_in: int | None = None, parent: str | None = None):
+    """Time one stage or sub-step; set .rows_out on the object it yields.
+
+    parent defaults to the enclosing step of this thread; pass current() from
+    the submitting thread for work handed to a thread pool.
+    """
+    return _NULL if _mode is None else _step(name, rows_in, parent)
+
+
+def current() -> str | None:
+    """Name of this thread's innermost open step (None when off)."""
+    stack = _stack() if _mode is not None else None
+    return stack[-1].name if stack else None
+
+
+@contextmanager
+def _step(name: str, rows_in: int | None, parent: str | None):
+    stack = _stack()
+    s = Step(name, parent or (stack[-1].name if stack else None), rows_in)
+    if _mode == "tracemalloc":
+        if stack:
+            stack[-1].mem_peak = max(
+                stack[-1].mem_peak, tracemalloc.get_traced_memory()[1]
+            )
+        tracemalloc.reset_peak()
+    rss0 = _rss() if _mode == "rss" else 0
+    prof = None
+    if _cprofile and s.parent is None:
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # another profiler is active (e.g. a sibling thread)
+            prof = None
+    stack.append(s)
+    wall0, cpu0 = time.perf_counter(), time.thread_time()
+    try:
+        yield s
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+        stack.pop()
+        if prof is not None:
+            prof.disable()
+        rec = {
+            "name": name,
+            "parent": s.parent,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "rows_in": s.rows_in,
+            "rows_out": s.rows_out,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        if _mode == "tracemalloc":
+            s.mem_peak = max(s.mem_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].mem_peak = max(stack[-1].mem_peak, s.mem_peak)
+            rec["traced_peak_mb"] = round(s.mem_peak / 2**20, 2)
+        else:
+            rec["rss_mb"] = round(_rss() / 2**20, 2)
+            rec["rss_delta_mb"] = round((_rss() - rss0) / 2**20, 2)
+            # ru_maxrss is KiB on Linux: the process high-water mark so far
+            rec["max_rss_mb"] = round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2
+            )
+        with _lock:
+            _records.append(rec)
+            if prof is not None:
+                _profiles.append((wall, name, prof))
+
+
+def _rows(result) -> int | None:
+    if hasattr(result, "num_rows"):  # Arrow
+        return result.num_rows
+    if hasattr(result, "shape"):  # pandas / numpy
+        return result.shape[0]
+    return None
+
+
+def timed(name: str):
+    """Decorator form of step(); rows in/out are the row counts of a frame
+    passed as first argument / returned."""
+
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            if _mode is None:
+                return fn(*args, **kwargs)
+            with step(name, rows_in=_rows(args[0]) if args else None) as s:
+                result = fn(*args, **kwargs)
+                s.rows_out = _rows(result)
+            return result
+
+        return inner
+
+    return wrap
+
+
+def drain() -> list[dict]:
+    """Take (and forget) the records collected so far in this process."""
+    with _lock:
+        out = _records[:]
+        _records.clear()
+    return out
+
+
+def traced_call(fn, *args):
+    """Run fn in a worker; returns (result, the step records fn produced)."""
+    with _lock:
+        start = len(_records)  # a forked worker starts with the parent's list
+    result = fn(*args)
+    with _lock:
+        new = _records[start:]
+        del _records[start:]
+    return result, new
+
+
+def unwrap(result_and_records):
+    """Counterpart of traced_call in the parent: keep the records, return result."""
+    result, records = result_and_records
+    stack = _stack()
+    for r in records:  # worker-side roots hang under the step that submitted them
+        if r["parent"] is None and stack:
+            r["parent"] = stack[-1].name
+    with _lock:
+        _records.extend(records)
+    return result
+
+
+def _default_out() -> Path:
+    script = Path(sys.argv[0]).stem or "python"
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return settings.data_dir / "interim" / "profile" / f"{script}-{stamp}.json"
+
+
+def report() -> Path | None:
+    """Write the collected records as JSON and log the top-level steps."""
+    records = drain()
+    if not records:
+        return None
+    out = _out or Path(os.getenv("SDG4_PROFILE_OUT") or _default_out())
+    out.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "script": sys.argv[0],
+        "argv": sys.argv[1:],
+        "mode": _mode,
+        "pid": os.getpid(),
+        "written": datetime.now().isoformat(timespec="seconds"),
+    }
+    out.write_text(json.dumps({"meta": meta, "steps": records}, indent=2))
+
+    top = sorted(
+        (r for r in records if r["parent"] is None),
+        key=lambda r: r["wall_s"],
+        reverse=True,
+    )
+    for r in top:
+        rows = "" if r["rows_out"] is None else f", {r['rows_out']:,} rows"
+        logger.info(f"[profile] {r['name']}: {r['wall_s']:.2f}s wall{rows}")
+    if _profiles:
+        wall, name, prof = max(_profiles, key=lambda p: p[0])
+        stats = out.with_suffix(".pstats")
+        prof.dump_stats(stats)
+        logger.info(f"[profile] cProfile of {name} ({wall:.2f}s) in {stats}")
+        _profiles.clear()
+    logger.info(f"[profile] wrote {out}")
+    return out
+
+
+# SDG4_PROFILE in the environment turns profiling on at import, in workers too
+if os.getenv("SDG4_PROFILE", "").lower() not in ("", "0", "false", "no"):
+    _env = os.environ["SDG4_PROFILE"].lower()
+    enable(
+        "tracemalloc" if _env == "tracemalloc" else "rss",
+        cprofile=bool(os.getenv("SDG4_PROFILE_CPROFILE")),
+    )
@@ -0,0 +1,144 @@
+# pipelines/registry.py
+"""The indicator registry: docs/indicators.csv, read once per process.
+
+One row per indicator: where it comes from (source, code), its unit, the
+bucket it is scored in (empty: exported but not scored), its Tableau label,
+the range its values must fall in (valid_min / valid_max, checked by
+validate.py; empty: unbounded) and how it is normalized, declared rather
+than special-cased in code:
+
+    higher   higher_is_better TRUE: higher values are better
+    lower    higher_is_better FALSE: lower values are better
+    target   a `target` value is set: the closer to it the better (e.g. 1
+             for a gender parity index); overrides higher_is_better
+
+Every rule is a transform to "higher is better" applied before min-max
+scaling (see Rule.apply), so adding an indicator, even hundreds of them, is a
+row in the CSV. A docs/indicators.csv in the working directory takes
+precedence over the one next to the code.
+"""
+import csv
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:  # ingest_worldbank reads the registry without pandas
+    import pandas as pd
+
+INDICATORS_CSV = Path("docs/indicators.csv")
+BUNDLED_CSV = Path(__file__).resolve().parent.parent / "docs" / "indicators.csv"
+RULES = ("higher", "lower", "target")
+
+
+class Rule(NamedTuple):
+    kind: str  # one of RULES
+    target: float | None = None
+
+    def apply(self, x: "pd.Series") -> "pd.Series":
+        """Values as "higher is better", ready for min-max scaling."""
+        if self.kind == "target":
+            return 1 - (x - self.target).abs()
+        if self.kind == "lower":
+            return -x
+        return x
+
+
+class Indicator(NamedTuple):
+    indicator_id: str
+    name: str
+    source: str
+    code: str
+    unit: str
+    bucket: str  # "" if the indicator is not scored
+    rule: Rule
+    label: str
+    valid_min: float | None = None
+    valid_max: float | None = None
+
+
+def path() -> Path:
+    return INDICATORS_CSV if INDICATORS_CSV.exists() else BUNDLED_CSV
+
+
+def _number(text: str | None) -> float | None:
+    text = (text or "").strip()
+    return float(text) if text else None
+
+
+def _rule(row: dict) -> Rule:
+    target = _number(row.get("target"))
+    if target is not None:
+        return Rule("target", target)
+    higher = row["higher_is_better"].strip().upper() in ("TRUE", "1", "YES")
+    return Rule("higher" if higher else "lower")
+
+
+@lru_cache(maxsize=4)
+def _read(path: str, mtime_ns: int) -> tuple[Indicator, ...]:
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    out = tuple(
+        Indicator(
+            r["indicator_id"],
+            r["name"],
+            r["source"],
+            r["code"],
+            r["unit"],
+            (r.get("bucket") or "").strip(),
+            _rule(r),
+            (r.get("label") or "").strip() or r["indicator_id"],
+            _number(r.get("valid_min")),
+            _number(r.get("valid_max")),
+        )
+        for r in rows
+    )
+    counts = Counter(i.indicator_id for i in out)
+    dupes = [k for k, n in counts.items() if n > 1]
+    if dupes:
+        raise ValueError(f"{path}: duplicate indicator_id {sorted(dupes)}")
+    return out
+
+
+def load(csv_path: Path | None = None) -> tuple[Indicator, ...]:
+    """Every indicator, in file order; reread only once the file changes."""
+    p = csv_path or path()
+    return _read(str(p), p.stat().st_mtime_ns)
+
+
+def by_source(source: str, csv_path: Path | None = None) -> list[Indicator]:
+    return [i for i in load(csv_path) if i.source == source]
+
+
+def scored(csv_path: Path | None = None) -> list[Indicator]:
+    """Indicators with a bucket, i.e. the ones the index uses."""
+    return [i for i in load(csv_path) if i.bucket]
+
+
+def buckets(csv_path: Path | None = None) -> dict[str, list[str]]:
+    """Bucket -> its indicator ids, buckets in order of first appearance."""
+    out: dict[str, list[str]] = {}
+    for i in scored(csv_path):
+        out.setdefault(i.bucket, []).append(i.indicator_id)
+    return out
+
+
+def rules(csv_path: Path | None = None) -> dict[str, Rule]:
+    return {i.indicator_id: i.rule for i in scored(csv_path)}
+
+
+def apply_rules(
+    ids: "pd.Series", x: "pd.Series", rules: dict[str, Rule]
+) -> "pd.Series":
+    """Rule.apply for rows of many indicators at once (ids: each row's
+    indicator); one vectorized pass per rule kind, not per indicator."""
+    ids = ids.astype(object)
+    kind = ids.map({k: r.kind for k, r in rules.items()})
+    out = x.copy()
+    lower = (kind == "lower").to_numpy()
+    out[lower] = -x[lower]
+    target = (kind == "target").to_numpy()
+    if target.any():
+        t = ids[target].map({k: r.target for k, r in rules.items()}).astype(float)
+        out[target] = 1 - (x[target] - t).abs()
+    return out
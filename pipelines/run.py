@@ -0,0 +1,388 @@
+# pipelines/run.py
+"""Run the pipeline as a DAG of stages.
+
+    ingest -> harmonize -> uis_bulk -> gapfill -> build_index -> export
+                                              -> coverage
+
+Each stage declares its inputs and outputs. A stage is skipped when the
+fingerprint of its inputs (size + mtime of every file, including the stage's
+own code, and the settings it reads) matches the last successful run and its
+outputs exist; stages whose dependencies are done run concurrently on a thread
+pool. Frames a stage
+returns (the index) are handed to its dependents in memory instead of being
+read back from Parquet. Fingerprints are kept in
+data/interim/_pipeline_state.json.
+
+    python pipelines/run.py                  # everything that is stale
+    python pipelines/run.py export --force   # export and its upstream, rerun
+    python pipelines/run.py --skip ingest    # offline
+"""
+import hashlib
+import importlib
+import json
+import time
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import NamedTuple
+
+import instrument
+import typer
+from config import settings
+from loguru import logger
+
+HERE = Path(__file__).resolve().parent
+STATE = settings.data_dir / "interim" / "_pipeline_state.json"
+# build_index's outputs, named here so checking them does not import pandas
+INDEX = settings.data_dir / "interim" / "inequity_index.parquet"
+INDEX_DISAGG = settings.data_dir / "interim" / "inequity_index_disagg.parquet"
+BROKEN = ("failed", "blocked")
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable[[dict], object]  # gets the return values of its deps
+    deps: tuple[str, ...]
+    inputs: Callable[[], list[Path]]  # files or directories
+    outputs: Callable[[], list[Path]]
+    config: tuple[str, ...] = ()  # settings fields that are inputs too
+
+
+def _code(*modules: str) -> list[Path]:
+    return [HERE / f"{m}.py" for m in modules]
+
+
+def _stage(module: str):
+    # stage modules (and pandas, requests, ... behind them) are imported when
+    # a stage is fingerprinted or run, not when the CLI starts: --help and
+    # argument errors stay instant
+    return importlib.import_module(module)
+
+
+def _registry() -> list[Path]:
+    # the indicator list and rules every stage reads (docs/indicators.csv)
+    return [_stage("registry").path(), *_code("registry")]
+
+
+def _harmonized() -> list[Path]:
+    # rewritten only when harmonize / uis_bulk write to the dataset; the
+    # dataset itself is no input of gapfill, which rewrites it
+    harmonize = _stage("harmonize")
+    interim = settings.data_dir / "interim"
+    return [interim / harmonize.MANIFEST, interim / harmonize.BULK_MANIFEST]
+
+
+def _bulk_export() -> list[Path]:
+    return [Path(settings.uis_bulk)] if settings.uis_bulk else []
+
+
+def _wb_zips() -> list[Path]:
+    raw = settings.data_dir / "raw"
+    codes = _stage("ingest_worldbank").worldbank_codes()
+    return [raw / f"wb_{code}.zip" for code in codes]
+
+
+def _ingest(_: dict) -> None:
+    ingest_worldbank = _stage("ingest_worldbank")
+    codes = ingest_worldbank.worldbank_codes()
+    results = ingest_worldbank.download_indicators(codes)
+    if len(results) < len(set(codes)):
+        raise RuntimeError("Some World Bank downloads failed")
+
+
+def _harmonize(_: dict, workers: int | None = None):
+    return _stage("harmonize").main(workers=workers)
+
+
+def _uis_bulk(_: dict):
+    if not settings.uis_bulk:
+        return None  # no export configured (UIS_BULK)
+    return _stage("uis_bulk").main(Path(settings.uis_bulk))
+
+
+def _gapfill(_: dict) -> None:
+    _stage("gapfill").main()
+
+
+def _coverage(_: dict) -> None:
+    # reads the observed-only cube; the one gapfill hands over counts its fills
+    _stage("check_coverage").main()
+
+
+def _build_index(_: dict):
+    return _stage("build_index").main()
+
+
+def _export(done: dict) -> None:
+    # coverage comes from the observed-only cube on disk (see coverage_cube)
+    _stage("export_for_tableau").export_all(index_df=done.get("build_index"))
+
+
+def stages(workers: int | None = None) -> dict[str, Stage]:
+    """The pipeline, in dependency order."""
+    return {
+        s.name: s
+        for s in [
+            Stage(
+                "ingest",
+                _ingest,
+                (),
+                lambda: [*_registry(), *_code("ingest_worldbank")],
+                _wb_zips,
+            ),
+            Stage(
+                "harmonize",
+                lambda done: _harmonize(done, workers),
+                ("ingest",),
+                lambda: [
+                    settings.data_dir / "raw",
+                    *_registry(),
+                    *_code(
+                        "harmonize", "tidy_unesco", "excel_cache", "store", "schema"
+                    ),
+                ],
+                lambda: [
+                    _stage("store").DATASET,
+                    _stage("coverage_cube").CUBE,
+                    _stage("coverage_cube").OBSERVED,
+                ],
+            ),
+            Stage(
+                "uis_bulk",
+                _uis_bulk,
+                ("harmonize",),
+                # harmonize's manifest too: harmonize --force replaces bulk
+                # partitions with the raw files, which this stage restores
+                lambda: [
+                    *_bulk_export(),
+                    _harmonized()[0],
+                    *_registry(),
+                    *_code("uis_bulk", "store", "schema", "validate"),
+                ],
+                lambda: [],
+                ("uis_bulk",),
+            ),
+            Stage(
+                "gapfill",
+                _gapfill,
+                ("harmonize", "uis_bulk"),
+                lambda: [*_harmonized(), *_code("gapfill", "store", "schema")],
+                lambda: [_stage("gapfill").MANIFEST],
+                ("gapfill_methods", "gapfill_max_gap"),
+            ),
+            Stage(
+                "coverage",
+                _coverage,
+                ("gapfill",),
+                lambda: [
+                    _stage("coverage_cube").OBSERVED,
+                    *_registry(),
+                    *_code("check_coverage"),
+                ],
+                lambda: [_stage("check_coverage").OUT],
+            ),
+            Stage(
+                "build_index",
+                _build_index,
+                ("gapfill",),
+                lambda: [
+                    _stage("store").DATASET,
+                    *_registry(),
+                    *_code("build_index", "index_state", "uncertainty", "countries"),
+                ],
+                lambda: [INDEX, INDEX_DISAGG],
+            ),
+            Stage(
+                "export",
+                _export,
+                ("build_index",),
+                lambda: [
+                    INDEX,
+                    INDEX_DISAGG,
+                    _stage("store").DATASET,
+                    _stage("coverage_cube").OBSERVED,
+                    *_registry(),
+                    *_code("export_for_tableau"),
+                ],
+                lambda: [
+                    _stage("export_for_tableau").OUT / f"{name}.csv"
+                    for name in (
+                        "inequity_index",
+                        "inequity_index_latest",
+                        "indicators_long",
+                        "coverage",
+                    )
+                ],
+            ),
+        ]
+    }
+
+
+def fingerprint(paths: list[Path], config: dict | None = None) -> str:
+    """Digest of (path, size, mtime) of every file under `paths`, and of
+    the `config` values."""
+    h = hashlib.sha256()
+    if config:
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+    for path in paths:
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        for f in files:
+            hidden = any(part.startswith(".") for part in f.relative_to(path).parts)
+            if hidden or not f.is_file():
+                continue  # temp files/dirs of in-flight writes
+            st = f.stat()
+            h.update(f"{f}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        if not files:
+            h.update(f"{path}\0missing\n".encode())
+    return h.hexdigest()
+
+
+def load_state() -> dict:
+    return json.loads(STATE.read_text()) if STATE.exists() else {}
+
+
+def save_state(state: dict) -> None:
+    STATE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
+    tmp.replace(STATE)
+
+
+def _upstream(dag: dict[str, Stage], targets: list[str]) -> list[str]:
+    """targets and everything they depend on, in dependency order."""
+    needed, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(dag[name].deps)
+    return [name for name in dag if name in needed]
+
+
+def _is_fresh(stage: Stage, state: dict, force: bool) -> tuple[bool, str]:
+    config = {name: getattr(settings, name) for name in stage.config}
+    digest = fingerprint(stage.inputs(), config)
+    fresh = (
+        not force
+        and state.get(stage.name) == digest
+        and all(p.exists() for p in stage.outputs())
+    )
+    return fresh, digest
+
+
+def _run_stage(stage: Stage, done: dict, state: dict, force: bool):
+    start = time.perf_counter()
+    with instrument.step(f"run.{stage.name}"):
+        fresh, digest = _is_fresh(stage, state, force)
+        if fresh:
+            return "cached", None, digest, time.perf_counter() - start
+        value = stage.func({d: done.get(d) for d in stage.deps})
+    return "ran", value, digest, time.perf_counter() - start
+
+
+def execute(
+    dag: dict[str, Stage],
+    targets: list[str],
+    skip: tuple[str, ...] = (),
+    force: bool = False,
+    jobs: int = 2,
+) -> dict[str, tuple[str, float]]:
+    """Run `targets` (and their upstream) as their dependencies finish.
+
+    Returns {stage: (status, seconds)}; status is ran, cached, skipped,
+    failed or blocked (a dependency failed, so the stage was not run).
+    """
+    order = _upstream(dag, targets)
+    state = load_state()
+    report = {name: ("skipped", 0.0) for name in order if name in skip}
+    done: dict[str, object] = {}
+    pending = [name for name in order if name not in skip]
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                deps = [d for d in dag[name].deps if d in order]
+                if any(report.get(d, ("",))[0] in BROKEN for d in deps):
+                    report[name] = ("blocked", 0.0)
+                    logger.error(f"{name}: not run, an upstream stage failed")
+                    pending.remove(name)
+                elif all(d in report for d in deps):
+                    logger.info(f"{name}: starting")
+                    fut = pool.submit(_run_stage, dag[name], done, state, force)
+                    running[fut] = name
+                    pending.remove(name)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                try:
+                    status, value, digest, seconds = fut.result()
+                except Exception as e:
+                    logger.exception(f"{name} failed: {e!r}")
+                    report[name] = ("failed", 0.0)
+                    continue
+                done[name] = value
+                state[name] = digest
+                save_state(state)
+                report[name] = (status, seconds)
+                logger.info(f"{name}: {status} ({seconds:.1f}s)")
+    return report
+
+
+def print_summary(report: dict[str, tuple[str, float]], total: float) -> None:
+    typer.echo(f"\n{'stage':<14}{'status':<10}{'seconds':>9}")
+    for name, (status, seconds) in report.items():
+        typer.echo(f"{name:<14}{status:<10}{seconds:>9.2f}")
+    typer.echo(f"{'total':<24}{total:>9.2f}")
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def run(
+    targets: list[str] = typer.Argument(
+        None, help="stages to bring up to date (default: all)"
+    ),
+    skip: list[str] = typer.Option([], help="stages to leave out, e.g. ingest"),
+    force: bool = typer.Option(False, help="rerun stages even if inputs are unchanged"),
+    jobs: int = typer.Option(2, help="stages run at the same time"),
+    workers: int = typer.Option(None, help="harmonize worker processes"),
+    dry_run: bool = typer.Option(False, help="only show which stages are stale"),
+    profile: bool = typer.Option(False, help="record timings/memory per step"),
+    cprofile: bool = typer.Option(
+        False, help="with --profile, also dump cProfile stats of the slowest stage"
+    ),
+):
+    """Bring the pipeline outputs up to date."""
+    if profile or cprofile:
+        instrument.enable(cprofile=cprofile)
+    dag = stages(workers)
+    unknown = [t for t in (targets or []) + skip if t not in dag]
+    if unknown:
+        raise typer.BadParameter(f"unknown stage(s) {unknown}; known: {list(dag)}")
+    targets = targets or list(dag)
+
+    if dry_run:
+        state, stale = load_state(), set()
+        for name in _upstream(dag, targets):
+            if name in skip:
+                typer.echo(f"{name:<14}skipped")
+                continue
+            fresh, _ = _is_fresh(dag[name], state, force)
+            if not fresh or stale.intersection(dag[name].deps):
+                stale.add(name)  # a stale dependency will change its inputs
+            typer.echo(f"{name:<14}{'stale' if name in stale else 'fresh'}")
+        return
+
+    start = time.perf_counter()
+    report = execute(dag, targets, tuple(skip), force, jobs)
+    print_summary(report, time.perf_counter() - start)
+    if any(status in BROKEN for status, _ in report.values()):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,147 @@
+# pipelines/schema.py
+"""Column types of the tidy indicator rows, shared by every stage.
+
+The string columns hold a handful of distinct values each (a few hundred
+countries, one unit, two sources...), so they are categorical in pandas and
+dictionary-encoded in Arrow/Parquet; `year` is a nullable int16 and `value`
+is float64, or float32 when VALUE_DTYPE=float32 trades exact output (the
+index moves by ~1e-7) for half the memory. The Arrow schema is stored with
+the Parquet files, so the types survive a round trip.
+
+    cast(df)         pandas frame -> these dtypes (for whatever columns it has)
+    cast_table(t)    Arrow table  -> ARROW_SCHEMA (missing columns as nulls)
+    compact(t)       Arrow table  -> same, without unused dictionary entries
+    to_pandas(t)     Arrow table  -> pandas, categoricals included
+    concat(frames)   pd.concat that keeps categoricals categorical
+
+Categories are kept sorted, so sorting or grouping on a categorical column
+orders rows exactly as it would on the plain strings.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from config import settings
+from pandas.api.types import union_categoricals
+
+COLUMNS = [
+    "country_iso3",
+    "country_name",
+    "year",
+    "indicator_id",
+    "value",
+    "unit",
+    "source",
+    "disagg_type",
+    "disagg_value",
+    "is_imputed",
+    "obs_status",
+]
+# obs_status of a row gapfill added for a cell that had no row at all (a row
+# it filled in place keeps its own status); see gapfill.py
+GAPFILL_STATUS = "gapfill"
+CATEGORICAL = [
+    "country_iso3",
+    "country_name",
+    "indicator_id",
+    "unit",
+    "source",
+    "disagg_type",
+    "disagg_value",
+    "obs_status",
+]
+
+if settings.value_dtype not in ("float32", "float64"):
+    raise ValueError(f"VALUE_DTYPE must be float32 or float64: {settings.value_dtype}")
+VALUE_DTYPE = np.dtype(settings.value_dtype)
+YEAR_DTYPE = pd.Int16Dtype()
+
+_ARROW_TYPES = {
+    "year": pa.int16(),
+    "value": pa.from_numpy_dtype(VALUE_DTYPE),
+    "is_imputed": pa.bool_(),
+}
+ARROW_SCHEMA = pa.schema(
+    [(c, _ARROW_TYPES.get(c, pa.dictionary(pa.int32(), pa.string()))) for c in COLUMNS]
+)
+
+
+def _sorted_categorical(s: pd.Series) -> pd.Series:
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        # factorize, not astype("category"): far quicker on all-NA columns
+        codes, uniques = pd.factorize(s, sort=True)
+        cats = pd.Index([str(u) for u in uniques], dtype=object)
+        return _sorted_categorical(
+            pd.Series(pd.Categorical.from_codes(codes, cats), index=s.index)
+        )
+    if s.cat.categories.dtype != object:
+        s = s.cat.rename_categories(list(s.cat.categories.astype(str)))
+    if not s.cat.categories.is_monotonic_increasing:
+        s = s.cat.reorder_categories(sorted(s.cat.categories))
+    return s
+
+
+def cast(df: pd.DataFrame) -> pd.DataFrame:
+    """The frame with schema dtypes on the schema columns it has (in place)."""
+    for c in df.columns.intersection(CATEGORICAL):
+        df[c] = _sorted_categorical(df[c])
+    if "year" in df.columns:
+        df["year"] = pd.to_numeric(df["year"], errors="coerce").astype(YEAR_DTYPE)
+    if "value" in df.columns:
+        df["value"] = pd.to_numeric(df["value"], errors="coerce").astype(VALUE_DTYPE)
+    if "is_imputed" in df.columns:
+        df["is_imputed"] = df["is_imputed"].fillna(False).astype(bool)
+    return df
+
+
+def empty(columns: list[str] | None = None) -> pd.DataFrame:
+    """Zero rows with the schema dtypes."""
+    return to_pandas(ARROW_SCHEMA.empty_table().select(columns or COLUMNS))
+
+
+def cast_table(table: pa.Table) -> pa.Table:
+    """Cast to ARROW_SCHEMA, adding missing columns as nulls."""
+    arrays = []
+    for field in ARROW_SCHEMA:
+        if field.name not in table.column_names:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+            continue
+        col = table.column(field.name)
+        if field.name in CATEGORICAL and not pa.types.is_dictionary(col.type):
+            col = pc.dictionary_encode(col.cast(pa.string()))
+        arrays.append(col.cast(field.type))
+    return pa.Table.from_arrays(arrays, schema=ARROW_SCHEMA)
+
+
+def compact(table: pa.Table) -> pa.Table:
+    """Drop unused dictionary entries (a slice keeps its parent's dictionary)."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            col = pc.dictionary_encode(table.column(i).cast(pa.string()))
+            table = table.set_column(i, field, col.cast(field.type))
+    return table
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Arrow -> pandas with the schema dtypes (columns outside it untouched)."""
+    for name in table.column_names:
+        col = table.column(name)
+        if name in CATEGORICAL and not pa.types.is_dictionary(col.type):
+            i = table.column_names.index(name)
+            table = table.set_column(i, name, pc.dictionary_encode(col))
+    return cast(table.to_pandas())
+
+
+def concat(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """pd.concat for frames of one layout; categoricals with different
+    categories are unioned rather than decoded to object."""
+    columns = frames[0].columns
+    shared = [
+        c
+        for c in columns.intersection(CATEGORICAL)
+        if all(isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames)
+    ]
+    out = pd.concat([f.drop(columns=shared) for f in frames], ignore_index=True)
+    for c in shared:
+        out[c] = union_categoricals([f[c] for f in frames], sort_categories=True)
+    return cast(out[columns])
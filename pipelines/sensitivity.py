@@ -0,0 +1,287 @@
+# pipelines/sensitivity.py
+"""Weight-scenario sensitivity for the inequity index.
+
+Scores K alternative weight vectors at once: for the country-year × bucket
+score matrix X (mask M) and weights W (K × buckets) the index of every
+scenario is ((X*M) @ W.T) / (M @ W.T), computed in chunks of scenarios.
+Per country-year it keeps running moments, min/max, rank statistics (rank
+within year, 1 = most equitable) and a BINS-bin histogram of the index from
+which quantiles are read, so memory is rows × (chunk_size + bins), whatever K.
+A row's histogram spans its lowest to highest bucket score: every weighting's
+index is a weighted mean of those scores, so it cannot fall outside, even
+when --reference bounds put scores outside [0, 1].
+"""
+import argparse
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from build_index import (
+    bucket_indicators,
+    bucket_weights,
+    index_inputs,
+    parse_years,
+    weighted_index,
+)
+from config import settings
+from loguru import logger
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+BINS = 200  # index histogram resolution; quantiles interpolate within a bin
+
+
+def dirichlet_weights(
+    n_buckets: int, k: int, alpha: float = 1.0, seed: int = 0
+) -> np.ndarray:
+    """k weight vectors drawn from a symmetric Dirichlet(alpha)."""
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(np.full(n_buckets, alpha), size=k)
+
+
+def grid_weights(n_buckets: int, steps: int) -> np.ndarray:
+    """Every weight vector on the simplex with entries in multiples of 1/steps."""
+    # stars and bars: bar positions split `steps` units among the buckets
+    grid = []
+    for bars in combinations(range(steps + n_buckets - 1), n_buckets - 1):
+        edges = np.array((-1, *bars, steps + n_buckets - 1))
+        grid.append(np.diff(edges) - 1)
+    return np.array(grid, dtype=float) / steps
+
+
+def ranks_within_year(index: np.ndarray, year_slices: list[slice]) -> np.ndarray:
+    """Ordinal rank (1 = highest index) within each year, per column; NaN last."""
+    ranks = np.empty(index.shape, dtype=np.float64)
+    for sl in year_slices:
+        order = np.argsort(-index[sl], axis=0, kind="stable")
+        r = np.empty_like(order)
+        np.put_along_axis(r, order, np.arange(order.shape[0])[:, None], axis=0)
+        ranks[sl] = r + 1
+    return ranks
+
+
+def hist_bins(
+    values: np.ndarray, lo: np.ndarray, hi: np.ndarray, bins: int
+) -> np.ndarray:
+    """Bin of each value (rows × columns) in its row's histogram over [lo, hi]."""
+    width = np.where(hi > lo, hi - lo, 1.0)[:, None]
+    b = np.floor((values - lo[:, None]) / width * bins)
+    return np.clip(np.nan_to_num(b), 0, bins - 1).astype(np.int64)
+
+
+def hist_quantiles(
+    hist: np.ndarray, n: np.ndarray, qs, lo: np.ndarray = 0.0, hi: np.ndarray = 1.0
+) -> np.ndarray:
+    """Quantiles (rows × len(qs)) from per-row histograms over [lo, hi]."""
+    bins = hist.shape[1]
+    lo, hi = np.broadcast_to(lo, n.shape), np.broadcast_to(hi, n.shape)
+    cum = hist.cumsum(axis=1)
+    rows = np.arange(hist.shape[0])
+    out = np.full((hist.shape[0], len(qs)), np.nan)
+    for j, q in enumerate(qs):
+        target = q * n
+        b = (cum >= target[:, None]).argmax(axis=1)
+        inside = hist[rows, b]
+        frac = (target - (cum[rows, b] - inside)) / np.maximum(inside, 1)
+        out[:, j] = np.where(n > 0, lo + (b + frac) / bins * (hi - lo), np.nan)
+    return out
+
+
+def score_scenarios(
+    scores: np.ndarray,
+    mask: np.ndarray,
+    years: np.ndarray,
+    weights: np.ndarray,
+    baseline: np.ndarray,
+    chunk_size: int = 512,
+    bins: int = BINS,
+) -> tuple[dict, pd.DataFrame]:
+    """Index distribution and rank stability of each row across K weightings.
+
+    scores/mask are the (already coverage-filtered) bucket matrix, years the
+    year of each row and weights a K × buckets array (rows need not sum to 1;
+    weights are renormalized over present buckets). Returns per-row statistic
+    arrays and a per-year table of Spearman correlation with the baseline.
+    """
+    if (weights < 0).any():
+        raise ValueError("Weights must be non-negative")
+    n_rows, k = scores.shape[0], weights.shape[0]
+
+    # rows grouped by year so each year is one contiguous slice
+    perm = np.argsort(years, kind="stable")
+    filled = np.where(mask, scores, 0.0)[perm]
+    present = mask[perm].astype(float)
+    yrs = years[perm]
+    uniq, starts = np.unique(yrs, return_index=True)
+    ends = np.r_[starts[1:], n_rows]
+    year_slices = [slice(s, e) for s, e in zip(starts, ends, strict=True)]
+
+    base_idx, _ = weighted_index(filled, present.astype(bool), baseline)
+    base_rank = ranks_within_year(base_idx[:, None], year_slices)[:, 0]
+
+    n = np.zeros(n_rows)
+    s1, s2 = np.zeros(n_rows), np.zeros(n_rows)
+    lo, hi = np.full(n_rows, np.inf), np.full(n_rows, -np.inf)
+    r1, r2 = np.zeros(n_rows), np.zeros(n_rows)
+    rlo, rhi = np.full(n_rows, np.inf), np.full(n_rows, -np.inf)
+    hist = np.zeros((n_rows, bins), dtype=np.int32)  # counts up to 2**31 weightings
+    rho_sum = np.zeros(len(year_slices))
+    rho_min = np.full(len(year_slices), np.inf)
+    offsets = (np.arange(n_rows) * bins)[:, None]
+    # histogram range: no weighting takes the index past the row's bucket scores
+    bin_lo = np.where(mask, scores, np.inf).min(axis=1)[perm]
+    bin_hi = np.where(mask, scores, -np.inf).max(axis=1)[perm]
+
+    for start in range(0, k, chunk_size):
+        w = weights[start : start + chunk_size]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            idx = (filled @ w.T) / (present @ w.T)  # rows × chunk
+        valid = ~np.isnan(idx)
+        v = np.where(valid, idx, 0.0)
+        n += valid.sum(axis=1)
+        s1 += v.sum(axis=1)
+        s2 += (v * v).sum(axis=1)
+        lo = np.minimum(lo, np.where(valid, idx, np.inf).min(axis=1))
+        hi = np.maximum(hi, np.where(valid, idx, -np.inf).max(axis=1))
+
+        flat = (offsets + hist_bins(v, bin_lo, bin_hi, bins))[valid]
+        hist += np.bincount(flat, minlength=n_rows * bins).reshape(n_rows, bins)
+
+        ranks = ranks_within_year(idx, year_slices)
+        r1 += ranks.sum(axis=1)
+        r2 += (ranks * ranks).sum(axis=1)
+        rlo = np.minimum(rlo, ranks.min(axis=1))
+        rhi = np.maximum(rhi, ranks.max(axis=1))
+        for y, sl in enumerate(year_slices):
+            m = sl.stop - sl.start
+            if m < 2:
+                continue
+            d = ranks[sl] - base_rank[sl, None]
+            rho = 1 - 6 * (d * d).sum(axis=0) / (m * (m * m - 1))
+            rho_sum[y] += rho.sum()
+            rho_min[y] = min(rho_min[y], rho.min())
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s1 / n
+        std = np.sqrt(np.maximum(s2 / n - mean**2, 0.0))
+    rank_mean = r1 / k
+    rank_std = np.sqrt(np.maximum(r2 / k - rank_mean**2, 0.0))
+    qs = hist_quantiles(hist, n, QUANTILES, bin_lo, bin_hi)
+
+    inv = np.argsort(perm)  # back to the caller's row order
+    stats = {
+        "index_baseline": base_idx[inv],
+        "index_mean": mean[inv],
+        "index_std": std[inv],
+        "index_min": np.where(n > 0, lo, np.nan)[inv],
+        "index_max": np.where(n > 0, hi, np.nan)[inv],
+        **{f"index_p{round(q * 100):02d}": qs[inv, j] for j, q in enumerate(QUANTILES)},
+        "rank_baseline": base_rank[inv],
+        "rank_mean": rank_mean[inv],
+        "rank_std": rank_std[inv],
+        "rank_min": rlo[inv],
+        "rank_max": rhi[inv],
+    }
+    by_year = pd.DataFrame(
+        {
+            "year": uniq,
+            "n_countries": ends - starts,
+            "spearman_mean": rho_sum / k,
+            "spearman_min": np.where(np.isfinite(rho_min), rho_min, np.nan),
+        }
+    )
+    return stats, by_year
+
+
+def run(
+    weights: np.ndarray | pd.DataFrame | None = None,
+    k: int = 1000,
+    alpha: float = 1.0,
+    seed: int = 0,
+    grid_steps: int | None = None,
+    chunk_size: int = 512,
+    reference: tuple[int, int] | None = None,
+    bins: int = BINS,
+) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+    """Load the index inputs once and score a batch of weight scenarios.
+
+    weights, if given, is a K × buckets array in sorted bucket order or a
+    frame with one column per bucket; otherwise a Dirichlet sample of size k
+    (or a simplex grid) is drawn. The inputs are build_index's (index_state,
+    reference years included), so index_baseline is the published index.
+    """
+    inputs = index_inputs(reference=reference)
+    if inputs is None:
+        return None
+    rows, buckets, scores, mask = inputs
+    baseline = bucket_weights(buckets)
+    _, keep = weighted_index(scores, mask, baseline)
+    rows, scores, mask = rows[keep], scores[keep], mask[keep]
+
+    if isinstance(weights, pd.DataFrame):
+        weights = weights[buckets].to_numpy(dtype=float)
+    elif weights is None:
+        weights = (
+            grid_weights(len(buckets), grid_steps)
+            if grid_steps
+            else dirichlet_weights(len(buckets), k, alpha, seed)
+        )
+    if weights.shape[1] != len(buckets):
+        raise ValueError(f"Expected {len(buckets)} weights per scenario: {buckets}")
+    logger.info(f"Scoring {len(weights):,} weightings over {len(rows):,} country-years")
+
+    years = rows.get_level_values("year").to_numpy(dtype=np.int64)
+    stats, by_year = score_scenarios(
+        scores, mask, years, weights, baseline, chunk_size=chunk_size, bins=bins
+    )
+    out = rows.to_frame(index=False)
+    for name, values in stats.items():
+        out[name] = values
+    return out, by_year
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index sensitivity to bucket weights")
+    parser.add_argument("-k", type=int, default=1000, help="Dirichlet samples")
+    parser.add_argument("--alpha", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--grid", type=int, default=None, help="use a simplex grid with this many steps"
+    )
+    parser.add_argument(
+        "--weights-csv",
+        type=Path,
+        default=None,
+        help="one scenario per row, one column per bucket ("
+        + ", ".join(bucket_indicators())
+        + ")",
+    )
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument(
+        "--bins", type=int, default=BINS, help="index histogram bins for quantiles"
+    )
+    parser.add_argument(
+        "--reference",
+        default=settings.index_reference,
+        help="freeze min-max bounds to these years, as build_index does",
+    )
+    args = parser.parse_args()
+
+    result = run(
+        weights=pd.read_csv(args.weights_csv) if args.weights_csv else None,
+        k=args.k,
+        alpha=args.alpha,
+        seed=args.seed,
+        grid_steps=args.grid,
+        chunk_size=args.chunk_size,
+        reference=parse_years(args.reference),
+        bins=args.bins,
+    )
+    if result is not None:
+        out_df, by_year = result
+        base = settings.data_dir / "interim"
+        out_df.to_parquet(base / "index_sensitivity.parquet", index=False)
+        by_year.to_csv(base / "index_sensitivity_by_year.csv", index=False)
+        logger.success(
+            f"Wrote {base / 'index_sensitivity.parquet'} with {len(out_df):,} rows"
+        )
@@ -0,0 +1,395 @@
+# pipelines/serve.py
+"""Read-only HTTP API over the inequity index and the indicator table.
+
+    python pipelines/serve.py --port 8000
+
+inequity_index.parquet and the exported indicators_long table are loaded
+into memory once, sorted by (ISO3, year), with a row range per country and
+the rows of each year precomputed. Routes:
+
+    GET /health                      file versions and row counts
+    GET /countries                   ISO3, name, first and last index year
+    GET /countries/<ISO3>            index history of one country
+    GET /years/<YYYY>                every country that year, ranked
+    GET /ranking?year=YYYY&n=10&order=top|bottom
+    GET /indicators/<ISO3>?indicator=<ID>&from=YYYY&to=YYYY
+
+Responses are JSON, or an Arrow IPC stream with ?format=arrow (or
+"Accept: application/vnd.apache.arrow.stream"). The ETag is the version
+(size + mtime) of the files, so If-None-Match gets a 304 until the pipeline
+writes new outputs, and rendered responses are kept in an LRU cache. Files
+are re-stat'ed at most every RELOAD_INTERVAL seconds; a changed file is
+reloaded and the cache dropped. A file caught mid-write fails to load and
+the previous data keeps being served until the next check.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from config import settings
+from loguru import logger
+
+INDEX = settings.data_dir / "interim" / "inequity_index.parquet"
+INDICATORS = settings.data_dir / "public" / "parquet" / "indicators_long.parquet"
+INDICATORS_CSV = settings.data_dir / "public" / "indicators_long.csv"
+RELOAD_INTERVAL = 1.0  # seconds between checks for new pipeline outputs
+ARROW = "application/vnd.apache.arrow.stream"
+# the export's Tableau names -> the API's (same as the interim dataset)
+RENAME = {
+    "ISO3": "country_iso3",
+    "Country": "country_name",
+    "Year": "year",
+    "Bucket": "bucket",
+    "Indicator": "indicator",
+    "IndicatorID": "indicator_id",
+    "Value": "value",
+}
+NO_INDICATORS = pa.schema(
+    [
+        ("country_iso3", pa.string()),
+        ("country_name", pa.string()),
+        ("year", pa.int16()),
+        ("bucket", pa.string()),
+        ("indicator", pa.string()),
+        ("indicator_id", pa.string()),
+        ("value", pa.float64()),
+    ]
+)
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Table(NamedTuple):
+    data: pa.Table  # sorted by country_iso3, year; plain (non-dictionary) columns
+    by_country: dict[str, tuple[int, int]]  # row range
+    by_year: dict[int, np.ndarray]  # row positions
+
+
+class Snapshot(NamedTuple):
+    version: str
+    files: dict[str, str]
+    index: Table
+    indicators: Table
+
+
+def _decode(table: pa.Table) -> pa.Table:
+    fields = [
+        pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f
+        for f in table.schema
+    ]
+    return table.cast(pa.schema(fields))
+
+
+def index_table(table: pa.Table) -> Table:
+    """Sort a table with country_iso3 / year columns and index it by both."""
+    table = _decode(table)
+    table = table.filter(pc.is_valid(table["country_iso3"]))
+    order = pc.sort_indices(
+        table, [("country_iso3", "ascending"), ("year", "ascending")]
+    )
+    table = table.take(order).combine_chunks()
+    iso3 = table["country_iso3"].to_numpy(zero_copy_only=False)
+    codes, starts = np.unique(iso3, return_index=True)
+    stops = [*starts[1:], len(iso3)]
+    by_country = {
+        str(c): (int(a), int(b)) for c, a, b in zip(codes, starts, stops, strict=True)
+    }
+    years = table["year"].to_numpy(zero_copy_only=False)
+    order = np.argsort(years, kind="stable")
+    uniq, first = np.unique(years[order], return_index=True)
+    by_year = {
+        int(y): rows for y, rows in zip(uniq, np.split(order, first[1:]), strict=True)
+    }
+    return Table(table, by_country, by_year)
+
+
+def _version(path: Path) -> str:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return "missing"
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def _indicators_path() -> Path:
+    return INDICATORS if INDICATORS.exists() else INDICATORS_CSV
+
+
+def file_versions() -> dict[str, str]:
+    return {str(p): _version(p) for p in (INDEX, _indicators_path())}
+
+
+def load_snapshot(files: dict[str, str]) -> Snapshot:
+    if files[str(INDEX)] == "missing":
+        raise FileNotFoundError(f"{INDEX}; run pipelines/build_index.py first")
+    index = pq.read_table(INDEX)
+    path = _indicators_path()
+    if files[str(path)] == "missing":
+        logger.warning(f"No {path}; /indicators will be empty")
+        indicators = NO_INDICATORS.empty_table()
+    elif path.suffix == ".csv":
+        indicators = pacsv.read_csv(path)
+    else:
+        indicators = pq.read_table(path)
+    indicators = indicators.rename_columns(
+        [RENAME.get(c, c) for c in indicators.column_names]
+    )
+    digest = hashlib.blake2b(json.dumps(files, sort_keys=True).encode(), digest_size=8)
+    return Snapshot(
+        digest.hexdigest(), files, index_table(index), index_table(indicators)
+    )
+
+
+def _ranked(table: pa.Table) -> pa.Table:
+    order = pc.sort_indices(
+        table, [("inequity_index", "descending"), ("country_iso3", "ascending")]
+    )
+    table = table.take(order)
+    return table.append_column("rank", pa.array(np.arange(1, len(table) + 1)))
+
+
+def _int(params: dict, name: str, default: int | None = None) -> int | None:
+    value = params.get(name, [None])[0]
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer") from None
+
+
+def _country(table: Table, iso3: str) -> pa.Table:
+    if iso3 not in table.by_country:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown country {iso3}")
+    start, stop = table.by_country[iso3]
+    return table.data.slice(start, stop - start)
+
+
+def _year(table: Table, year: int) -> pa.Table:
+    if year not in table.by_year:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"No index for {year}")
+    return table.data.take(table.by_year[year])
+
+
+def _health(snap: Snapshot, params: dict) -> dict:
+    return {
+        "version": snap.version,
+        "files": snap.files,
+        "index_rows": snap.index.data.num_rows,
+        "indicator_rows": snap.indicators.data.num_rows,
+    }
+
+
+def _countries(snap: Snapshot, params: dict, iso3: str | None = None) -> pa.Table:
+    index = snap.index
+    if iso3 is not None:
+        return _country(index, iso3.upper())
+    codes = list(index.by_country)
+    first = [index.by_country[c][0] for c in codes]
+    last = [index.by_country[c][1] - 1 for c in codes]
+    return pa.table(
+        {
+            "country_iso3": codes,
+            "country_name": index.data["country_name"].take(first),
+            "first_year": index.data["year"].take(first),
+            "last_year": index.data["year"].take(last),
+        }
+    )
+
+
+def _years(snap: Snapshot, params: dict, year: str) -> pa.Table:
+    if not year.isdigit():
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Bad year {year}")
+    return _ranked(_year(snap.index, int(year)))
+
+
+def _ranking(snap: Snapshot, params: dict) -> pa.Table:
+    year = _int(params, "year", max(snap.index.by_year, default=0))
+    n = max(_int(params, "n", 10), 0)
+    order = params.get("order", ["top"])[0]
+    if order not in ("top", "bottom"):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "order must be top or bottom")
+    ranked = _ranked(_year(snap.index, year))
+    if order == "top":
+        return ranked.slice(0, n)
+    return ranked.slice(max(len(ranked) - n, 0))
+
+
+def _indicators(snap: Snapshot, params: dict, iso3: str) -> pa.Table:
+    rows = _country(snap.indicators, iso3.upper())
+    if "indicator" in params:
+        wanted = pa.array(list(params["indicator"]))
+        rows = rows.filter(pc.is_in(rows["indicator_id"], wanted))
+    first, last = _int(params, "from"), _int(params, "to")
+    if first is not None:
+        rows = rows.filter(pc.greater_equal(rows["year"], first))
+    if last is not None:
+        rows = rows.filter(pc.less_equal(rows["year"], last))
+    return rows
+
+
+# (first path segment, number of further segments) -> handler
+ROUTES = {
+    ("health", 0): _health,
+    ("countries", 0): _countries,
+    ("countries", 1): _countries,
+    ("years", 1): _years,
+    ("ranking", 0): _ranking,
+    ("indicators", 1): _indicators,
+}
+
+
+def query(snap: Snapshot, path: str, params: dict) -> pa.Table | dict:
+    """The result of one GET, as an Arrow table (or a dict for /health)."""
+    parts = [p for p in path.split("/") if p] or [""]
+    route = ROUTES.get((parts[0], len(parts) - 1))
+    if route is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"No route {path}")
+    return route(snap, params, *parts[1:])
+
+
+def render(result: pa.Table | dict, fmt: str) -> tuple[bytes, str]:
+    if isinstance(result, dict):
+        return json.dumps(result).encode(), "application/json"
+    if fmt == "arrow":
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, result.schema) as writer:
+            writer.write_table(result)
+        return sink.getvalue().to_pybytes(), ARROW
+    # NaN is not JSON: send null
+    columns = [
+        pc.if_else(pc.is_nan(c), None, c) if pa.types.is_floating(c.type) else c
+        for c in result.columns
+    ]
+    rows = pa.table(columns, names=result.column_names).to_pylist()
+    return json.dumps(rows).encode(), "application/json"
+
+
+class Api:
+    """Snapshot holder, reload check and LRU response cache (thread-safe)."""
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        files = file_versions()
+        self.snapshot = load_snapshot(files)
+        logger.info(f"Loaded data version {self.snapshot.version}")
+
+    def refresh(self) -> Snapshot:
+        """The current snapshot, reloading first if the pipeline wrote new files."""
+        now = time.monotonic()
+        if now - self._checked < RELOAD_INTERVAL:
+            return self.snapshot
+        with self._lock:
+            if now - self._checked < RELOAD_INTERVAL:
+                return self.snapshot
+            self._checked = now
+            files = file_versions()
+            if files != self.snapshot.files:
+                try:
+                    self.snapshot = load_snapshot(files)
+                    self._cache.clear()
+                    logger.info(f"Reloaded, data version {self.snapshot.version}")
+                except Exception as e:  # e.g. a file that is being written
+                    logger.warning(f"Reload failed, keeping the old data: {e!r}")
+        return self.snapshot
+
+    def get(self, snap: Snapshot, path: str, params: dict, fmt: str):
+        key = (snap.version, path, tuple(sorted(params.items())), fmt)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        out = render(query(snap, path, params), fmt)
+        with self._lock:
+            self._cache[key] = out
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return out
+
+
+class Handler(BaseHTTPRequestHandler):
+    api: Api  # set on the subclass make_server builds
+
+    def do_GET(self):  # noqa: N802 (http.server naming)
+        url = urlsplit(self.path)
+        params = {k: tuple(v) for k, v in parse_qs(url.query).items()}
+        fmt = self._format(params.pop("format", ("",))[0])
+        if fmt is None:
+            return self._send(HTTPStatus.BAD_REQUEST, {"error": "bad format"})
+
+        try:
+            snap = self.api.refresh()
+            etag = f'"{snap.version}-{fmt}"'
+            if etag in self.headers.get("If-None-Match", ""):
+                return self._send(HTTPStatus.NOT_MODIFIED, None, etag=etag)
+            body, ctype = self.api.get(snap, url.path, params, fmt)
+        except ApiError as e:
+            return self._send(e.status, {"error": str(e)})
+        except Exception:
+            # a bug, not the client's fault: log it, answer rather than hang up
+            logger.exception(f"GET {self.path} failed")
+            return self._send(
+                HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"}
+            )
+        self._send(HTTPStatus.OK, body, ctype, etag)
+
+    def _format(self, requested: str) -> str | None:
+        if not requested:
+            return "arrow" if ARROW in self.headers.get("Accept", "") else "json"
+        return requested if requested in ("json", "arrow") else None
+
+    def _send(self, status, body, ctype="application/json", etag=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if body is not None:
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8000, cache_size: int = 1024):
+    handler = type("BoundHandler", (Handler,), {"api": Api(cache_size)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only HTTP API over the index")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--cache-size", type=int, default=1024, help="LRU entries")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.cache_size)
+    logger.info(f"Serving on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,172 @@
+# pipelines/store.py
+"""Partitioned interim dataset and the DuckDB query layer over it.
+
+harmonize writes every indicator into one hive-partitioned Parquet dataset,
+
+    <data_dir>/interim/dataset/indicator_id=<id>/year=<yyyy>/part-0.parquet
+
+with rows sorted by country_iso3 (so row-group min/max statistics are
+selective). Downstream stages read it through `scan`, which pushes the
+projection and the indicator / year / country predicates down to DuckDB: a
+"2015-2024, these 3 indicators" query only opens those partitions' files and
+skips row groups whose statistics rule them out.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import schema
+from config import settings
+
+DATASET = settings.data_dir / "interim" / "dataset"
+ROW_GROUP_SIZE = 64_000
+
+
+def indicator_dir(indicator_id: str, base: Path | None = None) -> Path:
+    return (base or DATASET) / f"indicator_id={indicator_id}"
+
+
+def write_indicator(
+    data: pa.Table | pd.DataFrame, indicator_id: str, base: Path | None = None
+) -> int:
+    """Replace one indicator's partitions; returns the number of rows written."""
+    table = (
+        pa.Table.from_pandas(data, preserve_index=False)
+        if isinstance(data, pd.DataFrame)
+        else data
+    )
+    table = schema.cast_table(table)
+    # rows without a year have no partition to go to (and no downstream use)
+    table = table.filter(pc.is_valid(table.column("year")))
+    # Arrow cannot sort dictionary columns, so order by the decoded codes
+    keys = pa.table(
+        {"year": table["year"], "iso3": table["country_iso3"].cast(pa.string())}
+    )
+    order = pc.sort_indices(keys, [("year", "ascending"), ("iso3", "ascending")])
+    table = table.take(order)
+
+    target = indicator_dir(indicator_id, base)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    # One file per year, written by hand rather than by ds.write_dataset so each
+    # keeps only the dictionary entries it uses: an unchanged year then has
+    # unchanged bytes, which index_state relies on to skip it.
+    years = table.column("year").to_numpy()
+    starts = np.flatnonzero(np.diff(years, prepend=years[:1] - 1))  # sorted: runs
+    stops = [*starts[1:], len(years)] if len(years) else []  # no rows: no years
+    for start, stop in zip(starts, stops, strict=True):
+        part = table.slice(start, stop - start).drop_columns(["indicator_id", "year"])
+        part_dir = tmp / f"year={years[start]}"
+        part_dir.mkdir()
+        pq.write_table(
+            schema.compact(part),
+            part_dir / "part-0.parquet",
+            row_group_size=ROW_GROUP_SIZE,
+        )
+    # swap the finished directory in: move the old one aside, rename the new one
+    # into place, then delete the old one. Readers never see half an indicator,
+    # only (between the two renames) none at all, as a directory cannot be
+    # renamed over a non-empty one; if the second rename fails the old returns.
+    old = target.with_name(f".{target.name}.{os.getpid()}.old")
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        target.rename(old)
+    try:
+        tmp.rename(target)
+    except BaseException:
+        if old.exists():
+            old.rename(target)
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+    return table.num_rows
+
+
+def available_indicators(base: Path | None = None) -> list[str]:
+    """Indicator ids present in the dataset."""
+    base = base or DATASET
+    if not base.exists():
+        return []
+    return sorted(
+        p.name.split("=", 1)[1]
+        for p in base.iterdir()
+        if p.is_dir() and p.name.startswith("indicator_id=")
+    )
+
+
+def _sql_list(values) -> str:
+    return ", ".join("'" + str(v).replace("'", "''") + "'" for v in values)
+
+
+def _query(source: str, columns: list[str] | None, where: list[str]) -> pd.DataFrame:
+    select = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+    # values are quoted by _sql_list / int(), so plain string building is safe
+    sql = f"SELECT {select} FROM {source}" + (  # noqa: S608
+        f" WHERE {' AND '.join(where)}" if where else ""
+    )
+    with duckdb.connect() as con:
+        # via Arrow, so the string columns arrive dictionary-encoded
+        return schema.to_pandas(con.execute(sql).fetch_arrow_table())
+
+
+def scan(
+    columns: list[str] | None = None,
+    indicators: list[str] | None = None,
+    years: tuple[int, int] | None = None,
+    countries: list[str] | None = None,
+    base: Path | None = None,
+) -> pd.DataFrame:
+    """Rows of the interim dataset, filtered and projected inside DuckDB.
+
+    years is an inclusive (first, last) range. Columns come back with the
+    dtypes of schema.py (categorical strings, Int16 year, compact value).
+    """
+    base = base or DATASET
+    columns = columns or schema.COLUMNS
+    empty = schema.empty(columns)
+    if not any(base.glob("indicator_id=*/year=*/*.parquet")):
+        return empty
+
+    where = []
+    # only the requested indicators' directories are listed: a glob over the
+    # whole dataset costs every query time in proportion to all indicators
+    globs = [base / "indicator_id=*" / "year=*" / "*.parquet"]
+    if indicators is not None:
+        # sorted, so rows come back in the order of the dataset-wide glob
+        dirs = [indicator_dir(ind, base) for ind in sorted(set(indicators))]
+        globs = [d / "year=*" / "*.parquet" for d in dirs if d.exists()]
+        if not globs:
+            return empty
+        where.append(f"indicator_id IN ({_sql_list(indicators)})")
+    if years is not None:
+        where.append(f"year BETWEEN {int(years[0])} AND {int(years[1])}")
+    if countries is not None:
+        if not countries:
+            return empty
+        where.append(f"country_iso3 IN ({_sql_list(countries)})")
+
+    source = (
+        f"read_parquet([{_sql_list(globs)}], hive_partitioning = true, "
+        "hive_types = {'indicator_id': VARCHAR, 'year': SMALLINT})"
+    )
+    return _query(source, columns, where)
+
+
+def read_file(
+    path: Path,
+    columns: list[str] | None = None,
+    years: tuple[int, int] | None = None,
+) -> pd.DataFrame:
+    """A single Parquet file (e.g. inequity_index.parquet) with pushdown."""
+    where = []
+    if years is not None:
+        where.append(f"year BETWEEN {int(years[0])} AND {int(years[1])}")
+    source = "read_parquet('" + str(path).replace("'", "''") + "')"
+    return _query(source, columns, where)
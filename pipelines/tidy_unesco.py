@@ -1,27 +1,40 @@
 # pipelines/tidy_unesco.py
+from importlib.util import find_spec
 from pathlib import Path
-import pandas as pd
-
-try:
-    import country_converter as coco
-
-    CC = coco.CountryConverter()
-except Exception:
-    CC = None  # we'll fallback if not installed
 
-SCHEMA = [
-    "country_iso3",
-    "country_name",
-    "year",
-    "indicator_id",
-    "value",
-    "unit",
-    "source",
-    "disagg_type",
-    "disagg_value",
-    "is_imputed",
-    "obs_status",
-]
+import instrument
+import pandas as pd
+import schema
+from excel_cache import excel_columns, read_excel_cached
+
+# country_converter is only imported once a name actually needs resolving
+if find_spec("country_converter") is not None:
+    from countries import to_iso3
+else:
+    to_iso3 = None  # we'll fallback if not installed
+
+
+# disaggregation columns -> disagg_type; several in one file are joined by "|"
+DISAGG_COLUMNS = {
+    "Sex": "sex",
+    "SEX": "sex",
+    "Location": "location",
+    "LOCATION": "location",
+    "Wealth quintile": "wealth_quintile",
+    "Quantile": "wealth_quintile",
+    "WEALTH_QUINTILE": "wealth_quintile",
+}
+# values meaning "everyone" (the headline row), upper case
+TOTALS = {"", "_T", "_Z", "T", "TOTAL", "ALL", "BOTHSEX", "BOTH SEXES", "ALLAREA"}
+# SDG-portal / label spellings -> the SDMX codes the UIS bulk export uses
+DISAGG_CODES = {
+    "FEMALE": "F",
+    "MALE": "M",
+    "URBAN": "U",
+    "RURAL": "R",
+    **{f"QUINTILE_{q}": f"Q{q}" for q in range(1, 6)},
+    **{f"QUINTILE {q}": f"Q{q}" for q in range(1, 6)},
+}
 
 
 def _col(df, options):
@@ -31,20 +44,68 @@ def _col(df, options):
     return None
 
 
-def _read_any(path: Path) -> pd.DataFrame:
+def _year_cols(columns) -> list:
+    # Any column that is a 4-digit year becomes a value column
+    return [c for c in columns if str(c).isdigit() and len(str(c)) == 4]
+
+
+def _read_any(path: Path, columns: list | None = None) -> pd.DataFrame:
+    ext = path.suffix.lower()
+    with instrument.step(f"tidy_unesco.read{ext}") as s:
+        if ext in (".xls", ".xlsx"):
+            # parsed once, then served from a Parquet sidecar (see excel_cache)
+            df = read_excel_cached(path, columns)
+        elif ext == ".csv":
+            df = pd.read_csv(path, usecols=columns)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+        s.rows_out = len(df)
+    return df
+
+
+def _read_header(path: Path) -> pd.DataFrame:
+    """Zero-row frame with the file's columns, to decide what to read."""
     ext = path.suffix.lower()
     if ext in (".xls", ".xlsx"):
-        return pd.read_excel(path)
+        return pd.DataFrame(columns=excel_columns(path))
     elif ext == ".csv":
-        return pd.read_csv(path)
+        return pd.read_csv(path, nrows=0)
     else:
         raise ValueError(f"Unsupported file type: {ext}")
 
 
-def _melt_years(df: pd.DataFrame) -> pd.DataFrame:
-    # Any column that is a 4-digit year becomes a value column
-    year_cols = [c for c in df.columns if str(c).isdigit() and len(str(c)) == 4]
-    id_cols = [c for c in df.columns if c not in year_cols]
+def _disagg_cols(columns) -> list:
+    return [c for c in columns if c in DISAGG_COLUMNS]
+
+
+def disaggregation(df: pd.DataFrame, cols: list) -> tuple[pd.Series, pd.Series]:
+    """disagg_type / disagg_value per row from the disaggregation columns
+    (NA for a total, i.e. the headline row)."""
+    if not cols:
+        return pd.Series(pd.NA, index=df.index), pd.Series(pd.NA, index=df.index)
+    types, values = [], []
+    for c in cols:
+        v = df[c].astype("string").str.strip().fillna("")
+        upper = v.str.upper()
+        total = upper.isin(TOTALS)
+        code = upper.map(DISAGG_CODES).fillna(v)
+        types.append(pd.Series(DISAGG_COLUMNS[c], index=df.index).mask(total))
+        values.append(code.mask(total))
+    # join the non-total parts, e.g. sex|location and F|R
+    out = []
+    for parts in (types, values):
+        joined = parts[0].astype("string")
+        for part in parts[1:]:
+            both = joined + "|" + part.astype("string")
+            joined = both.fillna(joined).fillna(part.astype("string"))
+        out.append(joined)
+    return out[0], out[1]
+
+
+def _melt_years(df: pd.DataFrame, id_cols: list | None = None) -> pd.DataFrame:
+    year_cols = _year_cols(df.columns)
+    if id_cols is None:
+        id_cols = [c for c in df.columns if c not in year_cols]
     long = df.melt(
         id_vars=id_cols, value_vars=year_cols, var_name="year", value_name="value"
     )
@@ -54,18 +115,21 @@ def _melt_years(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def tidy_unesco_file(path: Path, indicator_id: str, unit: str) -> pd.DataFrame:
-    df = _read_any(path)
+    header = _read_header(path)
+    years = _year_cols(header.columns)
 
     # --- CASE A: SDG portal schema (wide years + GeoAreaName/GeoAreaCode) ---
-    if "GeoAreaName" in df.columns:
-        df_long = _melt_years(df)
+    disagg = _disagg_cols(header.columns)
+    if "GeoAreaName" in header.columns:
+        unit_col = _col(header, ["Units", "Unit"])
+        id_cols = ["GeoAreaName"] + ([unit_col] if unit_col else []) + disagg
+        df_long = _melt_years(_read_any(path, id_cols + years), id_cols)
+        disagg_type, disagg_value = disaggregation(df_long, disagg)
 
         country_name_col = "GeoAreaName"
         # Prefer ISO3; SDG portal gives M49 numeric codes, not ISO3
-        if CC is not None:
-            iso3_series = CC.convert(
-                df_long[country_name_col].astype(str), to="ISO3", not_found=None
-            )
+        if to_iso3 is not None:
+            iso3_series = to_iso3(df_long[country_name_col])
         else:
             iso3_series = None
 
@@ -76,39 +140,34 @@ def tidy_unesco_file(path: Path, indicator_id: str, unit: str) -> pd.DataFrame:
                 "year": df_long["year"],
                 "indicator_id": indicator_id,
                 "value": df_long["value"],
-                "unit": (
-                    df_long[_col(df_long, ["Units", "Unit"])]
-                    if _col(df_long, ["Units", "Unit"])
-                    else unit
-                ),
+                "unit": df_long[unit_col] if unit_col else unit,
                 "source": "UNESCO",
-                "disagg_type": pd.NA,  # You can later wire Sex/Education level if you want
-                "disagg_value": pd.NA,
+                "disagg_type": disagg_type,
+                "disagg_value": disagg_value,
                 "is_imputed": False,
                 "obs_status": pd.NA,
             }
         )
-        return out[SCHEMA]
+        return schema.cast(out[schema.COLUMNS])
 
     # --- CASE B: UIS-style (already long or tidy-ish) ---
     # Try flexible mapping
-    ctry = _col(df, ["Country", "COUNTRY", "country", "Ref_Area", "LOCATION_NAME"])
-    iso3 = _col(df, ["ISO3", "Code", "Country Code", "REF_AREA", "LOCATION"])
-    year = _col(df, ["Year", "Time", "TIME_PERIOD", "Year_Code"])
-    val = _col(df, ["Value", "OBS_VALUE", "Observation Value", "obs_value"])
+    ctry = _col(header, ["Country", "COUNTRY", "country", "Ref_Area", "LOCATION_NAME"])
+    iso3 = _col(header, ["ISO3", "Code", "Country Code", "REF_AREA", "LOCATION"])
+    year = _col(header, ["Year", "Time", "TIME_PERIOD", "Year_Code"])
+    val = _col(header, ["Value", "OBS_VALUE", "Observation Value", "obs_value"])
+    # LOCATION is the country code in OECD-style UIS files, not urban/rural
+    disagg = [c for c in disagg if c not in (ctry, iso3)]
 
     # If it's wide but not SDG schema, try melting by year too
-    if year is None and any(str(c).isdigit() and len(str(c)) == 4 for c in df.columns):
-        df_long = _melt_years(df)
+    if year is None and years:
+        id_cols = [c for c in (ctry, iso3) if c] + disagg
+        df_long = _melt_years(_read_any(path, id_cols + years), id_cols)
+        disagg_type, disagg_value = disaggregation(df_long, disagg)
         year = "year"
         val = "value"
-        # Recompute ctry/iso3 in long table if needed
-        if ctry is None:
-            ctry = _col(df_long, ["Country", "COUNTRY", "Ref_Area", "LOCATION_NAME"])
-        if iso3 is None and CC is not None and ctry is not None:
-            iso3_series = CC.convert(
-                df_long[ctry].astype(str), to="ISO3", not_found=None
-            )
+        if iso3 is None and to_iso3 is not None and ctry is not None:
+            iso3_series = to_iso3(df_long[ctry])
         else:
             iso3_series = df_long[iso3] if iso3 in df_long.columns else pd.NA
         out = pd.DataFrame(
@@ -120,15 +179,17 @@ def tidy_unesco_file(path: Path, indicator_id: str, unit: str) -> pd.DataFrame:
                 "value": df_long[val],
                 "unit": unit,
                 "source": "UNESCO",
-                "disagg_type": pd.NA,
-                "disagg_value": pd.NA,
+                "disagg_type": disagg_type,
+                "disagg_value": disagg_value,
                 "is_imputed": False,
                 "obs_status": pd.NA,
             }
         )
-        return out[SCHEMA]
+        return schema.cast(out[schema.COLUMNS])
 
     # Fallback simple mapping if columns are present
+    df = _read_any(path, [c for c in (iso3, ctry, year, val) if c] + disagg or None)
+    disagg_type, disagg_value = disaggregation(df, disagg)
     out = pd.DataFrame(
         {
             "country_iso3": df[iso3] if iso3 else pd.NA,
@@ -138,10 +199,10 @@ def tidy_unesco_file(path: Path, indicator_id: str, unit: str) -> pd.DataFrame:
             "value": pd.to_numeric(df[val], errors="coerce") if val else pd.NA,
             "unit": unit,
             "source": "UNESCO",
-            "disagg_type": pd.NA,
-            "disagg_value": pd.NA,
+            "disagg_type": disagg_type,
+            "disagg_value": disagg_value,
             "is_imputed": False,
             "obs_status": pd.NA,
         }
     )
-    return out[SCHEMA]
+    return schema.cast(out[schema.COLUMNS])
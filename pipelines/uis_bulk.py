@@ -0,0 +1,377 @@
+# pipelines/uis_bulk.py
+"""Streaming reader for the UIS bulk SDMX-CSV export.
+
+The bulk download is one long CSV (plain, .gz or inside a .zip) with a row
+per indicator × country × year × disaggregation, covering every indicator
+UIS publishes: far more than fits in memory. It is read in blocks of whole
+lines (--block-mb), each parsed by Arrow on its own, keeping only
+
+  * the columns named in COLUMNS / DIMENSIONS that the file has, and
+  * rows whose indicator is a UNESCO indicator of docs/indicators.csv,
+    matched on its indicator_id or its code (put the UIS code there),
+
+and each block is mapped onto the schema and appended to a Parquet writer
+per indicator in a staging directory. Only then is each indicator swapped
+into the dataset (store.write_indicator), one at a time. Peak memory is one
+block plus the largest selected indicator, however large the export is.
+(Arrow's own streaming CSV reader is not used: it reads dozens of blocks
+ahead of its consumer, so its footprint grows with the file.) As with Arrow's
+default parse options, quoted values must not contain line breaks.
+
+Disaggregations: a dimension column holding _T (total), _Z (not
+applicable), nothing or another of tidy_unesco.TOTALS is not a
+disaggregation. A row with one other value gets disagg_type = the dimension
+(lower case) and disagg_value = the code; a row with several gets them
+joined by "|" (e.g. sex|location, F|R), as tidy_unesco does. Codes
+given as "CODE: Label" (SDMX-CSV with labels) are cut to the code; for
+REF_AREA the label becomes the country name.
+
+Every indicator written is recorded in data/interim/_uis_bulk.json
+(harmonize.BULK_MANIFEST), so harmonize leaves it alone rather than
+rebuilding it from a raw UNESCO file; `harmonize.py --force` takes it back.
+run.py runs this as its uis_bulk stage when UIS_BULK names the export.
+
+    python pipelines/uis_bulk.py data/raw/uis/SDG_DATA.csv.gz
+    python pipelines/uis_bulk.py export.zip --block-mb 64 --progress 5
+"""
+import argparse
+import bz2
+import csv
+import gzip
+import os
+import resource
+import shutil
+import time
+import zipfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+import coverage_cube
+import harmonize
+import instrument
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import registry
+import schema
+import store
+import validate
+from config import settings
+from loguru import logger
+from tidy_unesco import TOTALS
+
+# schema column -> SDMX-CSV (or UIS bulk) column names, first match wins
+COLUMNS = {
+    "indicator": ["INDICATOR", "INDICATOR_ID", "STAT_UNIT", "SERIES"],
+    "country_iso3": ["REF_AREA", "COUNTRY_ID", "GEO_UNIT"],
+    "country_name": ["Geographic area", "REF_AREA_LABEL", "COUNTRY_NAME"],
+    "year": ["TIME_PERIOD", "YEAR"],
+    "value": ["OBS_VALUE", "VALUE"],
+    "obs_status": ["OBS_STATUS", "QUALIFIER"],
+}
+DIMENSIONS = [
+    "SEX",
+    "AGE",
+    "GRADE",
+    "EDU_LEVEL",
+    "EDU_TYPE",
+    "LOCATION",
+    "WEALTH_QUINTILE",
+    "SOC_ECON_STATUS",
+    "IMM_STATUS",
+    "DISABILITY",
+    "LANGUAGE",
+]
+CODECS = {".gz": gzip.open, ".bz2": bz2.open}
+BLOCK_MB = 16
+STAGING = settings.data_dir / "interim" / ".uis_bulk"
+
+
+class Indicator(NamedTuple):
+    indicator_id: str
+    code: str
+    unit: str
+
+
+def unesco_indicators(path: Path | None = None) -> list[Indicator]:
+    """UNESCO indicators listed in the registry (docs/indicators.csv)."""
+    return [
+        Indicator(i.indicator_id, i.code, i.unit)
+        for i in registry.by_source("UNESCO", path)
+    ]
+
+
+@contextmanager
+def _open(path: Path):
+    """(CSV stream, on-disk file) for a .zip (its first .csv), .gz/.bz2 or
+    plain file; the second one's position is how far the file has been read."""
+    with open(path, "rb") as raw:
+        if path.suffix.lower() == ".zip":
+            with zipfile.ZipFile(raw) as z:
+                name = next(n for n in z.namelist() if n.lower().endswith(".csv"))
+                with z.open(name) as f:
+                    yield f, raw
+        elif path.suffix.lower() in CODECS:
+            with CODECS[path.suffix.lower()](raw) as f:
+                yield f, raw
+        else:
+            yield raw, raw
+
+
+def _blocks(f, size: int) -> Iterator[bytes]:
+    """The stream in pieces of about `size` bytes, each ending at a line end."""
+    rest = b""
+    while chunk := f.read(size):
+        data = rest + chunk
+        cut = data.rfind(b"\n") + 1
+        if cut:
+            yield data[:cut]
+        rest = data[cut:]
+    if rest:
+        yield rest
+
+
+def _pick(header: list[str]) -> dict[str, str]:
+    """schema column -> file column, for the columns the file has."""
+    found = {k: next((c for c in v if c in header), None) for k, v in COLUMNS.items()}
+    missing = [
+        k for k in ("indicator", "country_iso3", "year", "value") if not found[k]
+    ]
+    if missing:
+        raise ValueError(f"Not an SDMX-CSV export: no column for {missing}")
+    return {k: c for k, c in found.items() if c}
+
+
+def _code_label(col: pa.ChunkedArray) -> tuple[pa.ChunkedArray, pa.ChunkedArray]:
+    """ "CODE: Label" -> (CODE, Label); plain codes give a null label."""
+    has_label = pc.match_substring(col, ": ")
+    if not pc.any(has_label).as_py():  # plain codes: no regex pass
+        return col, pa.nulls(len(col), pa.string())
+    code = pc.replace_substring_regex(col, r":\s.*$", "")
+    label = pc.replace_substring_regex(col, r"^[^:]*:\s*", "")
+    return code, pc.if_else(has_label, label, pa.scalar(None, pa.string()))
+
+
+def _disaggregation(t: pa.Table, dims: list[str]) -> tuple[pa.Array, pa.Array]:
+    """disagg_type and disagg_value per row (null for totals)."""
+    null = pa.scalar(None, pa.string())
+    if not dims:
+        return pa.nulls(t.num_rows, pa.string()), pa.nulls(t.num_rows, pa.string())
+    types, values = [], []
+    for dim in dims:
+        code, _ = _code_label(t[dim])
+        totals = pa.array(sorted(TOTALS))
+        total = pc.fill_null(pc.is_in(pc.utf8_upper(code), value_set=totals), True)
+        types.append(pc.if_else(total, null, pa.scalar(dim.lower())))
+        values.append(pc.if_else(total, null, code))
+    # nulls joined as "" and the empty fields squeezed out afterwards
+    # (null_handling="skip" drops rows that are null in every part)
+    out = []
+    for parts in (types, values):
+        joined = pc.binary_join_element_wise(
+            *parts, "|", null_handling="replace", null_replacement=""
+        )
+        joined = pc.utf8_trim(pc.replace_substring_regex(joined, r"\|\|+", "|"), "|")
+        out.append(pc.if_else(pc.equal(joined, ""), null, joined))
+    return out[0], out[1]
+
+
+def tidy_block(
+    t: pa.Table,
+    cols: dict[str, str],
+    dims: list[str],
+    indicators: list[Indicator],
+) -> pa.Table:
+    """Rows of the wanted indicators in one block, mapped onto the schema."""
+    code, _ = _code_label(t[cols["indicator"]])
+    # position in `indicators` of the indicator (by id or code), null if unwanted
+    pos = pc.index_in(code, value_set=pa.array([i.indicator_id for i in indicators]))
+    pos = pc.coalesce(
+        pos, pc.index_in(code, value_set=pa.array([i.code for i in indicators]))
+    )
+    keep = pc.is_valid(pos)
+    t, pos = t.filter(keep), pos.filter(keep)
+    if not t.num_rows:
+        return schema.ARROW_SCHEMA.empty_table()
+
+    null = pa.scalar(None, pa.string())
+    iso3, label = _code_label(t[cols["country_iso3"]])
+    name = t[cols["country_name"]] if "country_name" in cols else label
+    year = pc.utf8_slice_codeunits(t[cols["year"]], 0, 4)  # "2015" or "2015-2016"
+    year = pc.if_else(pc.match_substring_regex(year, r"^\d{4}$"), year, null)
+    disagg_type, disagg_value = _disaggregation(t, dims)
+    status = (
+        _code_label(t[cols["obs_status"]])[0]
+        if "obs_status" in cols
+        else pa.nulls(t.num_rows, pa.string())
+    )
+    out = pa.table(
+        {
+            "country_iso3": iso3,
+            "country_name": name,
+            "year": year.cast(pa.int16()),
+            "indicator_id": pa.array([i.indicator_id for i in indicators]).take(pos),
+            "value": t[cols["value"]],
+            "unit": pa.array([i.unit for i in indicators]).take(pos),
+            "source": pa.repeat("UNESCO", t.num_rows),
+            "disagg_type": disagg_type,
+            "disagg_value": disagg_value,
+            "is_imputed": pa.repeat(False, t.num_rows),
+            "obs_status": status,
+        }
+    )
+    return schema.cast_table(out)
+
+
+def _parse(
+    block: bytes, header: list[str], cols: dict[str, str], dims: list[str]
+) -> pa.Table:
+    """One block of lines as a table of the columns in use."""
+    convert = pacsv.ConvertOptions(
+        include_columns=[*cols.values(), *dims],
+        column_types={
+            **{c: pa.string() for c in [*cols.values(), *dims]},
+            cols["value"]: pa.float64(),
+        },
+        null_values=["", "NA", ".."],
+        strings_can_be_null=True,
+    )
+    read = pacsv.ReadOptions(column_names=header, use_threads=False)
+    return pacsv.read_csv(
+        pa.py_buffer(block), read_options=read, convert_options=convert
+    )
+
+
+class Progress:
+    """Logs bytes read of the (on-disk) file every `every` seconds."""
+
+    def __init__(self, size: int, every: float):
+        self.size, self.every = size, every
+        self.start = self.last = time.perf_counter()
+        self.done = -1
+
+    def __call__(self, done: int, rows: int, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self.last < self.every or done == self.done:
+            return
+        self.last, self.done = now, done
+        pct = 100 * done / self.size if self.size else 100
+        mb_s = done / 2**20 / max(now - self.start, 1e-9)
+        logger.info(f"{pct:5.1f}% read ({mb_s:.0f} MB/s), {rows:,} rows kept")
+
+
+def stream(
+    path: Path,
+    staging: Path,
+    indicators: list[Indicator],
+    block_mb: int = BLOCK_MB,
+    progress: float = 10.0,
+) -> dict[str, int]:
+    """Filter and tidy the export into one Parquet file per indicator in staging.
+
+    Returns rows written per indicator.
+    """
+    writers: dict[str, pq.ParquetWriter] = {}
+    rows: dict[str, int] = {}
+    report = Progress(path.stat().st_size, progress)
+    with _open(path) as (f, raw):
+        header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        cols = _pick(header)
+        dims = [d for d in DIMENSIONS if d in header]
+        logger.info(f"{path}: columns {cols}, dimensions {dims}")
+        for block in _blocks(f, block_mb << 20):
+            t = _parse(block, header, cols, dims)
+            part = tidy_block(t, cols, dims, indicators)
+            del block, t
+            for ind in pc.unique(part["indicator_id"].cast(pa.string())).to_pylist():
+                sub = part.filter(pc.equal(part["indicator_id"].cast(pa.string()), ind))
+                if ind not in writers:
+                    writers[ind] = pq.ParquetWriter(
+                        staging / f"{ind}.parquet", schema.ARROW_SCHEMA
+                    )
+                writers[ind].write_table(sub)
+                rows[ind] = rows.get(ind, 0) + sub.num_rows
+            report(raw.tell(), sum(rows.values()))
+        report(path.stat().st_size, sum(rows.values()), force=True)
+    for w in writers.values():
+        w.close()
+    return rows
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@instrument.timed("uis_bulk")
+def main(
+    path: Path,
+    block_mb: int = BLOCK_MB,
+    progress: float = 10.0,
+    base: Path | None = None,
+) -> coverage_cube.CoverageCube | None:
+    """Replace the dataset partitions of every indicator found in the export."""
+    indicators = unesco_indicators()
+    staging = STAGING.with_name(f"{STAGING.name}.{os.getpid()}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    reports: dict[str, dict | None] = {}
+    interim = settings.data_dir / "interim"
+    bulk = harmonize.load_manifest(interim, harmonize.BULK_MANIFEST)
+    st, written = path.stat(), []
+    try:
+        with instrument.step("uis_bulk.stream") as s:
+            rows = stream(path, staging, indicators, block_mb, progress)
+            s.rows_out = sum(rows.values())
+        for i in indicators:
+            if i.indicator_id not in rows:
+                logger.warning(f"{i.indicator_id} ({i.code}) not in {path}")
+        for ind, n in sorted(rows.items()):
+            with instrument.step(f"uis_bulk.write:{ind}", n) as s:
+                table = schema.cast_table(pq.read_table(staging / f"{ind}.parquet"))
+                try:
+                    reports[ind] = validate.run(table, ind)
+                except validate.ValidationError as e:
+                    reports[ind] = e.result
+                    raise
+                s.rows_out = store.write_indicator(table, ind, base)
+                del table
+            bulk[ind] = {
+                "input": str(path),
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "value_dtype": schema.VALUE_DTYPE.name,
+            }
+            written.append(ind)
+            logger.success(f"Wrote {store.indicator_dir(ind, base)} with {n:,} rows")
+    finally:
+        if base is None and reports:
+            validate.save_report(reports)
+        if base is None and written:
+            harmonize.save_manifest(interim, bulk, harmonize.BULK_MANIFEST)
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"Peak RSS {peak_rss_mb():.0f} MB")
+    if not rows or base is not None:
+        return None
+    return harmonize.write_coverage()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the UIS bulk SDMX-CSV export")
+    parser.add_argument("path", type=Path, help=".csv, .csv.gz or .zip")
+    parser.add_argument(
+        "--block-mb", type=int, default=BLOCK_MB, help="CSV block read at a time"
+    )
+    parser.add_argument(
+        "--progress", type=float, default=10.0, help="seconds between progress lines"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="record timings/memory per step"
+    )
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+    main(args.path, args.block_mb, args.progress)
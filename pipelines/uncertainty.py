@@ -0,0 +1,269 @@
+# pipelines/uncertainty.py
+"""Monte Carlo uncertainty bands for the inequity index.
+
+Every draw perturbs the index of all country-years at once, in two ways:
+
+- the buckets present in a row are resampled with a Bayesian bootstrap
+  (Dirichlet(1, ..., 1) multipliers on their weights), so a country-year
+  resting on two buckets moves more than one resting on six;
+- each bucket score gets Gaussian noise with an sd set by how the values
+  behind it were obtained (obs_status / is_imputed, see STATUS_SD), and is
+  clipped back to [0, 1], or to the range of all scores where that is wider
+  (scores scaled on --reference years can lie outside [0, 1]; clipping them
+  to it would pull the band away from the index).
+
+Draws are generated chunk × rows × buckets at a time. Per row the running
+moments, a histogram of the index over that clipping range and a histogram
+of its rank within the year (1 = highest index) are accumulated, and the
+intervals are read from the histograms. Blocks of draws can run in a process
+pool; every block has its own seed (SeedSequence.spawn), so results do not
+depend on the number of workers.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import instrument
+import numpy as np
+import pandas as pd
+import store
+from build_index import (
+    KEYS,
+    SDG_ERA,
+    bucket_indicators,
+    bucket_weights,
+    index_inputs,
+    parse_years,
+    weighted_index,
+)
+from config import settings
+from loguru import logger
+from sensitivity import hist_bins, hist_quantiles, ranks_within_year
+
+OUT = settings.data_dir / "interim" / "index_uncertainty.parquet"
+BLOCK = 2048  # draws per process-pool task
+BINS = 1000  # index histogram resolution
+
+# sd of the noise on a bucket score (normalized units), by SDMX OBS_STATUS
+STATUS_SD = {"A": 0.02, "P": 0.04, "E": 0.05, "F": 0.08, "I": 0.10}
+DEFAULT_SD = 0.02  # no status: a normal observation
+IMPUTED_SD = 0.10
+
+
+def noise_sd(rows: pd.MultiIndex, buckets: list[str]) -> np.ndarray:
+    """rows × buckets noise sd: the mean over the dataset rows behind a cell."""
+    bucket_of = {ind: b for b, inds in bucket_indicators().items() for ind in inds}
+    df = store.scan(
+        columns=[*KEYS, "indicator_id", "obs_status", "is_imputed"],
+        indicators=list(bucket_of),
+        years=SDG_ERA,
+    )
+    sd = df["obs_status"].astype(object).map(STATUS_SD).astype(float)
+    sd = np.where(df["is_imputed"].to_numpy(dtype=bool), IMPUTED_SD, sd)
+    df = df[KEYS].assign(
+        bucket=df["indicator_id"].astype(object).map(bucket_of),
+        sd=np.where(np.isnan(sd), DEFAULT_SD, sd),
+    )
+    cell = df.groupby([*KEYS, "bucket"], observed=True)["sd"].mean()
+
+    out = np.full((len(rows), len(buckets)), DEFAULT_SD)
+    r = rows.get_indexer(cell.index.droplevel("bucket"))
+    c = pd.Index(buckets).get_indexer(cell.index.get_level_values("bucket"))
+    ok = (r >= 0) & (c >= 0)
+    out[r[ok], c[ok]] = cell.to_numpy()[ok]
+    return out
+
+
+def rank_quantiles(hist: np.ndarray, qs) -> np.ndarray:
+    """Quantiles (rows × len(qs)) of integer ranks from per-row rank histograms."""
+    cum = hist.cumsum(axis=1)
+    n = cum[:, -1]
+    return np.stack(
+        [(cum >= np.ceil(q * n)[:, None]).argmax(axis=1) + 1 for q in qs], axis=1
+    )
+
+
+def clip_range(scores: np.ndarray, mask: np.ndarray) -> tuple[float, float]:
+    """Bounds a noisy score is clipped to, so also the range of the index."""
+    present = scores[mask]
+    if not present.size:
+        return 0.0, 1.0
+    return min(0.0, float(present.min())), max(1.0, float(present.max()))
+
+
+def _draw_block(
+    scores: np.ndarray,
+    mask: np.ndarray,
+    sd: np.ndarray,
+    weights: np.ndarray,
+    year_slices: list[slice],
+    max_rank: int,
+    draws: int,
+    seed: np.random.SeedSequence,
+    chunk_size: int = 256,
+) -> dict[str, np.ndarray]:
+    """Accumulators over `draws` draws; rows must be grouped by year."""
+    rng = np.random.default_rng(seed)
+    n_rows, n_buckets = scores.shape
+    base_w = np.where(mask, weights, 0.0)
+    offsets = np.arange(n_rows)[:, None]
+    lo, hi = clip_range(scores, mask)
+    lo_rows, hi_rows = np.full(n_rows, lo), np.full(n_rows, hi)
+    acc = {
+        "s1": np.zeros(n_rows),
+        "s2": np.zeros(n_rows),
+        "hist": np.zeros((n_rows, BINS), dtype=np.int64),
+        "rank_hist": np.zeros((n_rows, max_rank), dtype=np.int64),
+    }
+    for start in range(0, draws, chunk_size):
+        shape = (min(chunk_size, draws - start), n_rows, n_buckets)
+        w = base_w * rng.standard_exponential(shape)
+        x = np.clip(scores + sd * rng.standard_normal(shape), lo, hi)
+        idx = ((w * x).sum(axis=2) / w.sum(axis=2)).T  # rows × chunk
+
+        acc["s1"] += idx.sum(axis=1)
+        acc["s2"] += (idx * idx).sum(axis=1)
+        b = hist_bins(idx, lo_rows, hi_rows, BINS)
+        acc["hist"] += np.bincount(
+            (offsets * BINS + b).ravel(), minlength=n_rows * BINS
+        ).reshape(n_rows, BINS)
+        ranks = ranks_within_year(idx, year_slices).astype(np.int64)
+        acc["rank_hist"] += np.bincount(
+            (offsets * max_rank + ranks - 1).ravel(), minlength=n_rows * max_rank
+        ).reshape(n_rows, max_rank)
+    return acc
+
+
+def simulate(
+    scores: np.ndarray,
+    mask: np.ndarray,
+    sd: np.ndarray,
+    years: np.ndarray,
+    weights: np.ndarray,
+    draws: int = 10_000,
+    level: float = 0.9,
+    seed: int = 0,
+    chunk_size: int = 256,
+    workers: int | None = None,
+) -> dict[str, np.ndarray]:
+    """Per-row interval statistics of the index and its rank over `draws` draws.
+
+    scores/mask/sd are rows × buckets (rows already coverage-filtered) and
+    years the year of each row; workers > 1 spreads blocks of draws over a
+    process pool.
+    """
+    n_rows = scores.shape[0]
+    perm = np.argsort(years, kind="stable")  # each year one contiguous slice
+    _, starts, counts = np.unique(years[perm], return_index=True, return_counts=True)
+    year_slices = [slice(s, s + n) for s, n in zip(starts, counts, strict=True)]
+    max_rank = int(counts.max())
+
+    blocks = [min(BLOCK, draws - i) for i in range(0, draws, BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+    run_block = partial(
+        _draw_block,
+        scores[perm],
+        mask[perm],
+        sd[perm],
+        weights,
+        year_slices,
+        max_rank,
+        chunk_size=chunk_size,
+    )
+    if workers and workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(run_block, blocks, seeds))
+    else:
+        parts = [run_block(n, s) for n, s in zip(blocks, seeds, strict=True)]
+    acc = {k: sum(p[k] for p in parts) for k in parts[0]}
+
+    base_idx, _ = weighted_index(scores[perm], mask[perm], weights)
+    base_rank = ranks_within_year(base_idx[:, None], year_slices)[:, 0]
+    mean = acc["s1"] / draws
+    std = np.sqrt(np.maximum(acc["s2"] / draws - mean**2, 0.0))
+    tail = (1 - level) / 2
+    qs = (tail, 0.5, 1 - tail)
+    iq = hist_quantiles(
+        acc["hist"], np.full(n_rows, draws), qs, *clip_range(scores, mask)
+    )
+    rq = rank_quantiles(acc["rank_hist"], qs)
+
+    inv = np.argsort(perm)  # back to the caller's row order
+    return {
+        "index_mean": mean[inv],
+        "index_std": std[inv],
+        "index_lo": iq[inv, 0],
+        "index_median": iq[inv, 1],
+        "index_hi": iq[inv, 2],
+        "rank": base_rank[inv].astype(np.int64),
+        "rank_lo": rq[inv, 0],
+        "rank_median": rq[inv, 1],
+        "rank_hi": rq[inv, 2],
+    }
+
+
+@instrument.timed("uncertainty")
+def run(
+    draws: int = 10_000,
+    level: float = 0.9,
+    seed: int = 0,
+    chunk_size: int = 256,
+    workers: int | None = None,
+    reference: tuple[int, int] | None = None,
+) -> pd.DataFrame | None:
+    """Intervals for every country-year of the index (None if there is none)."""
+    inputs = index_inputs(reference=reference)
+    if inputs is None:
+        return None
+    rows, buckets, scores, mask = inputs
+    weights = bucket_weights(buckets)
+    index, keep = weighted_index(scores, mask, weights)
+    rows, scores, mask = rows[keep], scores[keep], mask[keep]
+    logger.info(f"{draws:,} draws over {len(rows):,} country-years")
+
+    stats = simulate(
+        scores,
+        mask,
+        noise_sd(rows, buckets),
+        rows.get_level_values("year").to_numpy(dtype=np.int64),
+        weights,
+        draws=draws,
+        level=level,
+        seed=seed,
+        chunk_size=chunk_size,
+        workers=workers,
+    )
+    out = rows.to_frame(index=False)
+    out["inequity_index"] = index[keep]
+    for name, values in stats.items():
+        out[name] = values
+    out["n_buckets"] = mask.sum(axis=1)
+    out["level"] = level
+    return out
+
+
+def main(draws: int = 10_000, **kwargs) -> pd.DataFrame | None:
+    out = run(draws, **kwargs)
+    if out is not None:
+        out.to_parquet(OUT, index=False)
+        logger.success(f"Wrote {OUT} with {len(out):,} rows")
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Uncertainty bands for the index")
+    parser.add_argument("--draws", type=int, default=10_000)
+    parser.add_argument("--level", type=float, default=0.9, help="interval coverage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("--reference", default=settings.index_reference)
+    args = parser.parse_args()
+    main(
+        args.draws,
+        level=args.level,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        reference=parse_years(args.reference),
+    )
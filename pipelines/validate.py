@@ -0,0 +1,143 @@
+# pipelines/validate.py
+"""Data-quality checks on a tidy indicator table, before it is written.
+
+Every check is one vectorized pass over the table's Arrow columns (no Python
+loop over rows), so validating costs a few percent of parsing the input:
+
+    duplicate  more than one row per (country_iso3, year, disagg_type,
+               disagg_value); a table holds a single indicator
+    range      value outside the indicator's valid_min / valid_max in
+               docs/indicators.csv (see registry.py)
+    year       year outside settings.valid_years (VALID_YEARS)
+
+harmonize and uis_bulk check each table they write. settings.validation
+(VALIDATION) decides what a failed check does: "warn" logs it and writes the
+table anyway, "fail" refuses the table and stops the run (fail-fast), "off"
+skips the checks. Failure counts and a few failing rows per check go to
+data/interim/validation.json, one entry per indicator.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import registry
+from config import settings
+from loguru import logger
+
+REPORT = settings.data_dir / "interim" / "validation.json"
+MODES = ("warn", "fail", "off")
+SAMPLE = 5  # failing rows kept per check
+KEY = ["country_iso3", "year", "disagg_type", "disagg_value"]
+SAMPLE_COLUMNS = [*KEY[:1], "country_name", *KEY[1:], "value"]
+
+
+class ValidationError(ValueError):
+    """A table failed its checks with settings.validation == "fail"."""
+
+    def __init__(self, message: str, result: dict):
+        super().__init__(message, result)
+        self.result = result
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def mode() -> str:
+    if settings.validation not in MODES:
+        raise ValueError(f"VALIDATION must be one of {MODES}: {settings.validation}")
+    return settings.validation
+
+
+def _years() -> tuple[int, int]:
+    first, _, last = settings.valid_years.partition("-")
+    return int(first), int(last or first)
+
+
+def _codes(col: pa.ChunkedArray) -> np.ndarray:
+    """Non-negative integer code per row of a dictionary or integer column;
+    nulls get a code of their own."""
+    if pa.types.is_dictionary(col.type):
+        col = pa.table({"c": col}).unify_dictionaries()["c"].combine_chunks().indices
+    else:
+        col = col.combine_chunks()
+    codes = pc.fill_null(col, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+    return codes - codes.min() if len(codes) else codes
+
+
+def duplicates(table: pa.Table) -> np.ndarray:
+    """Rows whose KEY occurs more than once (rows without an ISO3 code or a
+    year are not countries and are left out)."""
+    codes = [_codes(table[c]) for c in KEY]
+    key = np.ravel_multi_index(codes, [int(c.max()) + 1 for c in codes])
+    _, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+    valid = pc.and_(pc.is_valid(table["country_iso3"]), pc.is_valid(table["year"]))
+    return (counts[inverse] > 1) & valid.to_numpy(zero_copy_only=False)
+
+
+def _outside(col: pa.ChunkedArray, lo: float | None, hi: float | None):
+    out = None
+    if lo is not None:
+        out = pc.less(col, lo)
+    if hi is not None:
+        above = pc.greater(col, hi)
+        out = above if out is None else pc.or_(out, above)
+    return None if out is None else pc.fill_null(out, False)
+
+
+def _sample(table: pa.Table, mask) -> list[dict]:
+    rows = table.filter(pa.array(mask)).select(SAMPLE_COLUMNS).slice(0, SAMPLE)
+    return rows.to_pylist()
+
+
+def check(table: pa.Table, indicator_id: str) -> dict:
+    """{"rows": n, "failed": {check: {"rows": k, "sample": [...]}}} of a
+    table cast to schema.ARROW_SCHEMA; "failed" only lists failed checks."""
+    ind = {i.indicator_id: i for i in registry.load()}.get(indicator_id)
+    bounds = (ind.valid_min, ind.valid_max) if ind else (None, None)
+    masks = {
+        "duplicate": duplicates(table) if table.num_rows else None,
+        "range": _outside(table["value"], *bounds),
+        "year": _outside(table["year"], *_years()),
+    }
+    failed = {}
+    for name, mask in masks.items():
+        n = 0 if mask is None else int(np.count_nonzero(mask))
+        if n:
+            failed[name] = {"rows": n, "sample": _sample(table, mask)}
+    return {"rows": table.num_rows, "failed": failed}
+
+
+def run(table: pa.Table, indicator_id: str) -> dict | None:
+    """check() per settings.validation: None when off; logs failed checks and
+    raises ValidationError in fail mode."""
+    if mode() == "off":
+        return None
+    result = check(table, indicator_id)
+    for name, f in result["failed"].items():
+        logger.warning(
+            f"{indicator_id}: {f['rows']:,} of {result['rows']:,} rows fail the "
+            f"{name} check, e.g. {f['sample'][0]}"
+        )
+    if result["failed"] and mode() == "fail":
+        raise ValidationError(
+            f"{indicator_id} failed {', '.join(result['failed'])} checks", result
+        )
+    return result
+
+
+def save_report(results: dict[str, dict | None], path: Path = REPORT) -> Path:
+    """Merge per-indicator results into the report (None drops an entry)."""
+    report = json.loads(path.read_text()) if path.exists() else {}
+    for ind, result in results.items():
+        if result is None:
+            report.pop(ind, None)
+        else:
+            report[ind] = result
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(report, indent=1, sort_keys=True, default=str))
+    tmp.replace(path)
+    return path
@@ -0,0 +1,24 @@
+# tests/conftest.py
+"""The pipelines (and benchmarks) are flat scripts importing each other by name."""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / d) for d in ("pipelines", "app", "benchmarks")]
+
+
+@pytest.fixture(autouse=True, scope="session")
+def data_dir(tmp_path_factory):
+    """Point the data lake, and the caches placed under it at import, at a tmp dir."""
+    import countries
+    import excel_cache
+    from config import settings
+
+    data = tmp_path_factory.mktemp("data")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "data_dir", data)
+        mp.setattr(countries, "CACHE_DIR", data / "cache")
+        mp.setattr(excel_cache, "CACHE_DIR", data / "cache" / "excel")
+        yield data
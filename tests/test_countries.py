@@ -0,0 +1,42 @@
+# tests/test_countries.py
+from concurrent.futures import ThreadPoolExecutor
+
+import countries
+import pandas as pd
+import pytest
+from loguru import logger
+
+
+@pytest.fixture
+def fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(countries, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(countries, "_lookup", None)
+    monkeypatch.setattr(countries, "_warned", set())
+    return tmp_path
+
+
+def test_aggregates_and_unknowns_are_not_countries(fresh):
+    messages = []
+    sink = logger.add(messages.append, level="WARNING")
+    try:
+        values = pd.Series(["Kenya", "World", "AFE", "Republic of Utopia", None])
+        iso3 = countries.to_iso3(values)
+        countries.to_iso3(values)  # logged once
+    finally:
+        logger.remove(sink)
+    assert list(iso3.fillna("-")) == ["KEN", "-", "-", "-", "-"]
+    assert len(messages) == 1 and "Republic of Utopia" in messages[0]
+    assert "World" not in messages[0]
+    saved = pd.read_parquet(countries._table_path()).set_index("key")
+    assert saved.loc["World", "is_aggregate"]
+    assert not saved.loc["Republic of Utopia", "is_aggregate"]
+
+
+def test_concurrent_new_keys(fresh):
+    batches = [pd.Series([f"Utopia {i}-{j}" for j in range(20)]) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(countries.to_iso3, batches))
+    assert all(r.isna().all() for r in results)
+    saved = pd.read_parquet(countries._table_path())
+    assert set(saved["key"]) >= {k for b in batches for k in b}
+    assert [p.name for p in fresh.iterdir()] == [countries._table_path().name]
@@ -0,0 +1,28 @@
+# tests/test_data_views.py
+import arrow_io
+import pandas as pd
+import pandas.testing as pdt
+from data_views import arrow_year_slice, arrow_years, year_slices
+from export_for_tableau import export_index
+
+
+def test_arrow_and_parquet_slices_agree(tmp_path):
+    index = pd.DataFrame(
+        {
+            "country_iso3": ["KEN", "UGA", "TZA", "KEN", "UGA"],
+            "country_name": ["Kenya", "Uganda", "Tanzania", "Kenya", "Uganda"],
+            "year": [2020, 2020, 2020, 2021, 2021],
+            "inequity_index": [0.123456, 0.654321, 0.5, 0.2001, 0.19995],
+        }
+    )
+    exported = export_index(index)["inequity_index"]
+    parquet = tmp_path / "inequity_index.parquet"
+    exported.to_parquet(parquet, index=False)
+    arrow = arrow_io.write(exported, tmp_path / "i.arrow", year="Year")
+
+    slices = year_slices(str(parquet))
+    assert arrow_years(str(arrow)) == sorted(slices) == [2020, 2021]
+    for year, d in slices.items():
+        pdt.assert_frame_equal(
+            arrow_year_slice(str(arrow), year)[list(d.columns)], d, check_dtype=False
+        )
@@ -0,0 +1,16 @@
+# tests/test_excel_cache.py
+import excel_cache
+import pandas as pd
+
+
+def test_sidecar_is_keyed_on_the_parser(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_cache, "CACHE_DIR", tmp_path / "cache")
+    path = tmp_path / "SDG_4.x.xlsx"
+    pd.DataFrame({"COUNTRY": ["Kenya"], "2019": [81.5]}).to_excel(path, index=False)
+
+    first = excel_cache.sidecar(path)
+    assert excel_cache.sidecar(path) == first
+    monkeypatch.setattr(excel_cache, "_engine", lambda: ("pandas", pd.__version__))
+    second = excel_cache.sidecar(path)
+    assert second != first and second.name.endswith(f".pandas-{pd.__version__}.parquet")
+    assert list(excel_cache.read_excel_cached(path)["COUNTRY"]) == ["Kenya"]
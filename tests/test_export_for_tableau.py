@@ -0,0 +1,21 @@
+# tests/test_export_for_tableau.py
+import export_for_tableau as export
+import pandas as pd
+
+
+def test_remove_stale_drops_tables_not_exported(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "OUT", tmp_path)
+    monkeypatch.setattr(export, "PARQUET_OUT", tmp_path / "parquet")
+    monkeypatch.setattr(export, "ARROW_OUT", tmp_path / "arrow")
+    (tmp_path / "parquet").mkdir()
+    old = [
+        tmp_path / "inequity_index_intervals.csv",
+        tmp_path / "parquet" / "inequity_index_intervals.parquet",
+        tmp_path / "inequity_index_disagg.csv",
+        tmp_path / "inequity_index.csv",
+    ]
+    for p in old:
+        p.write_text("stale")
+
+    export.remove_stale({"inequity_index_disagg": pd.DataFrame()})
+    assert [p.exists() for p in old] == [False, False, True, True]
@@ -0,0 +1,46 @@
+# tests/test_gapfill.py
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import schema
+import validate
+from gapfill import fill_indicator, unfill
+
+
+def _rows() -> pd.DataFrame:
+    # KEN: 2016 has an empty row, 2017 has no row at all
+    df = pd.DataFrame(
+        {
+            "country_iso3": ["KEN"] * 4,
+            "country_name": ["Kenya"] * 4,
+            "year": [2015, 2016, 2018, 2019],
+            "indicator_id": ["X"] * 4,
+            "value": [1.0, np.nan, 4.0, 5.0],
+            "unit": ["percent"] * 4,
+            "source": ["UNESCO"] * 4,
+            "is_imputed": [False] * 4,
+        }
+    )
+    return schema.to_pandas(schema.cast_table(pa.Table.from_pandas(df)))
+
+
+def test_fills_empty_rows_in_place():
+    out, counts = fill_indicator(_rows(), ["interpolate"])
+    assert counts == {"interpolate": 2}
+    out = out.sort_values("year").reset_index(drop=True)
+    assert list(out["year"]) == [2015, 2016, 2017, 2018, 2019]
+    assert list(out["value"]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert list(out["is_imputed"]) == [False, True, True, False, False]
+    assert pd.isna(out["obs_status"].iloc[1])  # the row harmonize wrote
+    assert out["obs_status"].iloc[2] == schema.GAPFILL_STATUS
+    table = schema.cast_table(pa.Table.from_pandas(out, preserve_index=False))
+    assert not validate.duplicates(table).any()
+
+
+def test_unfill_restores_the_rows():
+    before = _rows()
+    out, _ = fill_indicator(before.copy(), ["interpolate", "locf"])
+    again, _ = fill_indicator(out, ["interpolate", "locf"])
+    assert again.equals(out)  # idempotent
+    restored = unfill(out).sort_values("year").reset_index(drop=True)
+    pd.testing.assert_frame_equal(restored, before, check_categorical=False)
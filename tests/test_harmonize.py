@@ -0,0 +1,66 @@
+# tests/test_harmonize.py
+import zipfile
+
+import pyarrow as pa
+import schema
+import store
+from harmonize import tidy_wb_zip, tidy_wb_zip_arrow
+
+# World Bank API layout: preamble, wide years, ".." / blanks for missing and
+# a trailing comma on every line
+API_CSV = """\
+"Data Source","World Development Indicators",
+
+"Last Updated Date","2024-06-28",
+
+"Country Name","Country Code","Indicator Name","Indicator Code","2019","2020","2021",
+"Kenya","KEN","Completion rate","SE.PRM.CMPT.ZS","99.1234567890123","..","",
+"Uganda","UGA","Completion rate","SE.PRM.CMPT.ZS","","0.1","1e-3",
+"Sub-Saharan Africa","SSF","Completion rate","SE.PRM.CMPT.ZS","70","71.5","72",
+"""
+
+
+def _zip(tmp_path):
+    path = tmp_path / "wb_SE.PRM.CMPT.ZS.zip"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("API_SE.PRM.CMPT.ZS_DS2_en_csv_v2_1.csv", API_CSV)
+        z.writestr("Metadata_Country_API_SE.PRM.CMPT.ZS_DS2_en_csv_v2_1.csv", "x\n")
+    return path
+
+
+def _decoded(table: pa.Table) -> pa.Table:
+    # dictionary order may differ (first seen vs sorted); the values may not
+    return pa.table(
+        {
+            name: (
+                col.cast(col.type.value_type)
+                if pa.types.is_dictionary(col.type)
+                else col
+            )
+            for name, col in zip(table.column_names, table.columns, strict=True)
+        }
+    )
+
+
+def test_arrow_path_matches_pandas_path(tmp_path):
+    path = _zip(tmp_path)
+    legacy = tidy_wb_zip(path, "SE.PRM.CMPT.ZS", "percent")
+    fast = tidy_wb_zip_arrow(path, "SE.PRM.CMPT.ZS", "percent")
+
+    assert fast.num_rows == len(legacy) == 9
+    # what harmonize writes: the pandas frame goes through the same cast
+    expected = schema.cast_table(pa.Table.from_pandas(legacy, preserve_index=False))
+    assert fast.schema.equals(expected.schema, check_metadata=True)
+    assert _decoded(fast).equals(_decoded(expected))
+    assert schema.to_pandas(fast).equals(legacy)
+
+
+def test_arrow_path_writes_the_same_dataset(tmp_path):
+    path = _zip(tmp_path)
+    store.write_indicator(tidy_wb_zip(path, "X", "percent"), "X", tmp_path / "old")
+    store.write_indicator(
+        tidy_wb_zip_arrow(path, "X", "percent"), "X", tmp_path / "new"
+    )
+    old = store.scan(base=tmp_path / "old")
+    new = store.scan(base=tmp_path / "new")
+    assert len(new) == 9 and new.equals(old)
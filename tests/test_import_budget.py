@@ -0,0 +1,14 @@
+# tests/test_import_budget.py
+import os
+
+import import_budget
+import pytest
+
+# stretch the budgets on slow CI machines, as `import_budget.py --scale` does
+SCALE = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+
+
+@pytest.mark.parametrize("module", list(import_budget.BUDGET_MS))
+def test_import_budget(module):
+    ms, loaded = import_budget.measure(module, repeat=2)
+    assert import_budget.check(module, ms, loaded, SCALE) == []
@@ -0,0 +1,68 @@
+# tests/test_ingest_worldbank.py
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ingest_worldbank
+import pytest
+from config import settings
+
+BODY = b"PK\x05\x06" + bytes(18)  # an empty ZIP
+
+
+class Handler(BaseHTTPRequestHandler):
+    failures = {"FLAKY": 1}  # 503s to answer before a 200, per code
+    requests = []
+
+    def do_GET(self):  # noqa: N802
+        code = self.path.strip("/")
+        self.requests.append((code, self.headers.get("If-None-Match")))
+        if self.failures.get(code, 0) > 0:
+            self.failures[code] -= 1
+            self.send_response(503)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "data_dir", tmp_path)
+    monkeypatch.setattr(ingest_worldbank, "BACKOFF", 0.0)
+    monkeypatch.setattr(Handler, "failures", {"FLAKY": 1})
+    monkeypatch.setattr(Handler, "requests", [])
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/{{code}}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _status(results):
+    return {r["code"]: r["status"] for r in results}
+
+
+def test_etag_then_not_modified(server, tmp_path):
+    first = ingest_worldbank.download_indicators(["SE.A"], base_url=server)
+    assert _status(first) == {"SE.A": "downloaded"}
+    assert (tmp_path / "raw" / "wb_SE.A.zip").read_bytes() == BODY
+    assert ingest_worldbank.load_manifest(tmp_path / "raw")["SE.A"]["etag"] == '"v1"'
+
+    again = ingest_worldbank.download_indicators(["SE.A"], base_url=server)
+    assert _status(again) == {"SE.A": "unchanged"}
+    assert Handler.requests == [("SE.A", None), ("SE.A", '"v1"')]
+
+
+def test_server_error_is_retried_once(server, tmp_path):
+    results = ingest_worldbank.download_indicators(["FLAKY"], base_url=server)
+    assert _status(results) == {"FLAKY": "downloaded"}
+    assert Handler.requests == [("FLAKY", None), ("FLAKY", None)]  # one layer
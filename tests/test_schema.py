@@ -0,0 +1,55 @@
+# tests/test_schema.py
+import numpy as np
+import pandas as pd
+import schema
+import store
+
+
+def _plain(n_countries: int = 200, n_years: int = 50) -> pd.DataFrame:
+    """Tidy rows as the pipelines built them before schema.py: object strings,
+    int64 years, float64 values."""
+    n = n_countries * n_years
+    iso3 = np.array([f"C{i:03d}" for i in range(n_countries)], dtype=object)
+    return pd.DataFrame(
+        {
+            "country_iso3": np.repeat(iso3, n_years),
+            "country_name": np.repeat(iso3 + " country", n_years),
+            "year": np.tile(np.arange(1975, 1975 + n_years), n_countries),
+            "indicator_id": "SE.PRM.CMPT.ZS",
+            "value": np.linspace(0, 100, n),
+            "unit": "percent",
+            "source": "WorldBank",
+            "disagg_type": pd.Series([None] * n, dtype=object),
+            "disagg_value": pd.Series([None] * n, dtype=object),
+            "is_imputed": False,
+            "obs_status": pd.Series([None] * n, dtype=object),
+        }
+    )
+
+
+def test_cast_uses_compact_dtypes():
+    df = schema.cast(_plain())
+    for c in schema.CATEGORICAL:
+        assert isinstance(df[c].dtype, pd.CategoricalDtype), c
+    assert df["year"].dtype == schema.YEAR_DTYPE
+    assert df["value"].dtype == schema.VALUE_DTYPE
+
+
+def test_cast_shrinks_memory():
+    plain = _plain()
+    before = plain.memory_usage(deep=True).sum()
+    after = schema.cast(plain.copy()).memory_usage(deep=True).sum()
+    assert after < before / 10
+
+
+def test_scan_returns_compact_frames(tmp_path):
+    plain = _plain()
+    store.write_indicator(plain, "SE.PRM.CMPT.ZS", tmp_path)
+    df = store.scan(base=tmp_path)
+    assert len(df) == len(plain)
+    assert isinstance(df["country_iso3"].dtype, pd.CategoricalDtype)
+    assert df.memory_usage(deep=True).sum() < plain.memory_usage(deep=True).sum() / 10
+    # same values, only the types changed
+    got = df.sort_values(["country_iso3", "year"]).reset_index(drop=True)
+    assert list(got["country_iso3"].astype(object)) == list(plain["country_iso3"])
+    assert np.allclose(got["value"].astype("float64"), plain["value"], rtol=1e-6)
@@ -0,0 +1,29 @@
+# tests/test_sensitivity.py
+import numpy as np
+from sensitivity import dirichlet_weights, score_scenarios
+from uncertainty import simulate
+
+
+def _inputs():
+    # scores as --reference bounds can leave them: partly outside [0, 1]
+    rng = np.random.default_rng(1)
+    scores = rng.uniform(-0.3, 1.4, (40, 4))
+    mask = np.ones(scores.shape, dtype=bool)
+    return scores, mask, np.repeat([2015, 2016], 20)
+
+
+def test_quantiles_outside_unit_range():
+    scores, mask, years = _inputs()
+    weights = dirichlet_weights(4, 2000)
+    stats, _ = score_scenarios(scores, mask, years, weights, np.full(4, 0.25))
+    index = (scores @ weights.T) / weights.sum(axis=1)
+    for q in (5, 50, 95):
+        expected = np.quantile(index, q / 100, axis=1)
+        assert np.abs(stats[f"index_p{q:02d}"] - expected).max() < 0.01
+
+
+def test_uncertainty_band_holds_the_index():
+    scores, mask, years = _inputs()
+    stats = simulate(scores, mask, np.full(scores.shape, 0.02), years, np.full(4, 0.25))
+    index = scores.mean(axis=1)
+    assert (stats["index_lo"] <= index).all() and (index <= stats["index_hi"]).all()
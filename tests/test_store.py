@@ -0,0 +1,39 @@
+# tests/test_store.py
+import pandas as pd
+import schema
+import store
+
+
+def _rows(years) -> pd.DataFrame:
+    n = len(years)
+    return pd.DataFrame(
+        {
+            "country_iso3": ["KEN"] * n,
+            "country_name": ["Kenya"] * n,
+            "year": pd.array(years, dtype="Int64"),
+            "indicator_id": ["X"] * n,
+            "value": [1.0] * n,
+        }
+    )
+
+
+def test_write_indicator_partitions_by_year(tmp_path):
+    assert store.write_indicator(_rows([2016, 2015, 2016]), "X", tmp_path) == 3
+    parts = sorted(p.name for p in store.indicator_dir("X", tmp_path).iterdir())
+    assert parts == ["year=2015", "year=2016"]
+
+
+def test_write_indicator_without_years_replaces_with_empty(tmp_path):
+    store.write_indicator(_rows([2015]), "X", tmp_path)
+    for df in (schema.empty(), _rows([None, None])):
+        assert store.write_indicator(df, "X", tmp_path) == 0
+        target = store.indicator_dir("X", tmp_path)
+        assert target.is_dir() and not any(target.iterdir())
+
+
+def test_write_indicator_swaps_the_old_copy_out(tmp_path):
+    store.write_indicator(_rows([2015, 2016]), "X", tmp_path)
+    store.write_indicator(_rows([2017]), "X", tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == ["indicator_id=X"]  # no leftovers
+    parts = [p.name for p in store.indicator_dir("X", tmp_path).iterdir()]
+    assert parts == ["year=2017"]
@@ -0,0 +1,32 @@
+# tests/test_tidy_unesco.py
+from tidy_unesco import tidy_unesco_file
+
+
+def test_location_as_country_code_is_not_a_disaggregation(tmp_path):
+    # OECD-style UIS file: LOCATION holds the ISO3 code, not urban/rural
+    path = tmp_path / "SDG_4.x.csv"
+    path.write_text(
+        "LOCATION,LOCATION_NAME,TIME_PERIOD,Value\n"
+        "KEN,Kenya,2019,81.5\n"
+        "UGA,Uganda,2018,70.25\n"
+    )
+    out = tidy_unesco_file(path, "SDG_4.x", "percent")
+    assert list(out["country_iso3"]) == ["KEN", "UGA"]
+    assert list(out["year"]) == [2019, 2018]
+    assert list(out["value"]) == [81.5, 70.25]
+    assert list(out["country_name"]) == ["Kenya", "Uganda"]
+    assert out["disagg_type"].isna().all()
+    assert out["disagg_value"].isna().all()
+
+
+def test_sex_column_is_a_disaggregation(tmp_path):
+    path = tmp_path / "SDG_4.y.csv"
+    path.write_text(
+        "COUNTRY,REF_AREA,TIME_PERIOD,SEX,OBS_VALUE\n"
+        "Kenya,KEN,2019,_T,80\n"
+        "Kenya,KEN,2019,F,82\n"
+    )
+    out = tidy_unesco_file(path, "SDG_4.y", "percent")
+    assert list(out["year"]) == [2019, 2019]
+    assert out["disagg_type"].isna().iloc[0]
+    assert (out["disagg_type"].iloc[1], out["disagg_value"].iloc[1]) == ("sex", "F")